@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Local mock of the DeepSeek chat-completions endpoint for benchmarking
+
+Usage:
+    python benchmarks/mock_deepseek_server.py --port 8000 --latency lognormal:0.05:0.5 --rate-limit-rate 0.05
+
+then point the generator at it with --api-url http://127.0.0.1:8000/v1/chat/completions
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Same distribution specs and batch-prompt detection as the generator's simulated backend
+from music_review_generator import batch_entry_numbers, parse_distribution  # noqa: E402
+
+REVIEW_PARAGRAPH = "这张专辑的旋律与编曲相得益彰，人声在克制与爆发之间游走，让人一听再听。"
+
+
+class MockDeepSeekServer:
+    """Threaded HTTP server imitating the chat-completions API
+
+    Requests are answered after a sampled latency; a configurable share of them
+    is rejected with 429 (with Retry-After) or 5xx. Streaming requests are
+    answered as server-sent events. Batched prompts (asking for a JSON array)
+    get one review per 序号.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency='lognormal:0.05:0.5', rate_limit_rate=0.0,
+                 server_error_rate=0.0, retry_after=1, review_chars=400, think_chars=200,
+                 chunk_chars=8, seed=None):
+        self.sample_latency = parse_distribution(latency)
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.retry_after = retry_after
+        self.review_chars = review_chars
+        self.think_chars = think_chars
+        self.chunk_chars = chunk_chars
+        self.rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.stats = {'requests': 0, 'ok': 0, 'rate_limited': 0, 'server_errors': 0, 'streamed': 0}
+        self._stats_lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _draw(self):
+        """Decide the outcome and latency of one request"""
+        with self._rng_lock:
+            roll = self.rng.random()
+            latency = self.sample_latency(self.rng)
+        if roll < self.rate_limit_rate:
+            return 'rate_limited', latency
+        if roll < self.rate_limit_rate + self.server_error_rate:
+            return 'server_error', latency
+        return 'ok', latency
+
+    def _review_text(self, title):
+        # Whole sentences only, so the review passes the generator's truncation check
+        body = REVIEW_PARAGRAPH * max(1, round(self.review_chars / len(REVIEW_PARAGRAPH)))
+        return f"# 【乐评】{title}\n\n{body}\n\n#音乐分享 #乐评"
+
+    def _content_for(self, prompt):
+        think = f"<think>{'思' * self.think_chars}</think>\n\n" if self.think_chars else ""
+        numbers = batch_entry_numbers(prompt)
+        if numbers:
+            items = [{"序号": number, "review": self._review_text(number)} for number in numbers]
+            return think + json.dumps(items, ensure_ascii=False)
+        title = re.search(r'^歌曲名: (.+)$', prompt, flags=re.MULTILINE)
+        return think + self._review_text(title.group(1) if title else "未知作品")
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=None):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_chunk(self, data):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                try:
+                    request = json.loads(self.rfile.read(length) or b'{}')
+                    prompt = request['messages'][-1]['content']
+                except (ValueError, KeyError, IndexError, TypeError):
+                    self._send_json(400, {"error": "invalid request"})
+                    return
+
+                server._count('requests')
+                outcome, latency = server._draw()
+                if outcome == 'rate_limited':
+                    server._count('rate_limited')
+                    self._send_json(429, {"error": "rate limited"}, {'Retry-After': str(server.retry_after)})
+                    return
+                if outcome == 'server_error':
+                    server._count('server_errors')
+                    self._send_json(503, {"error": "upstream unavailable"})
+                    return
+
+                content = server._content_for(prompt)
+                usage = {
+                    "prompt_tokens": len(prompt),
+                    "completion_tokens": len(content),
+                    "total_tokens": len(prompt) + len(content)
+                }
+                server._count('ok')
+
+                if not request.get('stream'):
+                    time.sleep(latency)
+                    self._send_json(200, {
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                        "usage": usage
+                    })
+                    return
+
+                # Streamed: spread the latency over the chunks
+                server._count('streamed')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                pieces = [content[i:i + server.chunk_chars] for i in range(0, len(content), server.chunk_chars)]
+                delay = latency / max(1, len(pieces))
+                for piece in pieces:
+                    time.sleep(delay)
+                    event = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+                    self._send_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode('utf-8'))
+                final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+                self._send_chunk(f"data: {json.dumps(final)}\n\n".encode('utf-8'))
+                self._send_chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DeepSeek chat-completions mock server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", default="lognormal:0.05:0.5",
+                        help="latency distribution, e.g. fixed:0.05, uniform:0.01:0.2, lognormal:0.05:0.5")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After seconds sent with 429")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = MockDeepSeekServer(
+        args.host, args.port, args.latency, args.rate_limit_rate, args.server_error_rate,
+        args.retry_after, seed=args.seed
+    )
+    print(f"Mock DeepSeek server listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Scaling benchmark of the multi-process `reprocess` stage on a synthetic corpus
+
+Writes N review files with the defects reprocess cleans up (leftover reasoning,
+trailing whitespace, blank-line runs, duplicated tags), then times
+reprocess_reviews at each worker count without writing back, so every run sees
+the same input. Reports files/sec, speedup over one worker and parallel
+efficiency:
+
+    python benchmarks/reprocess_scaling.py --files 100000
+    python benchmarks/reprocess_scaling.py --files 20000 --workers 1 2 4 8 --chunk-size 512
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import music_review_generator as mrg  # noqa: E402
+
+GENRES = ['流行', '摇滚', '民谣', '爵士', '电子', '说唱']
+PARAGRAPH = "这张专辑的旋律与编曲相得益彰，人声在克制与爆发之间游走，让人一听再听。"
+
+
+def write_corpus(directory, files):
+    """Write `files` synthetic reviews, spread over shard subdirectories like a large output directory"""
+    for i in range(files):
+        shard = os.path.join(directory, f"{i % 256:02x}")
+        if i < 256:
+            os.makedirs(shard, exist_ok=True)
+        music_info = {
+            '序号': str(i), '歌曲名': f"Synthetic Album {i:06d}", '表演者': f"Artist {i % 997}",
+            '发行时间': f"{1970 + i % 50}-01-01", '流派': GENRES[i % len(GENRES)], '专辑类型': '专辑',
+            '介质': 'CD', '评分': f"{7 + (i % 30) / 10:.1f}"
+        }
+        body = (f"<think>{'思' * 200}</think>\n\n# 【乐评】Synthetic Album {i:06d}   \n\n\n\n"
+                + "\n\n".join([PARAGRAPH * 4] * 3) + "  \n\n#音乐分享 #乐评 #音乐分享")
+        with open(os.path.join(shard, f"album-{i:06d}.md"), 'w', encoding='utf-8') as f:
+            f.write(mrg.render_review_markdown(music_info, body))
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    default_workers = sorted({1} | {2 ** k for k in range(1, 8) if 2 ** k <= cpus} | {cpus})
+    parser = argparse.ArgumentParser(description="reprocess scaling benchmark")
+    parser.add_argument("--files", type=int, default=100000, help="synthetic corpus size")
+    parser.add_argument("--workers", type=int, nargs='+', default=default_workers,
+                        help=f"worker counts to run (default: {' '.join(map(str, default_workers))})")
+    parser.add_argument("--chunk-size", type=int, default=mrg.REPROCESS_CHUNK_SIZE)
+    parser.add_argument("--rerender", action="store_true", help="also re-render every header")
+    parser.add_argument("--output", default=None,
+                        help="results JSON path (default: benchmarks/results/reprocess-<time>.json)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    cases = []
+    with tempfile.TemporaryDirectory(prefix="reprocess-bench-") as corpus:
+        started = time.perf_counter()
+        write_corpus(corpus, args.files)
+        print(f"Wrote {args.files} reviews in {time.perf_counter() - started:.1f}s")
+        # Warm the page cache so the first case is not penalised
+        mrg.list_review_files([corpus])
+
+        baseline = None
+        for workers in args.workers:
+            summary = mrg.reprocess_reviews([corpus], workers=workers, chunk_size=args.chunk_size,
+                                            rerender=args.rerender, write=False)
+            baseline = baseline or summary['files_per_s']
+            speedup = summary['files_per_s'] / baseline if baseline else None
+            case = {
+                'workers': workers,
+                'files': summary['files'],
+                'changed': summary['changed'],
+                'elapsed_s': summary['elapsed_s'],
+                'files_per_s': summary['files_per_s'],
+                'speedup': round(speedup, 2) if speedup else None,
+                'efficiency': round(speedup / workers, 2) if speedup else None
+            }
+            print(json.dumps(case))
+            cases.append(case)
+
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results", time.strftime("reprocess-%Y%m%d-%H%M%S.json")
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    config = dict(vars(args), cpus=cpus)
+    config.pop('output')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'config': config, 'cases': cases}, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {output}")
+    if cpus < max(args.workers):
+        print(f"Note: only {cpus} CPU(s) available; worker counts above that cannot scale")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""End-to-end throughput benchmark of the review pipeline against a local mock server
+
+Runs the full process_file_cli pipeline (HTTP, rate limiting, retries and file
+I/O) over synthetic catalogues and reports reviews/sec, latency percentiles,
+retries and peak RSS. Results are written as JSON so runs can be compared:
+
+    python benchmarks/run_benchmark.py --rows 25 1000 --concurrency 8
+    python benchmarks/run_benchmark.py --rows 1000 --baseline benchmarks/results/previous.json
+    python benchmarks/run_benchmark.py --rows 1000 --endpoint-error-rates 0 0.5   # failover across two mocks
+    python benchmarks/run_benchmark.py --rows 1000 --backend simulated --seed 7    # in-process, no sockets
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import music_review_generator as mrg  # noqa: E402
+from mock_deepseek_server import MockDeepSeekServer  # noqa: E402
+
+GENRES = ['流行', '摇滚', '民谣', '爵士', '电子', '说唱']
+
+
+def write_synthetic_table(path, rows):
+    """Write a Douban-style markdown table with `rows` distinct entries"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("# 合成数据\n\n")
+        f.write("| 序号 | 歌曲名 | 表演者 | 发行时间 | 流派 | 专辑类型 | 介质 | 评分 |\n")
+        f.write("| --- | --- | --- | --- | --- | --- | --- | --- |\n")
+        for i in range(1, rows + 1):
+            f.write(f"| {i} | Synthetic Album {i:06d} | Artist {i % 997} | {1970 + i % 50}-01-01 | "
+                    f"{GENRES[i % len(GENRES)]} | 专辑 | CD | {7 + (i % 30) / 10:.1f} |\n")
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def run_simulated_case(rows, args):
+    """Run the pipeline against the seeded in-process backend instead of a mock server"""
+    backend = mrg.SimulatedBackend(
+        seed=args.seed,
+        latency=args.latency,
+        rate_limit_rate=args.rate_limit_rate,
+        server_error_rate=args.server_error_rate,
+        retry_after=args.retry_after
+    )
+    with tempfile.TemporaryDirectory(prefix="review-bench-") as workdir:
+        table = os.path.join(workdir, "catalogue.md")
+        write_synthetic_table(table, rows)
+        started = time.perf_counter()
+        results = mrg.process_file_cli(
+            table,
+            os.path.join(workdir, "out"),
+            keep_thinking=False,
+            simulation_mode=True,
+            concurrency=args.concurrency,
+            requests_per_minute=args.rpm,
+            use_cache=False,
+            stream=args.stream,
+            batch_size=args.batch_size,
+            session=backend
+        )
+        elapsed = time.perf_counter() - started
+    return results, elapsed, [backend]
+
+
+def run_case(rows, args):
+    if args.backend == 'simulated':
+        results, elapsed, backends = run_simulated_case(rows, args)
+    else:
+        results, elapsed, backends = run_mock_case(rows, args)
+    
+    def total(key):
+        return sum(backend.stats[key] for backend in backends)
+
+    saved = [r for r in results if r['status'] == 'saved']
+    latencies = [r['latency'] for r in results if 'latency' in r]
+    return {
+        'rows': rows,
+        'saved': len(saved),
+        'failed': len(results) - len(saved),
+        'elapsed_s': round(elapsed, 3),
+        'reviews_per_s': round(len(saved) / elapsed, 2) if elapsed else None,
+        'latency_p50_s': mrg.percentile(latencies, 50),
+        'latency_p95_s': mrg.percentile(latencies, 95),
+        'latency_p99_s': mrg.percentile(latencies, 99),
+        'http_requests': total('requests'),
+        'retries': total('rate_limited') + total('server_errors'),
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+
+
+def run_mock_case(rows, args):
+    # One mock per endpoint; --endpoint-error-rates overrides the 5xx rate of each
+    error_rates = args.endpoint_error_rates or [args.server_error_rate]
+    servers = [
+        MockDeepSeekServer(
+            latency=args.latency,
+            rate_limit_rate=args.rate_limit_rate,
+            server_error_rate=error_rate,
+            retry_after=args.retry_after,
+            seed=args.seed + number
+        ).start()
+        for number, error_rate in enumerate(error_rates)
+    ]
+    try:
+        with tempfile.TemporaryDirectory(prefix="review-bench-") as workdir:
+            table = os.path.join(workdir, "catalogue.md")
+            write_synthetic_table(table, rows)
+            endpoints_file = None
+            if len(servers) > 1:
+                endpoints_file = os.path.join(workdir, "endpoints.json")
+                with open(endpoints_file, 'w', encoding='utf-8') as f:
+                    json.dump([{'url': server.url, 'name': f"mock-{number}", 'api_key': 'benchmark'}
+                               for number, server in enumerate(servers)], f)
+            started = time.perf_counter()
+            results = mrg.process_file_cli(
+                table,
+                os.path.join(workdir, "out"),
+                keep_thinking=False,
+                simulation_mode=False,
+                concurrency=args.concurrency,
+                requests_per_minute=args.rpm,
+                use_cache=False,
+                stream=args.stream,
+                api_url=servers[0].url,
+                # Never send the user's real key to the local mock
+                api_key='benchmark',
+                batch_size=args.batch_size,
+                endpoints_file=endpoints_file
+            )
+            elapsed = time.perf_counter() - started
+    finally:
+        for server in servers:
+            server.stop()
+    return results, elapsed, servers
+
+
+def compare(current, baseline_path):
+    """Print reviews/sec and p95 changes against a previous results file"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {case['rows']: case for case in json.load(f)['cases']}
+    for case in current:
+        previous = baseline.get(case['rows'])
+        if not previous:
+            continue
+        for key in ('reviews_per_s', 'latency_p95_s'):
+            if previous.get(key) and case.get(key):
+                change = (case[key] - previous[key]) / previous[key] * 100
+                print(f"rows={case['rows']}: {key} {previous[key]} -> {case[key]} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Review pipeline throughput benchmark")
+    parser.add_argument("--rows", type=int, nargs='+', default=[25, 1000],
+                        help="synthetic table sizes to run (e.g. 25 1000 100000)")
+    parser.add_argument("--backend", choices=['mock', 'simulated'], default='mock',
+                        help="mock: local HTTP mock server; simulated: seeded in-process backend (no sockets)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=float, default=1000000, help="client rate limit (requests/min)")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--latency", default="lognormal:0.05:0.5", help="mock latency distribution")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--server-error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.1)
+    parser.add_argument("--endpoint-error-rates", type=float, nargs='+', default=None,
+                        help="run one mock endpoint per value (its 5xx rate) and route across them")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default=None, help="results JSON path (default: benchmarks/results/<time>.json)")
+    parser.add_argument("--baseline", default=None, help="previous results JSON to compare against")
+    args = parser.parse_args()
+    if args.backend == 'simulated' and args.endpoint_error_rates:
+        parser.error("--endpoint-error-rates needs the mock backend")
+
+    # Per-entry INFO logging would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+
+    cases = []
+    for rows in args.rows:
+        case = run_case(rows, args)
+        print(json.dumps(case))
+        cases.append(case)
+
+    output = args.output or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "results", time.strftime("benchmark-%Y%m%d-%H%M%S.json")
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    config = {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')}
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'config': config, 'cases': cases}, f, indent=2, ensure_ascii=False)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        compare(cases, args.baseline)
+
+    # A case that lost reviews (e.g. a configuration error) must not pass as a slow run
+    incomplete = [case for case in cases if case['saved'] < case['rows']]
+    if incomplete:
+        for case in incomplete:
+            print(f"rows={case['rows']}: only {case['saved']} of {case['rows']} reviews saved", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
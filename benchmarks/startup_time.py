@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Startup-time benchmark for the generator module and CLI
+
+Measures, in fresh interpreters, how long `import music_review_generator` and
+`music_review_generator.py --help` take, and checks that the import does not
+pull in the GUI or heavy dependencies. Exits non-zero when a check fails, so it
+can guard CI against regressions:
+
+    python benchmarks/startup_time.py --runs 7 --max-ms 300
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(REPO_DIR, "music_review_generator.py")
+
+# Modules that must only be imported on the code paths that need them
+LAZY_MODULES = ('tkinter', 'pandas', 'requests', 'pyarrow', 'httpx')
+
+
+def time_command(command, runs):
+    """Median wall time in milliseconds of running `command` in a fresh process"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=REPO_DIR, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(timings), 1)
+
+
+def eagerly_imported_modules():
+    """Heavy modules present in sys.modules right after importing the generator"""
+    probe = (
+        "import json, sys; import music_review_generator; "
+        f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    )
+    output = subprocess.run([sys.executable, "-c", probe], cwd=REPO_DIR, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generator startup-time benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="runs per measurement (the median is reported)")
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="fail if the median --help time exceeds this many milliseconds")
+    args = parser.parse_args()
+
+    baseline = time_command([sys.executable, "-c", "pass"], args.runs)
+    result = {
+        'interpreter_ms': baseline,
+        'import_ms': time_command([sys.executable, "-c", "import music_review_generator"], args.runs),
+        'help_ms': time_command([sys.executable, SCRIPT, "--help"], args.runs),
+        'eager_heavy_imports': eagerly_imported_modules()
+    }
+    print(json.dumps(result))
+
+    failed = False
+    if result['eager_heavy_imports']:
+        print(f"Imported at module load: {', '.join(result['eager_heavy_imports'])}", file=sys.stderr)
+        failed = True
+    if args.max_ms is not None and result['help_ms'] > args.max_ms:
+        print(f"--help took {result['help_ms']} ms (limit {args.max_ms} ms)", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,287 +3,3908 @@ import os
 import re
 import time
 import json
-import requests
-import pandas as pd
+import math
+import random
+import hashlib
+import sqlite3
+import tempfile
+import csv
+import string
+import unicodedata
+from email.utils import parsedate_to_datetime
 import argparse
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
+from abc import ABC, abstractmethod
 import logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("music_review_generator.log")
-    ]
+# Heavy and optional dependencies (requests, pandas, tkinter) are imported on
+# the code paths that need them, so importing this module stays fast and works
+# on headless machines without Tk.
+tk = filedialog = messagebox = ttk = None
+
+logger = logging.getLogger(__name__)
+
+
+def configure_logging(log_file="music_review_generator.log"):
+    """Configure console and file logging (called from main, not at import time)"""
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=handlers
+    )
+
+
+def _import_tk():
+    """Import tkinter for the GUI on first use"""
+    global tk, filedialog, messagebox, ttk
+    if tk is None:
+        import tkinter
+        from tkinter import filedialog as tk_filedialog, messagebox as tk_messagebox, ttk as tk_ttk
+        tk, filedialog, messagebox, ttk = tkinter, tk_filedialog, tk_messagebox, tk_ttk
+
+# Constants (defaults that can be overridden)
+DEFAULT_MD_FILE_PATH = "top25Music_douban.md"
+DEFAULT_OUTPUT_DIR = "musicComments"
+DEFAULT_CACHE_PATH = "review_cache.sqlite3"
+RUN_JOURNAL_FILENAME = ".run_journal.jsonl"
+METRICS_FILENAME = ".metrics.jsonl"
+MANIFEST_FILENAME = ".manifest.json"
+PATH_MAP_FILENAME = ".paths.json"
+# Catalogue size above which new reviews are spread over hashed subdirectories
+SHARD_THRESHOLD = 5000
+
+# Columns of a catalogue entry, in the order of the Douban markdown table
+MUSIC_FIELDS = ['序号', '歌曲名', '表演者', '发行时间', '流派', '专辑类型', '介质', '评分']
+REQUIRED_FIELDS = ['序号', '歌曲名']
+# Alternative column names accepted in catalogue headers
+COLUMN_ALIASES = {
+    'id': '序号', 'no': '序号', 'rank': '序号',
+    'title': '歌曲名', 'album': '歌曲名', 'name': '歌曲名',
+    'artist': '表演者', 'performer': '表演者',
+    'release_date': '发行时间', 'date': '发行时间',
+    'genre': '流派',
+    'type': '专辑类型', 'album_type': '专辑类型',
+    'medium': '介质', 'media': '介质',
+    'rating': '评分', 'score': '评分'
+}
+# For Nvidia DeepSeek R1 model (override with DEEPSEEK_API_URL, e.g. to point at a local stand-in)
+API_URL = os.environ.get("DEEPSEEK_API_URL", "https://integrate.api.nvidia.com/v1/chat/completions")
+DEFAULT_MODEL = "deepseek-ai/deepseek-r1"
+
+def estimate_tokens(text):
+    """Roughly estimate the token count of a text (CJK ~1 token/char, others ~4 chars/token)"""
+    cjk_chars = len(re.findall(r'[\u3000-\u9fff\uff00-\uffef]', text))
+    return cjk_chars + (len(text) - cjk_chars) // 4 + 1
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header given as delta-seconds or an HTTP-date
+    
+    Returns the number of seconds to wait, or None if the value is missing or invalid.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RateLimiter:
+    """Thread-safe token-bucket rate limiter with adaptive backoff
+    
+    Requests and (optionally) tokens are metered per minute. The effective rate
+    is scaled by an adaptive factor: it is cut multiplicatively when the server
+    throttles us (429/5xx) and recovers additively on healthy responses, never
+    exceeding the configured limits. All waits are jittered so concurrent
+    workers do not wake up in lockstep.
+    """
+    
+    def __init__(self, requests_per_minute=10, tokens_per_minute=None, burst=1,
+                 min_rate_factor=0.1, decrease_factor=0.5, increase_step=0.05,
+                 jitter=0.1, base_backoff=2.0, max_backoff=120.0):
+        self.requests_per_minute = float(requests_per_minute)
+        self.tokens_per_minute = float(tokens_per_minute) if tokens_per_minute else None
+        self.burst = max(1.0, float(burst))
+        
+        # Adaptive (AIMD) parameters
+        self.rate_factor = 1.0
+        self.min_rate_factor = min_rate_factor
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        
+        # Backoff parameters
+        self.jitter = jitter
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        
+        self._lock = threading.Lock()
+        self._request_allowance = self.burst
+        self._token_allowance = self.tokens_per_minute or 0.0
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+    
+    def _refill(self, now):
+        """Top up both buckets for the time elapsed since the last refill (lock held)"""
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._request_allowance = min(
+            self.burst,
+            self._request_allowance + elapsed * self.requests_per_minute * self.rate_factor / 60.0
+        )
+        if self.tokens_per_minute:
+            self._token_allowance = min(
+                self.tokens_per_minute,
+                self._token_allowance + elapsed * self.tokens_per_minute * self.rate_factor / 60.0
+            )
+    
+    def _jittered(self, delay):
+        """Spread a wait by +/- `jitter` of its length"""
+        if delay <= 0 or not self.jitter:
+            return max(0.0, delay)
+        return max(0.0, delay * (1 + random.uniform(-self.jitter, self.jitter)))
+    
+    def acquire(self, tokens=0):
+        """Block until a request (and `tokens` tokens) may be sent; returns seconds slept"""
+        slept = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                # Never wait for more tokens than the bucket can ever hold
+                needed_tokens = min(tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+                
+                if now < self._blocked_until:
+                    wait_time = self._blocked_until - now
+                elif self._request_allowance < 1:
+                    wait_time = (1 - self._request_allowance) * 60.0 / (self.requests_per_minute * self.rate_factor)
+                elif self._token_allowance < needed_tokens:
+                    wait_time = ((needed_tokens - self._token_allowance) * 60.0
+                                 / (self.tokens_per_minute * self.rate_factor))
+                else:
+                    self._request_allowance -= 1
+                    if self.tokens_per_minute:
+                        self._token_allowance -= tokens
+                    return slept
+            
+            wait_time = self._jittered(wait_time)
+            logger.info(f"Rate limiting: sleeping for {wait_time:.2f} seconds")
+            time.sleep(wait_time)
+            slept += wait_time
+    
+    def record_tokens(self, actual_tokens, estimated_tokens):
+        """Correct the token bucket once the real usage of a request is known"""
+        if not self.tokens_per_minute:
+            return
+        with self._lock:
+            self._token_allowance -= (actual_tokens - estimated_tokens)
+    
+    def on_success(self):
+        """Speed back up after a healthy response"""
+        with self._lock:
+            self.rate_factor = min(1.0, self.rate_factor + self.increase_step)
+    
+    def on_throttle(self, retry_after=None, attempt=0):
+        """Slow down after a 429/5xx and pause all callers; returns the pause length"""
+        with self._lock:
+            self.rate_factor = max(self.min_rate_factor, self.rate_factor * self.decrease_factor)
+            pause = retry_after if retry_after is not None else self.backoff_delay(attempt)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+            logger.info(f"Rate limiter slowed down to {self.rate_factor:.0%} of the configured rate")
+        return pause
+    
+    def backoff_delay(self, attempt):
+        """Exponential backoff delay for the given retry attempt, with jitter"""
+        return self._jittered(min(self.max_backoff, self.base_backoff * (2 ** attempt)))
+    
+    def blocked_for(self):
+        """Seconds left of a pause imposed by on_throttle (0 when not paused)"""
+        with self._lock:
+            return max(0.0, self._blocked_until - time.monotonic())
+
+
+class TokenBudget:
+    """Cap on the tokens a whole run may spend
+    
+    Responses are charged as they arrive. `allows(in_flight)` turns False once
+    the tokens spent, plus the average cost of the requests still in flight,
+    would reach the limit, so a run stops starting new work just before the
+    cap instead of overshooting it by a full window of requests.
+    """
+    
+    def __init__(self, limit):
+        self.limit = int(limit)
+        self.spent = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+    
+    def charge(self, tokens):
+        with self._lock:
+            self.spent += int(tokens)
+            self.requests += 1
+    
+    def allows(self, in_flight=0):
+        """Whether another request may be started with `in_flight` requests still running"""
+        with self._lock:
+            average = self.spent / self.requests if self.requests else 0.0
+            return self.spent + in_flight * average < self.limit
+    
+    def summary(self):
+        with self._lock:
+            return f"{self.spent}/{self.limit} tokens spent over {self.requests} requests"
+
+
+DEFAULT_TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+DEFAULT_LANGUAGE = "zh"
+
+# Placeholders each template may use
+TEMPLATE_FIELDS = {
+    'prompt': MUSIC_FIELDS,
+    'batch_entry': MUSIC_FIELDS,
+    'batch_prompt': ['count', 'entries'],
+    'review_header': MUSIC_FIELDS
+}
+
+
+class PromptTemplate:
+    """A text template compiled once into literal and placeholder parts
+    
+    Placeholders are written `{字段名}`; `{{` and `}}` are literal braces.
+    """
+    
+    def __init__(self, text, name='<template>', allowed_fields=None):
+        self.name = name
+        self.text = text
+        self.hash = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+        self._parts = []
+        for literal, field, format_spec, conversion in string.Formatter().parse(text):
+            if literal:
+                self._parts.append((literal, None))
+            if field is None:
+                continue
+            if format_spec or conversion or not field:
+                raise ValueError(f"{name}: only plain {{字段名}} placeholders are supported")
+            if allowed_fields is not None and field not in allowed_fields:
+                raise ValueError(f"{name}: unknown placeholder {{{field}}}")
+            self._parts.append((None, field))
+    
+    def render(self, values):
+        return ''.join(literal if field is None else str(values[field]) for literal, field in self._parts)
+
+
+class TemplateSet:
+    """Prompt and output templates loaded once from `<directory>/<language>/`
+    
+    A template named `prompt` may have variants `prompt-<流派>-<专辑类型>`,
+    `prompt-<流派>` and `prompt-<专辑类型>`; the most specific one present is
+    used for an entry. Missing templates fall back to the default language.
+    Each template's hash takes part in request hashes and row fingerprints.
+    """
+    
+    def __init__(self, directory=DEFAULT_TEMPLATES_DIR, language=DEFAULT_LANGUAGE):
+        self.directory = directory
+        self.language = language
+        self.templates = {}
+        for lang in dict.fromkeys([DEFAULT_LANGUAGE, language]):
+            lang_dir = os.path.join(directory, lang)
+            if not os.path.isdir(lang_dir):
+                continue
+            for filename in sorted(os.listdir(lang_dir)):
+                name, extension = os.path.splitext(filename)
+                if extension not in ('.txt', '.md'):
+                    continue
+                with open(os.path.join(lang_dir, filename), 'r', encoding='utf-8') as f:
+                    text = f.read()
+                # Editors end files with a newline that is not part of the template
+                if text.endswith('\n'):
+                    text = text[:-1]
+                base = name.split('-', 1)[0]
+                self.templates[name] = PromptTemplate(text, f"{lang}/{filename}", TEMPLATE_FIELDS.get(base))
+        
+        missing = [name for name in TEMPLATE_FIELDS if name not in self.templates]
+        if missing:
+            raise ValueError(f"Templates missing from {directory} ({language}): {', '.join(missing)}")
+        self.hash = hashlib.sha256(
+            json.dumps(sorted((name, t.hash) for name, t in self.templates.items())).encode('utf-8')
+        ).hexdigest()[:16]
+        self._selected = {}
+    
+    def select(self, name, music_info=None):
+        """The most specific variant of template `name` for an entry"""
+        if music_info is None:
+            return self.templates[name]
+        genre, release_type = music_info.get('流派', ''), music_info.get('专辑类型', '')
+        cache_key = (name, genre, release_type)
+        template = self._selected.get(cache_key)
+        if template is None:
+            for candidate in (f"{name}-{genre}-{release_type}", f"{name}-{genre}", f"{name}-{release_type}", name):
+                if candidate in self.templates:
+                    template = self.templates[candidate]
+                    break
+            self._selected[cache_key] = template
+        return template
+    
+    def render_prompt(self, music_info):
+        return self.select('prompt', music_info).render(music_info)
+    
+    def render_batch_prompt(self, music_entries):
+        entries = "\n\n".join(self.select('batch_entry', info).render(info) for info in music_entries)
+        return self.select('batch_prompt').render({'count': len(music_entries), 'entries': entries})
+    
+    def render_header(self, music_info):
+        return self.select('review_header', music_info).render(music_info)
+    
+    def entry_hash(self, music_info):
+        """Hash of the templates that shape an entry's prompt and review file"""
+        return f"{self.select('prompt', music_info).hash}:{self.select('review_header', music_info).hash}"
+
+
+_templates = None
+
+
+def get_templates():
+    """The active TemplateSet (the bundled Chinese templates unless use_templates was called)"""
+    global _templates
+    if _templates is None:
+        _templates = TemplateSet()
+    return _templates
+
+
+def use_templates(directory=None, language=None):
+    """Load and activate a template set; returns it"""
+    global _templates
+    _templates = TemplateSet(directory or DEFAULT_TEMPLATES_DIR, language or DEFAULT_LANGUAGE)
+    logger.info(f"Using templates from {_templates.directory} ({_templates.language}), hash {_templates.hash}")
+    return _templates
+
+
+def build_prompt(music_info):
+    """Render the DeepSeek R1 prompt for a music entry from the active templates"""
+    return get_templates().render_prompt(music_info)
+
+
+def build_batch_prompt(music_entries):
+    """Render one prompt asking for reviews of several entries as a JSON array"""
+    return get_templates().render_batch_prompt(music_entries)
+
+
+# A complete <think>...</think> reasoning block and the whitespace after it
+THINK_BLOCK_PATTERN = re.compile(r'<think>.*?</think>\s*', re.DOTALL)
+# Reasoning inside a <think> block, including one left open by a truncated response
+THINK_CONTENT_PATTERN = re.compile(r'<think>(.*?)(?:</think>|$)', re.DOTALL)
+
+
+# The "序号: ..." line that opens each entry of a batched prompt (single-entry prompts have none)
+BATCH_ENTRY_PATTERN = re.compile(r'^序号: (.*)$', re.MULTILINE)
+
+
+def batch_entry_numbers(prompt):
+    """The 序号 of each entry a batched prompt asks for (empty for a single-entry prompt)"""
+    return [number.strip() for number in BATCH_ENTRY_PATTERN.findall(prompt)]
+
+
+def parse_batch_response(text):
+    """Split a batched response into {序号: review}; malformed items are skipped"""
+    # Drop any reasoning and Markdown code fences around the JSON
+    text = THINK_BLOCK_PATTERN.sub('', text)
+    fenced = re.search(r'```(?:json)?\s*(.*?)```', text, flags=re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    start, end = text.find('['), text.rfind(']')
+    if start == -1 or end <= start:
+        logger.warning("Batch response does not contain a JSON array")
+        return {}
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError as e:
+        logger.warning(f"Could not parse batch response as JSON: {str(e)}")
+        return {}
+    
+    reviews = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        key, review = item.get('序号'), item.get('review')
+        if key is None or not isinstance(review, str) or not review.strip():
+            continue
+        reviews[str(key).strip()] = review.strip()
+    return reviews
+
+
+class ResponseCache:
+    """Persistent SQLite cache of generated reviews, keyed by a hash of the request
+    
+    Entries older than `max_age_days` are ignored and evicted; beyond that the
+    least recently used entries are dropped once the cache exceeds `max_entries`
+    or `max_bytes`. With `refresh=True` lookups always miss but fresh results are
+    still stored.
+    """
+    
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=50000, max_bytes=512 * 1024 * 1024,
+                 max_age_days=90, refresh=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._puts_since_evict = 0
+        
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                review TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self.evict()
+    
+    @staticmethod
+    def make_key(model, temperature, keep_thinking, prompt, template_hash=None, max_tokens=None):
+        """Content address of a request: everything that influences the response
+        
+        Optional parameters only join the key when set, so entries cached
+        without them keep their addresses.
+        """
+        extra = ([template_hash] if template_hash else []) + ([{'max_tokens': max_tokens}] if max_tokens else [])
+        material = json.dumps(
+            [model, temperature, bool(keep_thinking), prompt] + extra,
+            ensure_ascii=False,
+            separators=(',', ':')
+        )
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+    
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+    
+    def get(self, key):
+        """Return the cached review for `key`, or None on a miss"""
+        if self.refresh:
+            self.misses += 1
+            return None
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT review, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return row[0]
+    
+    def put(self, key, review):
+        """Store a review, evicting old entries every so often"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, review, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, review, len(review.encode('utf-8')), now, now)
+            )
+            self._conn.commit()
+            self._puts_since_evict += 1
+            due = self._puts_since_evict >= 100
+        if due:
+            self.evict()
+    
+    def evict(self):
+        """Drop expired entries, then least recently used ones until within limits"""
+        with self._lock:
+            self._puts_since_evict = 0
+            if self.max_age:
+                self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+            count, total_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            if count > self.max_entries or total_size > self.max_bytes:
+                removed = 0
+                for key, size in self._conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed"
+                ).fetchall():
+                    if count - removed <= self.max_entries and total_size <= self.max_bytes:
+                        break
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    removed += 1
+                    total_size -= size
+                logger.info(f"Evicted {removed} entries from response cache")
+            self._conn.commit()
+    
+    def stats(self):
+        """Human-readable hit/miss summary"""
+        total = self.hits + self.misses
+        rate = (self.hits / total * 100) if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class ThroughputMeter:
+    """Thread-safe sliding-window counter of generated tokens per second"""
+    
+    def __init__(self, window=10.0):
+        self.window = window
+        self.total_tokens = 0
+        self._events = []
+        self._lock = threading.Lock()
+    
+    def add(self, tokens):
+        now = time.monotonic()
+        with self._lock:
+            self.total_tokens += tokens
+            self._events.append((now, tokens))
+            # Drop events that fell out of the window
+            cutoff = now - self.window
+            while self._events and self._events[0][0] < cutoff:
+                self._events.pop(0)
+    
+    def rate(self):
+        """Tokens per second over the window"""
+        now = time.monotonic()
+        with self._lock:
+            recent = sum(tokens for t, tokens in self._events if t >= now - self.window)
+        return recent / self.window
+
+
+def new_request_metrics():
+    """Empty per-entry metrics record, filled in by the pipeline and DeepSeekAPI"""
+    return {
+        'queue_wait_s': 0.0,
+        'rate_limit_sleep_s': 0.0,
+        'backoff_sleep_s': 0.0,
+        'network_s': 0.0,
+        'ttft_s': None,
+        'save_s': 0.0,
+        'total_s': 0.0,
+        'prompt_tokens': None,
+        'completion_tokens': None,
+        'reasoning_tokens': None,
+        'retries': 0,
+        'cache_hit': False,
+        'batch_size': 1,
+        'outcome': None,
+        'problems': []
+    }
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class MetricsRecorder:
+    """Collects per-entry request metrics
+    
+    Each record is appended to a JSONL file (if `jsonl_path` is given) as soon
+    as the entry finishes; `summary()` aggregates the whole run and
+    `write_prometheus()` exports it in the Prometheus text format.
+    """
+    
+    TIMING_FIELDS = ['queue_wait_s', 'rate_limit_sleep_s', 'backoff_sleep_s', 'network_s', 'ttft_s',
+                     'save_s', 'total_s']
+    
+    def __init__(self, jsonl_path=None):
+        self.jsonl_path = jsonl_path
+        self.records = []
+        self._lock = threading.Lock()
+        self._file = open(jsonl_path, 'a', encoding='utf-8') if jsonl_path else None
+    
+    def record(self, metrics):
+        with self._lock:
+            self.records.append(metrics)
+            if self._file is not None:
+                self._file.write(json.dumps(metrics, ensure_ascii=False) + '\n')
+                self._file.flush()
+    
+    def summary(self):
+        """Aggregate counts, timings and token usage over all recorded entries"""
+        with self._lock:
+            records = list(self.records)
+        summary = {'entries': len(records), 'outcomes': {}, 'retries': 0, 'cache_hits': 0,
+                   'prompt_tokens': 0, 'completion_tokens': 0, 'reasoning_tokens': 0, 'generated': 0,
+                   'timings': {}}
+        for record in records:
+            outcome = record.get('outcome') or 'unknown'
+            summary['outcomes'][outcome] = summary['outcomes'].get(outcome, 0) + 1
+            summary['retries'] += record.get('retries') or 0
+            summary['cache_hits'] += 1 if record.get('cache_hit') else 0
+            summary['prompt_tokens'] += record.get('prompt_tokens') or 0
+            summary['completion_tokens'] += record.get('completion_tokens') or 0
+            summary['reasoning_tokens'] += record.get('reasoning_tokens') or 0
+            # Reviews that were paid for (cache hits and skipped entries cost nothing)
+            if outcome in ('saved', 'invalid'):
+                summary['generated'] += 1
+        for field in self.TIMING_FIELDS:
+            values = [record[field] for record in records if record.get(field) is not None]
+            summary['timings'][field] = {
+                'sum': sum(values),
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99)
+            }
+        return summary
+    
+    def log_summary(self):
+        summary = self.summary()
+        if not summary['entries']:
+            return
+        timings = summary['timings']
+        outcomes = ', '.join(f"{name}={count}" for name, count in sorted(summary['outcomes'].items()))
+        logger.info(f"Run metrics: {summary['entries']} entries ({outcomes}), {summary['retries']} retries, "
+                    f"{summary['cache_hits']} cache hits")
+        logger.info(f"Time spent: queue wait {timings['queue_wait_s']['sum']:.1f}s, "
+                    f"rate-limit sleep {timings['rate_limit_sleep_s']['sum']:.1f}s, "
+                    f"backoff {timings['backoff_sleep_s']['sum']:.1f}s, "
+                    f"network {timings['network_s']['sum']:.1f}s, save {timings['save_s']['sum']:.1f}s")
+        total = timings['total_s']
+        if total['p50'] is not None:
+            ttft = timings['ttft_s']
+            ttft_text = f", TTFT p50 {ttft['p50']:.2f}s" if ttft['p50'] is not None else ""
+            logger.info(f"Latency per entry: p50 {total['p50']:.2f}s, p95 {total['p95']:.2f}s, "
+                        f"p99 {total['p99']:.2f}s{ttft_text}")
+        completion = summary['completion_tokens']
+        reasoning_share = f" ({summary['reasoning_tokens'] / completion:.0%} reasoning)" if completion else ""
+        per_review = ""
+        if summary['generated']:
+            per_review = (f"; {(summary['prompt_tokens'] + completion) / summary['generated']:.0f} "
+                          f"per generated review")
+        logger.info(f"Tokens: {summary['prompt_tokens']} prompt, {completion} completion{reasoning_share}"
+                    f"{per_review}")
+    
+    def write_prometheus(self, path):
+        """Write the run summary in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines = [
+            "# HELP review_entries_total Entries processed, by outcome.",
+            "# TYPE review_entries_total counter"
+        ]
+        for outcome, count in sorted(summary['outcomes'].items()):
+            lines.append(f'review_entries_total{{outcome="{outcome}"}} {count}')
+        for name, value, help_text in [
+            ('review_retries_total', summary['retries'], "Request retries."),
+            ('review_cache_hits_total', summary['cache_hits'], "Reviews served from the response cache."),
+            ('review_prompt_tokens_total', summary['prompt_tokens'], "Prompt tokens consumed."),
+            ('review_completion_tokens_total', summary['completion_tokens'], "Completion tokens generated."),
+            ('review_reasoning_tokens_total', summary['reasoning_tokens'],
+             "Completion tokens spent on reasoning (reported by the API or estimated).")
+        ]:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {value}"]
+        for field, stats in summary['timings'].items():
+            name = f"review_{field[:-2]}_seconds"
+            lines += [f"# HELP {name} Per-entry {field[:-2].replace('_', ' ')} time.", f"# TYPE {name} summary"]
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                if stats[key] is not None:
+                    lines.append(f'{name}{{quantile="{quantile}"}} {stats[key]:.6f}')
+            lines.append(f"{name}_sum {stats['sum']:.6f}")
+        atomic_write_text(path, '\n'.join(lines) + '\n')
+        logger.info(f"Wrote Prometheus metrics to {path}")
+    
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class ThinkStripper:
+    """Incremental state machine that removes <think>...</think> blocks from streamed text
+    
+    Tags may be split across chunks, so a possible partial tag at the end of a
+    chunk is held back until the next one arrives. Whitespace directly after a
+    closing tag is dropped, matching the non-streaming `<think>.*?</think>\\s*` rule.
+    The removed reasoning is kept in `reasoning` for token accounting.
+    """
+    
+    OPEN_TAG = '<think>'
+    CLOSE_TAG = '</think>'
+    
+    def __init__(self):
+        self._buffer = ''
+        self._in_think = False
+        self._skip_whitespace = False
+        self._reasoning = []
+    
+    @property
+    def reasoning(self):
+        return ''.join(self._reasoning)
+    
+    @staticmethod
+    def _partial_tag_length(text, tag):
+        """Length of the longest proper prefix of `tag` that `text` ends with"""
+        for length in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:length]):
+                return length
+        return 0
+    
+    def feed(self, text):
+        """Consume a chunk and return the part of it that is safe to emit"""
+        self._buffer += text
+        output = []
+        while self._buffer:
+            if self._in_think:
+                index = self._buffer.find(self.CLOSE_TAG)
+                if index == -1:
+                    # Everything but a possible partial closing tag is reasoning
+                    self._reasoning.append(self._buffer[:-(len(self.CLOSE_TAG) - 1)])
+                    self._buffer = self._buffer[-(len(self.CLOSE_TAG) - 1):]
+                    break
+                self._reasoning.append(self._buffer[:index])
+                self._buffer = self._buffer[index + len(self.CLOSE_TAG):]
+                self._in_think = False
+                self._skip_whitespace = True
+                continue
+            
+            if self._skip_whitespace:
+                self._buffer = self._buffer.lstrip()
+                if not self._buffer:
+                    break
+                self._skip_whitespace = False
+            
+            index = self._buffer.find(self.OPEN_TAG)
+            if index == -1:
+                keep = self._partial_tag_length(self._buffer, self.OPEN_TAG)
+                output.append(self._buffer[:len(self._buffer) - keep])
+                self._buffer = self._buffer[len(self._buffer) - keep:]
+                break
+            output.append(self._buffer[:index])
+            self._buffer = self._buffer[index + len(self.OPEN_TAG):]
+            self._in_think = True
+        return ''.join(output)
+    
+    def flush(self):
+        """Return any held-back text at the end of the stream"""
+        remaining = '' if self._in_think else self._buffer
+        self._buffer = ''
+        return remaining
+
+
+def iter_sse_data(lines):
+    """Yield the data payloads of a server-sent-event stream, stopping at [DONE]"""
+    data_lines = []
+    for line in lines:
+        if line is None:
+            continue
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line:
+            # A blank line terminates an event
+            if data_lines:
+                data = '\n'.join(data_lines)
+                data_lines = []
+                if data.strip() == '[DONE]':
+                    return
+                yield data
+            continue
+        if line.startswith(':'):
+            continue  # comment / keep-alive
+        if line.startswith('data:'):
+            data_lines.append(line[5:].lstrip(' '))
+    if data_lines:
+        data = '\n'.join(data_lines)
+        if data.strip() != '[DONE]':
+            yield data
+
+
+# Per-thread record of the time spent opening connections during the current request
+_connection_timing = threading.local()
+
+
+def _reset_connection_timing():
+    _connection_timing.setup_time = 0.0
+    _connection_timing.new_connections = 0
+
+
+def _add_connection_timing(seconds, new_connection=True):
+    _connection_timing.setup_time = getattr(_connection_timing, 'setup_time', 0.0) + seconds
+    if new_connection:
+        _connection_timing.new_connections = getattr(_connection_timing, 'new_connections', 0) + 1
+
+
+_timed_adapter_class = None
+
+
+def _get_timed_http_adapter_class():
+    """Build (once) an HTTPAdapter whose connections report how long TCP/TLS setup took"""
+    global _timed_adapter_class
+    if _timed_adapter_class is not None:
+        return _timed_adapter_class
+    from requests.adapters import HTTPAdapter
+    
+    class TimedHTTPAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            from urllib3.connection import HTTPConnection, HTTPSConnection
+            from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+        
+            class TimedHTTPConnection(HTTPConnection):
+                def connect(self):
+                    started = time.perf_counter()
+                    super().connect()
+                    _add_connection_timing(time.perf_counter() - started)
+        
+            class TimedHTTPSConnection(HTTPSConnection):
+                def connect(self):
+                    started = time.perf_counter()
+                    super().connect()
+                    _add_connection_timing(time.perf_counter() - started)
+        
+            class TimedHTTPConnectionPool(HTTPConnectionPool):
+                ConnectionCls = TimedHTTPConnection
+        
+            class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+                ConnectionCls = TimedHTTPSConnection
+        
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': TimedHTTPConnectionPool,
+                'https': TimedHTTPSConnectionPool
+            }
+    
+    _timed_adapter_class = TimedHTTPAdapter
+    return _timed_adapter_class
+
+
+class _HttpxResponse:
+    """Adapts an httpx response to the subset of the requests API used here"""
+    
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.encoding = None
+    
+    @property
+    def content(self):
+        return self._response.read()
+    
+    @property
+    def text(self):
+        self._response.read()
+        return self._response.text
+    
+    def json(self):
+        self._response.read()
+        return self._response.json()
+    
+    def iter_lines(self, decode_unicode=False):
+        if self.encoding:
+            self._response.default_encoding = self.encoding
+        return self._response.iter_lines()
+    
+    def close(self):
+        self._response.close()
+
+
+class _HttpxSession:
+    """HTTP/2 capable session backed by httpx, with the requests-style post() used here"""
+    
+    def __init__(self, pool_size, http_retries):
+        import httpx
+        self._httpx = httpx
+        self._client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            transport=httpx.HTTPTransport(http2=True, retries=http_retries)
+        )
+        self.transport_errors = (httpx.HTTPError, httpx.StreamError)
+    
+    @staticmethod
+    def _trace(event_name, info):
+        """Measure TCP connect and TLS handshake time from httpcore's trace events"""
+        if event_name in ("connection.connect_tcp.started", "connection.start_tls.started"):
+            _connection_timing.phase_started = time.perf_counter()
+        elif event_name in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            elapsed = time.perf_counter() - getattr(_connection_timing, 'phase_started', time.perf_counter())
+            _add_connection_timing(elapsed, new_connection=event_name == "connection.connect_tcp.complete")
+    
+    def post(self, url, headers=None, json=None, timeout=None, stream=False):
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        request = self._client.build_request(
+            "POST", url, headers=headers, json=json,
+            timeout=self._httpx.Timeout(read_timeout, connect=connect_timeout),
+            extensions={"trace": self._trace}
+        )
+        return _HttpxResponse(self._client.send(request, stream=stream))
+    
+    def close(self):
+        self._client.close()
+
+
+def create_http_session(pool_size=10, http_retries=2, http2=False):
+    """Create a pooled keep-alive HTTP session
+    
+    Connections are reused across requests and threads. `http_retries` covers
+    transport-level failures (connection errors) only; HTTP status handling
+    stays with the caller. With `http2=True` the session uses httpx (optional
+    dependency) to multiplex concurrent requests over one connection, falling
+    back to the requests pool if httpx is not installed.
+    """
+    if http2:
+        try:
+            session = _HttpxSession(pool_size, http_retries)
+            logger.info("Using HTTP/2 session (httpx)")
+            return session
+        except ImportError:
+            logger.warning("HTTP/2 requires 'httpx[http2]'; falling back to HTTP/1.1 connection pool")
+    
+    import requests
+    from urllib3.util.retry import Retry
+    session = requests.Session()
+    adapter = _get_timed_http_adapter_class()(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=http_retries, connect=http_retries, read=0, status=0,
+                          allowed_methods=None, backoff_factor=0.5,
+                          respect_retry_after_header=False, raise_on_status=False)
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.transport_errors = (requests.exceptions.RequestException,)
+    return session
+
+
+def parse_distribution(spec):
+    """Parse a distribution spec into a sampling function taking a random.Random
+    
+    Supported forms:
+        fixed:0.05              always 0.05
+        uniform:0.01:0.2        uniform between 0.01 and 0.2
+        normal:420:60           normal with mean 420 and standard deviation 60
+        lognormal:0.05:0.5      log-normal with median 0.05 and sigma 0.5
+        exponential:0.05        exponential with mean 0.05
+    """
+    kind, _, params = str(spec).partition(':')
+    try:
+        values = [float(v) for v in params.split(':') if v]
+        if kind == 'fixed':
+            value = values[0]
+            return lambda rng: value
+        if kind == 'uniform':
+            low, high = values[0], values[1]
+            return lambda rng: rng.uniform(low, high)
+        if kind == 'normal':
+            mean, sigma = values[0], values[1]
+            return lambda rng: rng.gauss(mean, sigma)
+        if kind == 'lognormal':
+            median, sigma = values[0], (values[1] if len(values) > 1 else 0.5)
+            return lambda rng: rng.lognormvariate(math.log(median), sigma)
+        if kind == 'exponential':
+            mean = values[0]
+            return lambda rng: rng.expovariate(1.0 / mean)
+    except (IndexError, ValueError):
+        pass
+    raise ValueError(f"Invalid distribution: {spec}")
+
+
+class SimulatedConnectionError(Exception):
+    """A connection failure injected by SimulatedBackend"""
+
+
+class _SimulatedResponse:
+    """A canned chat-completions response with the subset of the requests API used here"""
+    
+    def __init__(self, status_code, payload=None, headers=None, stream_lines=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.encoding = None
+        self._payload = payload
+        self._stream_lines = stream_lines
+    
+    @property
+    def content(self):
+        return json.dumps(self._payload, ensure_ascii=False).encode('utf-8')
+    
+    @property
+    def text(self):
+        return json.dumps(self._payload, ensure_ascii=False)
+    
+    def json(self):
+        return self._payload
+    
+    def iter_lines(self, decode_unicode=False):
+        return iter(self._stream_lines or ())
+    
+    def close(self):
+        pass
+
+
+class SimulatedBackend:
+    """Seeded in-process fake of the chat-completions endpoint, used as the HTTP session in simulation mode
+    
+    `post()` answers like the real API. After a sampled latency it returns a
+    429 (with Retry-After), a 5xx, a connection error or a review. The review
+    has a sampled length (characters for Chinese, words for English, as the
+    validator counts them) and <think> block, and a share of them can be
+    truncated mid-sentence. Batched prompts get a JSON array; streamed ones get
+    server-sent events, with the latency spread over the chunks. Because this
+    replaces only the transport, simulated runs use the real rate limiter,
+    retries, validation and file writing. Each draw comes from a generator
+    seeded by (seed, prompt, attempt), so outcomes do not depend on how worker
+    threads interleave. Distributions use `parse_distribution` specs.
+    """
+    
+    # Seconds of latency; 0 keeps simulation as fast as the pipeline allows
+    DEFAULT_LATENCY = 'fixed:0'
+    # Constructor options settable from the command line (--sim KEY=VALUE), with their types
+    OPTIONS = {
+        'seed': int, 'latency': str, 'rate_limit_rate': float, 'server_error_rate': float,
+        'connection_error_rate': float, 'truncation_rate': float, 'review_length': str,
+        'think_chars': str, 'retry_after': float, 'chunk_chars': int
+    }
+    
+    def __init__(self, seed=0, latency=DEFAULT_LATENCY, rate_limit_rate=0.0, server_error_rate=0.0,
+                 connection_error_rate=0.0, truncation_rate=0.0, review_length='normal:420:60',
+                 think_chars='uniform:100:600', retry_after=1.0, chunk_chars=8):
+        self.seed = seed
+        self.sample_latency = parse_distribution(latency)
+        self.sample_review_length = parse_distribution(review_length)
+        self.sample_think_chars = parse_distribution(think_chars)
+        self.rate_limit_rate = float(rate_limit_rate)
+        self.server_error_rate = float(server_error_rate)
+        self.connection_error_rate = float(connection_error_rate)
+        self.truncation_rate = float(truncation_rate)
+        self.retry_after = retry_after
+        self.chunk_chars = max(1, int(chunk_chars))
+        self.transport_errors = (SimulatedConnectionError,)
+        self.stats = {'requests': 0, 'ok': 0, 'rate_limited': 0, 'server_errors': 0,
+                      'connection_errors': 0, 'truncated': 0, 'streamed': 0}
+        self._attempts = {}
+        self._lock = threading.Lock()
+    
+    def _rng(self, prompt):
+        """A generator private to this attempt at this prompt"""
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+        with self._lock:
+            attempt = self._attempts.get(digest, 0)
+            self._attempts[digest] = attempt + 1
+            self.stats['requests'] += 1
+        return random.Random(f"{self.seed}:{digest}:{attempt}")
+    
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+    
+    def post(self, url, headers=None, json=None, timeout=None, stream=False):
+        prompt = json['messages'][-1]['content']
+        rng = self._rng(prompt)
+        latency = max(0.0, self.sample_latency(rng))
+        roll = rng.random()
+        thresholds = (self.connection_error_rate, self.rate_limit_rate, self.server_error_rate)
+        if roll < thresholds[0]:
+            self._count('connection_errors')
+            time.sleep(latency)
+            raise SimulatedConnectionError("Simulated connection reset")
+        if roll < sum(thresholds[:2]):
+            self._count('rate_limited')
+            return _SimulatedResponse(429, {"error": "rate limited"}, {'Retry-After': str(self.retry_after)})
+        if roll < sum(thresholds):
+            self._count('server_errors')
+            time.sleep(latency)
+            return _SimulatedResponse(503, {"error": "upstream unavailable"})
+        
+        content = self._content_for(prompt, rng)
+        max_tokens = json.get('max_tokens')
+        if max_tokens and estimate_tokens(content) > max_tokens:
+            # Cut off at the completion cap, as the API does
+            content = content[:len(content) * max_tokens // estimate_tokens(content)]
+            self._count('truncated')
+        usage = {"prompt_tokens": estimate_tokens(prompt), "completion_tokens": estimate_tokens(content)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        self._count('ok')
+        if not stream:
+            time.sleep(latency)
+            return _SimulatedResponse(200, {
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                "usage": usage
+            })
+        self._count('streamed')
+        return _SimulatedResponse(200, stream_lines=self._stream_lines(content, usage, latency))
+    
+    def _stream_lines(self, content, usage, latency):
+        pieces = [content[i:i + self.chunk_chars] for i in range(0, len(content), self.chunk_chars)]
+        delay = latency / max(1, len(pieces))
+        for piece in pieces:
+            time.sleep(delay)
+            yield "data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": piece}}]},
+                                        ensure_ascii=False)
+            yield ""
+        yield "data: " + json.dumps({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                                     "usage": usage})
+        yield ""
+        yield "data: [DONE]"
+        yield ""
+    
+    def _content_for(self, prompt, rng):
+        think_chars = max(0, int(self.sample_think_chars(rng)))
+        think = f"<think>{'嗯' * think_chars}</think>\n\n" if think_chars else ""
+        if batch_entry_numbers(prompt):
+            blocks = re.split(r'^(?=序号: )', prompt, flags=re.MULTILINE)[1:]
+            items = [{"序号": number, "review": self._review(block, rng)}
+                     for number, block in zip(batch_entry_numbers(prompt), blocks)]
+            return think + json.dumps(items, ensure_ascii=False)
+        return think + self._review(prompt, rng)
+    
+    def _review(self, prompt, rng):
+        """A review of the sampled length for the entry described in `prompt`"""
+        fields = dict(re.findall(r'^(歌曲名|表演者|流派|Title|Artist|Genre): (.*)$', prompt, flags=re.MULTILINE))
+        chinese = '歌曲名' in fields
+        title = (fields.get('歌曲名') or fields.get('Title') or '未知作品').split('/')[0].strip()
+        artist = fields.get('表演者') or fields.get('Artist') or ''
+        genre = fields.get('流派') or fields.get('Genre') or ''
+        target = max(1, int(self.sample_review_length(rng)))
+        if chinese:
+            heading = f"# 【遇见经典】{title}，{artist}的音乐心灵之旅 #音乐分享 #乐评"
+            sentences = SIMULATED_SENTENCES_ZH
+            tags = f"#音乐治愈 #{genre}之美" if genre else "#音乐治愈"
+        else:
+            heading = f"# Revisiting {title}: {artist} at their best #MusicReview #Classics"
+            sentences = SIMULATED_SENTENCES_EN
+            tags = "#NowPlaying #MusicReview"
+        paragraphs, paragraph, length = [], [], 0
+        while length < target:
+            sentence = rng.choice(sentences).format(title=title, artist=artist, genre=genre)
+            paragraph.append(sentence)
+            length += len(sentence) if chinese else len(sentence.split())
+            if len(paragraph) >= 3:
+                paragraphs.append(('' if chinese else ' ').join(paragraph))
+                paragraph = []
+        if paragraph:
+            paragraphs.append(('' if chinese else ' ').join(paragraph))
+        body = '\n\n'.join(paragraphs)
+        if rng.random() < self.truncation_rate:
+            self._count('truncated')
+            # Cut mid-sentence, as a response stopped at max_tokens would be
+            return f"{heading}\n\n{body[:max(1, len(body) * 2 // 3)].rstrip('。.！!？? ')}"
+        return f"{heading}\n\n{body}\n\n{tags}"
+    
+    def summary(self):
+        with self._lock:
+            return ', '.join(f"{count} {name}" for name, count in self.stats.items())
+    
+    def close(self):
+        pass
+
+
+def parse_simulation_options(items):
+    """Turn KEY=VALUE strings into SimulatedBackend keyword arguments"""
+    options = {}
+    for item in items or []:
+        key, separator, value = item.partition('=')
+        key = key.strip().replace('-', '_')
+        if not separator or key not in SimulatedBackend.OPTIONS:
+            raise ValueError(f"Invalid simulation option {item!r}; expected KEY=VALUE with KEY one of "
+                             f"{', '.join(SimulatedBackend.OPTIONS)}")
+        options[key] = SimulatedBackend.OPTIONS[key](value.strip())
+        if SimulatedBackend.OPTIONS[key] is str:
+            # Fail on a bad distribution now rather than on the first request
+            parse_distribution(options[key])
+    return options
+
+
+SIMULATED_SENTENCES_ZH = [
+    "这张由{artist}演绎的《{title}》是{genre}音乐中不可忽视的瑰宝。",
+    "作品以独特的音乐语言和细腻的情感表达，展现了艺术家深厚的音乐素养。",
+    "音乐时而澎湃激昂，时而柔情似水，情绪的转换无不牵动听众的心弦。",
+    "从历史角度看，它不仅丰富了{genre}的表现形式，也为后来的创作提供了新的可能。",
+    "每次聆听都能发现新的感动和启发，这正是经典的魅力所在。",
+    "如果你还没有听过这张作品，强烈推荐把它加入你的音乐清单。"
+]
+SIMULATED_SENTENCES_EN = [
+    "{artist} recorded {title} at the height of their powers, and it remains a landmark of {genre}.",
+    "The arrangements leave room for every instrument to breathe without losing momentum.",
+    "Quiet verses give way to soaring choruses that still raise goosebumps years later.",
+    "Its influence can be heard across a whole generation of {genre} records that followed.",
+    "Every listen reveals another detail hidden in the mix, which is what makes it a classic.",
+    "If you have never heard it, put it on tonight and let it play from start to finish."
+]
+
+
+class CircuitBreaker:
+    """Stop sending traffic to an endpoint after repeated failures, probing it again after a cooldown
+    
+    closed → open after `failure_threshold` consecutive failures; open →
+    half-open once `reset_timeout` seconds have passed, letting a single probe
+    request through; the probe's outcome closes or re-opens the circuit.
+    A disabled breaker counts failures but never opens.
+    """
+    
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, enabled=True):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.enabled = enabled
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+    
+    def retry_in(self):
+        """Seconds until an open circuit lets a probe through (0 when not open)"""
+        with self._lock:
+            if self.state != 'open':
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+    
+    def available(self):
+        """Whether a request could be let through now (without claiming the half-open probe)"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                return time.monotonic() >= self._opened_at + self.reset_timeout
+            return False
+    
+    def allow(self):
+        """Claim permission to send a request; an open circuit past its cooldown admits one probe"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() >= self._opened_at + self.reset_timeout:
+                self.state = 'half_open'
+                return True
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+    
+    def record_failure(self):
+        """Count a failure; returns True if this opened the circuit"""
+        with self._lock:
+            self.consecutive_failures += 1
+            if not self.enabled:
+                return False
+            if self.state == 'half_open' or (self.state == 'closed'
+                                             and self.consecutive_failures >= self.failure_threshold):
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+
+class Endpoint:
+    """One OpenAI-compatible chat-completions endpoint with its own key, model and rate budget"""
+    
+    # Smoothing of the latency and health averages used for routing
+    EWMA_ALPHA = 0.2
+    # Assumed latency of an endpoint that has not answered yet
+    DEFAULT_LATENCY = 1.0
+    
+    def __init__(self, url, api_key=None, model=DEFAULT_MODEL, rate_limiter=None, weight=1.0,
+                 name=None, breaker=None):
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.rate_limiter = rate_limiter or RateLimiter(requests_per_minute=10)
+        self.weight = max(0.0, float(weight))
+        self.name = name or url
+        self.breaker = breaker or CircuitBreaker()
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        self.latency = None
+        self.health = 1.0
+        self.stats = {'requests': 0, 'failures': 0}
+        self._lock = threading.Lock()
+    
+    def record_success(self, latency):
+        with self._lock:
+            self.stats['requests'] += 1
+            self.latency = latency if self.latency is None else (
+                self.EWMA_ALPHA * latency + (1 - self.EWMA_ALPHA) * self.latency
+            )
+            self.health = self.EWMA_ALPHA + (1 - self.EWMA_ALPHA) * self.health
+        self.breaker.record_success()
+    
+    def record_throttle(self):
+        """Count a 429: the endpoint is up, so the circuit is not charged (its rate limiter backs off)"""
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['throttled'] = self.stats.get('throttled', 0) + 1
+        # A throttled half-open probe still shows the endpoint answering
+        if self.breaker.state == 'half_open':
+            self.breaker.record_success()
+    
+    def record_failure(self):
+        """Count a transport error or 5xx against the endpoint's health and circuit"""
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats['failures'] += 1
+            self.health = (1 - self.EWMA_ALPHA) * self.health
+        if self.breaker.record_failure():
+            logger.warning(f"Circuit opened for endpoint {self.name} after "
+                           f"{self.breaker.consecutive_failures} consecutive failures")
+    
+    def score(self):
+        """Routing weight: configured weight scaled by health and adaptive rate, divided by latency"""
+        with self._lock:
+            latency = self.latency if self.latency is not None else self.DEFAULT_LATENCY
+            health = self.health
+        # A throttled endpoint (paused or slowed down by its limiter) gets less traffic
+        throttle = self.rate_limiter.rate_factor / (1.0 + self.rate_limiter.blocked_for())
+        return self.weight * max(health, 0.01) * throttle / max(latency, 0.05)
+    
+    def summary(self):
+        with self._lock:
+            latency = f"{self.latency:.2f}s" if self.latency is not None else "n/a"
+            return (f"{self.name}: {self.stats['requests']} requests, {self.stats['failures']} failures, "
+                    f"latency {latency}, health {self.health:.0%}, circuit {self.breaker.state}")
+
+
+class EndpointRouter:
+    """Spread requests over endpoints, weighted by health and latency, skipping open circuits"""
+    
+    def __init__(self, endpoints, rng=None):
+        if not endpoints:
+            raise ValueError("At least one endpoint is required")
+        self.endpoints = list(endpoints)
+        self._rng = rng or random.Random()
+    
+    def choose(self, exclude=()):
+        """Pick an endpoint for the next attempt, blocking while every circuit is open
+        
+        Endpoints in `exclude` (usually those that just failed) are avoided when
+        any other endpoint is available. Returns (endpoint, seconds waited).
+        """
+        waited = 0.0
+        while True:
+            available = [endpoint for endpoint in self.endpoints if endpoint.breaker.available()]
+            candidates = [endpoint for endpoint in available if endpoint not in exclude] or available
+            while candidates:
+                weights = [endpoint.score() for endpoint in candidates]
+                if sum(weights) > 0:
+                    endpoint = self._rng.choices(candidates, weights=weights)[0]
+                else:
+                    endpoint = self._rng.choice(candidates)
+                if endpoint.breaker.allow():
+                    return endpoint, waited
+                # Another worker claimed the half-open probe first
+                candidates.remove(endpoint)
+            
+            wait_time = min((endpoint.breaker.retry_in() for endpoint in self.endpoints), default=1.0)
+            # Half-open circuits report 0; poll until their probe settles
+            wait_time = max(wait_time, 0.5)
+            logger.warning(f"No endpoint available (circuits open); waiting {wait_time:.1f} seconds")
+            time.sleep(wait_time)
+            waited += wait_time
+    
+    def summary(self):
+        return [endpoint.summary() for endpoint in self.endpoints]
+
+
+def load_endpoints(path, requests_per_minute=10, tokens_per_minute=None, burst=1):
+    """Load endpoint definitions from a JSON file
+    
+    The file holds a list of objects with `url` and optionally `api_key_env`
+    (name of the environment variable holding the key, default NVIDIA_API_KEY),
+    `api_key`, `model`, `rpm`, `tpm`, `weight` and `name`. Each endpoint gets its
+    own rate limiter; `rpm`/`tpm` default to the global limits.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        definitions = json.load(f)
+    if not isinstance(definitions, list) or not definitions:
+        raise ValueError(f"{path}: expected a non-empty JSON list of endpoints")
+    
+    endpoints = []
+    for number, definition in enumerate(definitions, 1):
+        if not isinstance(definition, dict) or not definition.get('url'):
+            raise ValueError(f"{path}: endpoint {number} has no url")
+        api_key = definition.get('api_key') or os.environ.get(definition.get('api_key_env', 'NVIDIA_API_KEY'))
+        if not api_key:
+            raise ValueError(f"{path}: no API key for endpoint {number} "
+                             f"(set {definition.get('api_key_env', 'NVIDIA_API_KEY')})")
+        endpoints.append(Endpoint(
+            definition['url'],
+            api_key,
+            model=definition.get('model', DEFAULT_MODEL),
+            rate_limiter=RateLimiter(definition.get('rpm', requests_per_minute),
+                                     definition.get('tpm', tokens_per_minute), burst=burst),
+            weight=definition.get('weight', 1.0),
+            name=definition.get('name')
+        ))
+    return endpoints
+
+
+class ReviewProvider(ABC):
+    """Interface the review pipeline expects from a review backend
+    
+    Implementations generate reviews for entries (singly and in batches) and
+    expose a request hash for caching/resume, a `token_meter` for throughput
+    reporting and a `stream` flag. DeepSeekAPI is the OpenAI-compatible HTTP
+    implementation.
+    """
+    
+    cache = None
+    stream = False
+    # Optional TokenBudget; the pipeline stops starting requests once it is spent
+    token_budget = None
+    
+    @abstractmethod
+    def request_hash(self, music_info):
+        """Key of the request an entry produces, for the cache and the run journal"""
+    
+    @abstractmethod
+    def generate_review(self, music_info, stream_sink=None, metrics=None):
+        """Return the review text for an entry, or None if generation failed"""
+    
+    @abstractmethod
+    def generate_batch_reviews(self, music_entries, metrics=None):
+        """Return {序号: review} for the entries a single request produced"""
+    
+    def cached_review(self, music_info):
+        """Return the cached review for an entry, or None"""
+        if self.cache is None:
+            return None
+        cached_review = self.cache.get(self.request_hash(music_info))
+        if cached_review is not None:
+            logger.info(f"Cache hit for: {music_info['歌曲名']}")
+        return cached_review
+    
+    def store_review(self, music_info, review_text):
+        """Cache a review under the entry's single-request key"""
+        if self.cache is not None:
+            self.cache.put(self.request_hash(music_info), review_text)
+    
+    def forget_review(self, music_info):
+        """Drop an entry's cached review so the next request regenerates it"""
+        if self.cache is not None:
+            self.cache.delete(self.request_hash(music_info))
+    
+    def connection_summary(self):
+        return "n/a"
+    
+    def close(self):
+        pass
+
+
+class DeepSeekAPI(ReviewProvider):
+    """OpenAI-compatible chat-completions provider (DeepSeek R1 on NVIDIA by default)
+    
+    With `endpoints` (a list of Endpoint), every attempt is routed to one of
+    them by an EndpointRouter; each endpoint has its own key, model and rate
+    limiter, and failing endpoints are skipped by their circuit breakers. The
+    cache key uses the first endpoint's model, so routed endpoints are expected
+    to serve equivalent models. With `simulation_mode`, requests go to a
+    SimulatedBackend (or the `session` given) instead of the network, through
+    the same rate limiting, retry and streaming code.
+    """
+    
+    def __init__(self, api_key=None, keep_thinking=False, simulation_mode=False, rate_limiter=None,
+                 cache=None, stream=False, api_url=None, session=None, pool_size=10, http2=False,
+                 connect_timeout=10, read_timeout=120, max_retries=5, http_retries=2, endpoints=None,
+                 max_tokens=None, token_budget=None):
+        if endpoints:
+            self.api_key = endpoints[0].api_key
+        else:
+            self.api_key = api_key or os.environ.get("NVIDIA_API_KEY") or ("simulation" if simulation_mode else None)
+            if not self.api_key:
+                logger.error("No API key provided. Please set the NVIDIA_API_KEY environment variable.")
+                raise ValueError("No API key provided")
+            # Rate limiting parameters
+            # Note: DeepSeek API technically doesn't have a hard limit
+            # But we'll stay conservative (10 requests/min) unless configured otherwise.
+            # The limiter is shared across worker threads so concurrent requests honour one budget
+            endpoints = [Endpoint(api_url or API_URL, self.api_key,
+                                  rate_limiter=rate_limiter or RateLimiter(requests_per_minute=10))]
+        if len(endpoints) == 1:
+            # With nowhere to fail over to, an open circuit would only stall every worker
+            endpoints[0].breaker.enabled = False
+        self.router = EndpointRouter(endpoints)
+        self.endpoints = self.router.endpoints
+        
+        # The primary endpoint, for callers that only know about one
+        self.api_url = endpoints[0].url
+        self.headers = endpoints[0].headers
+        self.rate_limiter = endpoints[0].rate_limiter
+        
+        # Pooled keep-alive session shared by all worker threads (and endpoints)
+        if session is None:
+            session = SimulatedBackend() if simulation_mode else create_http_session(pool_size, http_retries, http2)
+        self.session = session
+        self._transport_errors = getattr(self.session, 'transport_errors', None)
+        if self._transport_errors is None:
+            import requests
+            self._transport_errors = (requests.exceptions.RequestException,)
+        # Separate connect/read timeouts (DeepSeek may take time to respond)
+        self.timeout = (connect_timeout, read_timeout)
+        self.connection_stats = {'requests': 0, 'new_connections': 0, 'setup_time': 0.0}
+        # Completion calls (a batch or a single entry), however many HTTP attempts each took
+        self.completion_calls = 0
+        self._stats_lock = threading.Lock()
+        
+        # New options
+        self.keep_thinking = keep_thinking
+        self.simulation_mode = simulation_mode
+        self.cache = cache
+        self.stream = stream
+        # Completion tokens received, for live throughput reporting
+        self.token_meter = ThroughputMeter()
+        
+        # Model settings
+        self.model = endpoints[0].model
+        self.temperature = 0.6  # DeepSeek R1 recommends 0.5-0.7 for best results
+        
+        # Maximum attempts; waits between them come from the rate limiter's backoff
+        self.max_retries = max_retries
+        # Completion cap sent with every request (None leaves it to the server)
+        self.max_tokens = max_tokens
+        self.token_budget = token_budget
+        # Expected completion size per entry, used to reserve tokens before the usage
+        # is known; learned from the responses so the tokens-per-minute quota is met
+        self.expected_completion_tokens = min(1500, max_tokens) if max_tokens else 1500
+        
+    def request_hash(self, music_info):
+        """Hash of everything that determines the review generated for an entry"""
+        templates = get_templates()
+        # Any endpoint may answer, so every configured model is part of the request
+        models = '+'.join(sorted({endpoint.model for endpoint in self.endpoints}))
+        return ResponseCache.make_key(models, self.temperature, self.keep_thinking,
+                                      templates.render_prompt(music_info), templates.entry_hash(music_info),
+                                      max_tokens=self.max_tokens)
+    
+    def generate_review(self, music_info, stream_sink=None, metrics=None):
+        """Generate a music review using DeepSeek R1 model
+        
+        In streaming mode the visible review text is passed to `stream_sink`
+        (see ReviewStreamWriter) as it arrives; `stream_sink.begin()` is called
+        at the start of every attempt so a retried stream starts from scratch.
+        Per-request measurements go into `metrics` (see new_request_metrics).
+        """
+        
+        # Format a prompt for DeepSeek R1
+        prompt = build_prompt(music_info)
+        
+        # Serve repeated requests from the local cache
+        cached_review = self.cached_review(music_info)
+        if cached_review is not None:
+            if metrics is not None:
+                metrics['cache_hit'] = True
+            return cached_review
+        
+        review_text = self._request_completion(prompt, music_info['歌曲名'], stream_sink, metrics=metrics)
+        if review_text:
+            self.store_review(music_info, review_text)
+        return review_text
+    
+    def generate_batch_reviews(self, music_entries, metrics=None):
+        """Generate reviews for several entries with a single batched request
+        
+        Returns a dict mapping each entry's 序号 to its review; entries missing
+        from (or unparseable in) the response are simply absent, so the caller
+        can fall back to single-entry requests for them.
+        """
+        label = f"batch of {len(music_entries)} ({', '.join(info['序号'] for info in music_entries)})"
+        # Batches are not streamed: the JSON has to be complete before it can be split
+        response_text = self._request_completion(build_batch_prompt(music_entries), label, stream=False,
+                                                 metrics=metrics, entries=len(music_entries))
+        if not response_text:
+            return {}
+        
+        reviews = parse_batch_response(response_text)
+        expected = {info['序号'] for info in music_entries}
+        missing = expected - set(reviews)
+        if missing:
+            logger.warning(f"Batch response is missing reviews for entries: {', '.join(sorted(missing))}")
+        return {key: review for key, review in reviews.items() if key in expected}
+    
+    def _request_completion(self, prompt, label, stream_sink=None, stream=None, metrics=None, entries=1):
+        """Send a prompt with rate limiting and retries; returns the visible response text or None
+        
+        Timings (rate-limit sleep, network time, time to first token), token
+        counts (prompt, completion and reasoning) and the retry count are
+        accumulated into the `metrics` dict. `entries` is the number of reviews
+        the prompt asks for.
+        """
+        stream = self.stream if stream is None else stream
+        metrics = metrics if metrics is not None else new_request_metrics()
+        with self._stats_lock:
+            self.completion_calls += 1
+        
+        # Prepare API request payload (the model is set per endpoint)
+        payload = {
+            "temperature": self.temperature,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ]
+        }
+        
+        # Add thinking option if requested
+        if self.keep_thinking:
+            payload["parameters"] = {
+                "keep_thinking": True
+            }
+        
+        if stream:
+            payload["stream"] = True
+        if self.max_tokens:
+            payload["max_tokens"] = self.max_tokens
+        
+        expected_completion = self.expected_completion_tokens * entries
+        if self.max_tokens:
+            expected_completion = min(expected_completion, self.max_tokens)
+        estimated_tokens = estimate_tokens(prompt) + int(expected_completion)
+        failed_endpoint = None
+        # Endpoints unreachable since the last backoff; once all are, the next round waits
+        unreachable = set()
+        
+        for retry_count in range(self.max_retries):
+            metrics['retries'] = retry_count
+            # Route each attempt; after a failure another endpoint is preferred
+            endpoint, waited = self.router.choose(exclude=unreachable | {failed_endpoint})
+            metrics['backoff_sleep_s'] += waited
+            failed_endpoint = endpoint
+            try:
+                # Rate limiting: sleep if necessary to maintain this endpoint's rate limit
+                metrics['rate_limit_sleep_s'] += endpoint.rate_limiter.acquire(estimated_tokens)
+                
+                # Make API request
+                if len(self.endpoints) > 1:
+                    logger.info(f"Sending request to {endpoint.name} for: {label}")
+                elif self.simulation_mode:
+                    logger.info(f"SIMULATION MODE: Sending request to the simulated backend for: {label}")
+                else:
+                    logger.info(f"Sending request to DeepSeek API for: {label}")
+                _reset_connection_timing()
+                request_started = time.perf_counter()
+                response = self.session.post(
+                    endpoint.url,
+                    headers=endpoint.headers,
+                    json=dict(payload, model=endpoint.model),
+                    timeout=self.timeout,
+                    stream=stream
+                )
+                self._record_connection_timing()
+                
+                # Handle different response statuses
+                if response.status_code == 200:
+                    endpoint.rate_limiter.on_success()
+                    if stream:
+                        review_text, usage, reasoning = self._read_stream(response, stream_sink, metrics,
+                                                                          request_started)
+                    else:
+                        result = response.json()
+                        # Without streaming the whole body arrives at once
+                        metrics['ttft_s'] = time.perf_counter() - request_started
+                        usage = result.get("usage") or {}
+                        # Extract review text from response
+                        review_text = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+                        self.token_meter.add(usage.get("completion_tokens") or estimate_tokens(review_text))
+                        reasoning = None
+                    metrics['network_s'] += time.perf_counter() - request_started
+                    endpoint.record_success(time.perf_counter() - request_started)
+                    self._account_tokens(usage, prompt, review_text, reasoning, metrics, entries)
+                    endpoint.rate_limiter.record_tokens(metrics['prompt_tokens'] + metrics['completion_tokens'],
+                                                        estimated_tokens)
+                    
+                    if not review_text:
+                        logger.error(f"Empty response received for {label}")
+                        return None
+                    
+                    # 移除思考过程（如果不需要保留）; streamed text is already stripped incrementally
+                    if not self.keep_thinking and not stream:
+                        # 使用正则表达式移除<think>...</think>标签及其内容
+                        review_text = THINK_BLOCK_PATTERN.sub('', review_text)
+                        logger.info("思考过程已从结果中移除")
+                    
+                    return review_text
+                
+                elif response.status_code == 429:
+                    # Rate limit exceeded: slow down and pause every worker.
+                    # Reading the (small) body lets a streamed connection return to the pool
+                    response.content
+                    metrics['network_s'] += time.perf_counter() - request_started
+                    endpoint.record_throttle()
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    wait_time = endpoint.rate_limiter.on_throttle(retry_after, retry_count)
+                    logger.warning(f"Rate limit exceeded. Attempt {retry_count+1}/{self.max_retries}. "
+                                  f"Pausing {endpoint.name} for {wait_time:.1f} seconds")
+                    continue
+                
+                else:
+                    # Other error
+                    logger.error(f"API request failed with status {response.status_code}: {response.text}")
+                    metrics['network_s'] += time.perf_counter() - request_started
+                    # If it's server error (5xx), retry with exponential backoff
+                    if 500 <= response.status_code < 600:
+                        endpoint.record_failure()
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        wait_time = endpoint.rate_limiter.on_throttle(retry_after, retry_count)
+                        logger.info(f"Server error, retrying in {wait_time:.1f} seconds. "
+                                   f"Attempt {retry_count+1}/{self.max_retries}")
+                        continue
+                    # A rejected key only concerns this endpoint; others may still work
+                    if response.status_code in (401, 403) and len(self.endpoints) > 1:
+                        endpoint.record_failure()
+                        continue
+                    # The endpoint answered; the request itself is at fault
+                    endpoint.breaker.record_success()
+                    return None
+                
+            except self._transport_errors as e:
+                self._record_connection_timing()
+                endpoint.record_failure()
+                logger.error(f"Request exception: {str(e)}")
+                unreachable.add(endpoint)
+                if len(unreachable) < len(self.endpoints):
+                    # Fail over straight away while some endpoint has not been tried
+                    continue
+                # Every endpoint is down (e.g. a local network outage): back off before the next round
+                unreachable.clear()
+                wait_time = endpoint.rate_limiter.backoff_delay(retry_count)
+                logger.info(f"Network error, retrying in {wait_time:.1f} seconds. "
+                           f"Attempt {retry_count+1}/{self.max_retries}")
+                time.sleep(wait_time)
+                metrics['backoff_sleep_s'] += wait_time
+                continue
+            
+            except Exception as e:
+                # Settle a half-open probe so the endpoint is not left in limbo
+                endpoint.breaker.record_failure()
+                logger.error(f"Error generating review: {str(e)}")
+                return None
+        
+        logger.error(f"Failed to generate review for {label} after {self.max_retries} retries")
+        return None
+    
+    def _account_tokens(self, usage, prompt, text, reasoning, metrics, entries=1):
+        """Record a response's token usage in `metrics`, charge the run budget and refine the estimate
+        
+        Counts missing from `usage` are estimated from the text. Reasoning
+        tokens come from the API's completion_tokens_details when reported;
+        otherwise they are estimated from the <think> text (`reasoning`, as
+        removed by the stream stripper, or the blocks still in `text`).
+        """
+        prompt_tokens = usage.get("prompt_tokens") or estimate_tokens(prompt)
+        completion_tokens = usage.get("completion_tokens") or estimate_tokens(text or '')
+        reasoning_tokens = (usage.get("completion_tokens_details") or {}).get("reasoning_tokens")
+        if reasoning_tokens is None:
+            if reasoning is None:
+                reasoning = ''.join(THINK_CONTENT_PATTERN.findall(text or ''))
+            reasoning_tokens = estimate_tokens(reasoning) if reasoning else 0
+        metrics['prompt_tokens'] = prompt_tokens
+        metrics['completion_tokens'] = completion_tokens
+        metrics['reasoning_tokens'] = reasoning_tokens
+        if self.token_budget is not None:
+            self.token_budget.charge(prompt_tokens + completion_tokens)
+        with self._stats_lock:
+            # Moving average of the completion size per entry, used for rate-limit reservations
+            self.expected_completion_tokens = (0.8 * self.expected_completion_tokens
+                                               + 0.2 * completion_tokens / max(1, entries))
+    
+    def _record_connection_timing(self):
+        """Fold this thread's connection-setup time for the last request into the totals"""
+        setup_time = getattr(_connection_timing, 'setup_time', 0.0)
+        new_connections = getattr(_connection_timing, 'new_connections', 0)
+        _reset_connection_timing()
+        with self._stats_lock:
+            self.connection_stats['requests'] += 1
+            self.connection_stats['new_connections'] += new_connections
+            self.connection_stats['setup_time'] += setup_time
+        if new_connections:
+            logger.debug(f"Connection setup took {setup_time * 1000:.1f} ms")
+        else:
+            logger.debug("Reused pooled connection")
+    
+    def connection_summary(self):
+        """Human-readable summary of connection reuse"""
+        with self._stats_lock:
+            stats = dict(self.connection_stats)
+        average = (stats['setup_time'] / stats['new_connections'] * 1000) if stats['new_connections'] else 0.0
+        return (f"{stats['requests']} requests over {stats['new_connections']} new connections, "
+                f"{stats['setup_time']:.2f}s total setup ({average:.1f} ms per connection)")
+    
+    def endpoint_summary(self):
+        """Per-endpoint request, failure, latency and circuit state lines"""
+        return self.router.summary()
+    
+    def close(self):
+        """Release pooled connections"""
+        self.session.close()
+    
+    def _read_stream(self, response, stream_sink=None, metrics=None, request_started=None):
+        """Consume an SSE chat-completion stream; returns (visible review text, usage dict, removed reasoning)
+        
+        The reasoning is None when thinking is kept (it is then part of the text).
+        """
+        stripper = None if self.keep_thinking else ThinkStripper()
+        parts = []
+        usage = {}
+        if stream_sink is not None:
+            stream_sink.begin()
+        
+        def emit(text):
+            if text:
+                parts.append(text)
+                if stream_sink is not None:
+                    stream_sink.write(text)
+        
+        # Server-sent events are always UTF-8, whatever the Content-Type says
+        response.encoding = 'utf-8'
+        lines = response.iter_lines(decode_unicode=True)
+        try:
+            for data in iter_sse_data(lines):
+                try:
+                    chunk = json.loads(data)
+                except ValueError:
+                    logger.warning(f"Ignoring malformed stream chunk: {data[:100]}")
+                    continue
+                usage = chunk.get("usage") or usage
+                choices = chunk.get("choices") or [{}]
+                content = (choices[0].get("delta") or {}).get("content") or ""
+                if not content:
+                    continue
+                if metrics is not None and metrics.get('ttft_s') is None:
+                    metrics['ttft_s'] = time.perf_counter() - request_started
+                # Each content delta is roughly one token
+                self.token_meter.add(1)
+                emit(stripper.feed(content) if stripper else content)
+            if stripper:
+                emit(stripper.flush())
+            # Drain whatever follows [DONE] so the connection can go back to the pool
+            for _ in lines:
+                pass
+        finally:
+            response.close()
+        return ''.join(parts).strip(), usage, stripper.reasoning if stripper else None
+
+
+def split_md_table_row(line):
+    """Split a markdown table row into stripped cells, honouring escaped pipes (\\|)"""
+    line = line.strip()
+    if line.startswith('|'):
+        line = line[1:]
+    if line.endswith('|') and not line.endswith('\\|'):
+        line = line[:-1]
+    if '\\|' not in line:
+        # Fast path for the common case without escaped pipes
+        return [cell.strip() for cell in line.split('|')]
+    return [cell.strip().replace('\\|', '|') for cell in re.split(r'(?<!\\)\|', line)]
+
+
+def _is_md_separator_row(cells):
+    return bool(cells) and all(re.fullmatch(r':?-{3,}:?', cell) for cell in cells)
+
+
+_ID_COLUMN_NAMES = {'序号'} | {alias for alias, field in COLUMN_ALIASES.items() if field == '序号'}
+
+
+def _normalize_column(name):
+    name = str(name).strip()
+    return COLUMN_ALIASES.get(name.lower(), name)
+
+
+def _build_music_info(values, line_number, source):
+    """Turn a column->value mapping into a music entry, or report it as a bad row"""
+    music_info = {field: str(values.get(field) or '').strip() for field in MUSIC_FIELDS}
+    missing = [field for field in REQUIRED_FIELDS if not music_info[field]]
+    if missing:
+        logger.warning(f"{source}:{line_number}: skipping row without {', '.join(missing)}")
+        return None
+    return music_info
+
+
+def extract_music_info_from_md_line(line, columns=None):
+    """Extract music information from a markdown table line
+    
+    `columns` maps cells to field names (taken from the table header); without
+    it the Douban column order is assumed.
+    """
+    if not line.strip() or not line.lstrip().startswith('|'):
+        return None
+    
+    cells = split_md_table_row(line)
+    columns = columns or MUSIC_FIELDS
+    if _is_md_separator_row(cells) or len(cells) < len(columns):
+        return None
+    # The header row itself is not an entry
+    if [_normalize_column(cell) for cell in cells[:len(columns)]] == list(columns):
+        return None
+    
+    music_info = {field: '' for field in MUSIC_FIELDS}
+    for column, cell in zip(columns, cells):
+        if column in music_info:
+            music_info[column] = cell
+    return music_info
+
+
+def parse_music_table(lines, source='<input>'):
+    """Lazily yield entries from markdown table lines, mapping columns from the header row
+    
+    `lines` is any iterable of strings (an open file, `text.splitlines()`, ...);
+    `source` only labels the warnings for skipped rows.
+    """
+    columns = None
+    for line_number, line in enumerate(lines, 1):
+        if not line.lstrip().startswith('|'):
+            continue
+        cells = split_md_table_row(line)
+        if _is_md_separator_row(cells):
+            continue
+        
+        # Only rows naming an id column can be headers; skip normalising every data row
+        if not _ID_COLUMN_NAMES.isdisjoint(map(str.lower, cells)):
+            normalized = [_normalize_column(cell) for cell in cells]
+            if '序号' in normalized and '歌曲名' in normalized:
+                # A (new) header row defines the column mapping for the rows below it
+                columns = normalized
+                continue
+        
+        row_columns = columns or MUSIC_FIELDS
+        if len(cells) != len(row_columns):
+            logger.warning(f"{source}:{line_number}: expected {len(row_columns)} columns, "
+                           f"found {len(cells)}; skipping row")
+            continue
+        music_info = _build_music_info(dict(zip(row_columns, cells)), line_number, source)
+        if music_info:
+            yield music_info
+
+
+def _iter_markdown_entries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from parse_music_table(f, path)
+
+
+def _iter_csv_entries(path):
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = [_normalize_column(name) for name in header]
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            if len(row) != len(columns):
+                logger.warning(f"{path}:{reader.line_num}: expected {len(columns)} columns, "
+                               f"found {len(row)}; skipping row")
+                continue
+            music_info = _build_music_info(dict(zip(columns, row)), reader.line_num, path)
+            if music_info:
+                yield music_info
+
+
+def _iter_jsonl_entries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                logger.warning(f"{path}:{line_number}: invalid JSON ({str(e)}); skipping row")
+                continue
+            if not isinstance(record, dict):
+                logger.warning(f"{path}:{line_number}: expected a JSON object; skipping row")
+                continue
+            record = {_normalize_column(key): value for key, value in record.items()}
+            music_info = _build_music_info(record, line_number, path)
+            if music_info:
+                yield music_info
+
+
+def _iter_parquet_entries(path, batch_size=10000):
+    """Read a Parquet file in record batches (pyarrow), falling back to pandas"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        pq = None
+    
+    if pq is not None:
+        batches = (batch.to_pylist() for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size))
+    else:
+        import pandas as pd
+        batches = [pd.read_parquet(path).to_dict('records')]
+    
+    row_number = 0
+    for records in batches:
+        for record in records:
+            row_number += 1
+            record = {_normalize_column(key): value for key, value in record.items()}
+            music_info = _build_music_info(record, row_number, path)
+            if music_info:
+                yield music_info
+
+
+def iter_music_entries(path):
+    """Lazily yield music entries from a catalogue file
+    
+    Markdown tables, CSV, JSONL and Parquet are recognised by extension.
+    Columns are mapped by header name; rows that cannot be read are logged
+    with their line (or row) number and skipped.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return _iter_csv_entries(path)
+    if extension in ('.jsonl', '.ndjson'):
+        return _iter_jsonl_entries(path)
+    if extension in ('.parquet', '.pq'):
+        return _iter_parquet_entries(path)
+    return _iter_markdown_entries(path)
+
+
+UNSAFE_FILENAME_CHARS = re.compile(r'[^\w\s.-]')
+WHITESPACE_RUN = re.compile(r'\s+')
+
+
+def sanitize_filename(name):
+    """Convert a string into a safe filename"""
+    # Remove characters that are not allowed in filenames
+    safe_name = UNSAFE_FILENAME_CHARS.sub('_', name)
+    # Replace spaces with underscores
+    safe_name = WHITESPACE_RUN.sub('_', safe_name)
+    # Remove leading/trailing periods, spaces, and underscores
+    safe_name = safe_name.strip('._')
+    # Ensure we have a valid filename
+    if not safe_name:
+        safe_name = "untitled"
+    return safe_name
+
+
+def review_filepath(music_info, output_dir, layout=None):
+    """Path of the review file for a music entry (planned by `layout` when given)"""
+    if layout is not None:
+        return layout.path_for(music_info)
+    # Use the song name as the filename
+    song_name = music_info['歌曲名'].split('/')[0].strip()  # Take just the primary name
+    filename = sanitize_filename(song_name) + '.md'
+    return os.path.join(output_dir, filename)
+
+
+def atomic_write_text(filepath, content):
+    """Write a text file via a temp file + rename so readers never see a partial file"""
+    directory = os.path.dirname(filepath) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def render_review_header(music_info):
+    """Render the metadata header that precedes a review"""
+    return get_templates().render_header(music_info)
+
+
+def render_review_markdown(music_info, review_text):
+    """Render the complete markdown document for a review"""
+    return render_review_header(music_info) + f"{review_text}\n"
+
+
+# Characters a complete review may end with
+# Sentence endings; a colon ends a lead-in to the closing tags ("互动话题：")
+TERMINAL_PUNCTUATION = set('。！？!?.…~～」』”"）)】》*：:')
+# Emoji and other symbols (plus the joiners and variation selectors that build emoji sequences)
+SYMBOL_CATEGORIES = ('So', 'Sk')
+EMOJI_JOINERS = '\u200d\ufe0e\ufe0f'
+# #话题 tags: '#' followed by text (not a space, so not a heading) and not part of a URL query/fragment
+HASHTAG_PATTERN = re.compile(r'(?<![/&=?])[#＃]([^\s#＃，。,.!！?？、;；:：]+)')
+TAG_LINE_PATTERN = re.compile(r'^(?:\s*[#＃][^\s#＃]+[#＃]?)+\s*$')
+CJK_PATTERN = re.compile(r'[㐀-鿿豈-﫿]')
+LATIN_PATTERN = re.compile(r'[A-Za-z]')
+# Reasoning blocks, including one cut off before its closing tag
+STRAY_THINK_PATTERN = re.compile(r'<think>.*?(?:</think>|$)\s*', re.DOTALL)
+# Whitespace and markdown markup, not counted towards a Chinese review's length
+MARKUP_CHARS_PATTERN = re.compile(r'[\s#*>`_\-]')
+
+
+class ReviewValidator:
+    """Check and normalise generated reviews in a single pass over their lines
+    
+    Normalisation strips stray <think> blocks, trailing whitespace and extra
+    blank lines, and rewrites tag-only lines as "#a #b" without duplicates.
+    Problems reported: 'empty', 'too_short', 'too_long', 'missing_title',
+    'too_few_tags', 'too_many_tags', 'truncated' and 'wrong_language'.
+    Lengths are counted in characters for Chinese and in words otherwise; the
+    defaults leave some slack around the 300-500 the prompt asks for, and
+    allow for tags repeated between the title and the closing line.
+    """
+    
+    def __init__(self, language=DEFAULT_LANGUAGE, min_length=250, max_length=800, min_tags=2, max_tags=6):
+        self.language = language
+        self.min_length = min_length
+        self.max_length = max_length
+        self.min_tags = min_tags
+        self.max_tags = max_tags
+    
+    def check(self, text):
+        """Return (normalised text, list of problems)"""
+        text = STRAY_THINK_PATTERN.sub('', text or '')
+        lines = []
+        tags = []
+        length = 0
+        cjk = latin = 0
+        last_content_line = ''
+        blank = False
+        in_fence = False
+        
+        for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+            # Two trailing spaces are a Markdown hard line break (used under section headings)
+            hard_break = line.endswith('  ') and bool(line.strip())
+            line = line.rstrip() + ('  ' if hard_break else '')
+            if not line.strip():
+                # Collapse runs of blank lines
+                blank = bool(lines)
+                continue
+            if line.lstrip().startswith('```'):
+                in_fence = not in_fence
+            if blank:
+                lines.append('')
+                blank = False
+            
+            line_tags = HASHTAG_PATTERN.findall(line)
+            tags.extend(line_tags)
+            if line_tags and TAG_LINE_PATTERN.match(line):
+                line = ' '.join(f"#{tag}" for tag in dict.fromkeys(line_tags)) + ('  ' if hard_break else '')
+                lines.append(line)
+                continue
+            
+            lines.append(line)
+            if len(lines) > 1:
+                # The title line does not count towards the length
+                last_content_line = line
+                if self.language == 'zh':
+                    length += len(MARKUP_CHARS_PATTERN.sub('', line))
+                else:
+                    length += len(line.split())
+            cjk += len(CJK_PATTERN.findall(line))
+            latin += len(LATIN_PATTERN.findall(line))
+        
+        normalized = '\n'.join(lines)
+        if not lines:
+            return normalized, ['empty']
+        
+        problems = []
+        if length < self.min_length:
+            problems.append('too_short')
+        elif length > self.max_length:
+            problems.append('too_long')
+        
+        # Reviews often lead their title with an emoji ("🎶 **...**") and end it with its tags
+        title = HASHTAG_PATTERN.sub('', self._strip_symbols(lines[0])).strip()
+        if not (title.startswith('#') or title[:1] in '【《「' or (len(title) <= 40 and title[-1:] not in '。，,')):
+            problems.append('missing_title')
+        
+        tag_count = len(dict.fromkeys(tags))
+        if tag_count < self.min_tags:
+            problems.append('too_few_tags')
+        elif tag_count > self.max_tags:
+            problems.append('too_many_tags')
+        
+        if in_fence or (last_content_line and not self._ends_sentence(last_content_line)):
+            problems.append('truncated')
+        
+        letters = cjk + latin
+        if letters:
+            cjk_share = cjk / letters
+            if (self.language == 'zh' and cjk_share < 0.5) or (self.language != 'zh' and cjk_share > 0.2):
+                problems.append('wrong_language')
+        return normalized, problems
+    
+    @staticmethod
+    def _strip_symbols(line):
+        """The line without leading whitespace, emoji and other symbols"""
+        index = 0
+        while index < len(line) and (line[index].isspace() or line[index] in EMOJI_JOINERS
+                                     or unicodedata.category(line[index]) in SYMBOL_CATEGORIES):
+            index += 1
+        return line[index:].rstrip()
+    
+    @staticmethod
+    def _ends_sentence(line):
+        """Whether a line ends in terminal punctuation or a closing emoji/symbol"""
+        line = line.rstrip().rstrip(EMOJI_JOINERS)
+        return bool(line) and (line[-1] in TERMINAL_PUNCTUATION
+                               or unicodedata.category(line[-1]) in SYMBOL_CATEGORIES)
+
+
+def split_review_file(content):
+    """Split a saved review file into (metadata header, review body)
+    
+    The header is the leading "# title" line and the "- key: value" lines
+    below it, as written by the review_header template.
+    """
+    lines = content.split('\n')
+    index = 0
+    if lines and lines[0].startswith('# '):
+        index = 1
+        while index < len(lines) and (not lines[index].strip() or lines[index].startswith('- ')):
+            if not lines[index].strip() and index > 1 and lines[index - 1].startswith('- '):
+                index += 1
+                break
+            index += 1
+    header = '\n'.join(lines[:index])
+    if header:
+        header += '\n'
+    return header, '\n'.join(lines[index:])
+
+
+def list_review_files(paths):
+    """Review files named by `paths`: files as given, directories scanned recursively for *.md"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            # Recursive, so sharded output directories are covered
+            files.extend(sorted(str(p) for p in Path(path).rglob('*.md') if not p.name.startswith('.')))
+        else:
+            files.append(path)
+    return files
+
+
+def validate_review_files(paths, language=DEFAULT_LANGUAGE, fix=False):
+    """Revalidate saved review files offline
+    
+    `paths` are files or directories (scanned for *.md). With `fix`, files
+    whose body changes under normalisation are rewritten atomically. Returns
+    {path: problems} for every file checked.
+    """
+    validator = ReviewValidator(language)
+    files = list_review_files(paths)
+    
+    report = {}
+    fixed = 0
+    started = time.perf_counter()
+    for filepath in files:
+        try:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except OSError as e:
+            logger.error(f"Could not read {filepath}: {str(e)}")
+            continue
+        new_content, problems = reprocess_review_text(content, validator)
+        report[filepath] = problems
+        if problems:
+            logger.warning(f"{filepath}: {', '.join(problems)}")
+        if fix and new_content != content:
+            atomic_write_text(filepath, new_content)
+            fixed += 1
+    
+    elapsed = time.perf_counter() - started
+    failing = sum(1 for problems in report.values() if problems)
+    rate = len(report) / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Validated {len(report)} reviews in {elapsed:.2f}s ({rate:.0f}/s): "
+                f"{failing} with problems, {fixed} normalised")
+    return report
+
+
+INDEX_FILENAME = ".review_index.sqlite3"
+
+# Header labels of the bundled English template, mapped to the catalogue columns
+HEADER_LABELS = {
+    'Artist': '表演者', 'Release date': '发行时间', 'Genre': '流派',
+    'Release type': '专辑类型', 'Medium': '介质', 'Rating': '评分'
+}
+INDEX_COLUMNS = ['歌曲名', '表演者', '发行时间', '流派', '专辑类型', '介质', '评分']
+
+
+def parse_review_file(content):
+    """Parse a saved review into its metadata (catalogue columns) and body"""
+    header, body = split_review_file(content)
+    metadata = {column: '' for column in INDEX_COLUMNS}
+    for line in header.split('\n'):
+        if line.startswith('# '):
+            # "# <歌曲名> - 乐评"
+            metadata['歌曲名'] = line[2:].rsplit(' - ', 1)[0].strip()
+        elif line.startswith('- ') and ':' in line:
+            label, value = line[2:].split(':', 1)
+            column = HEADER_LABELS.get(label.strip(), label.strip())
+            if column in metadata:
+                metadata[column] = value.strip()
+    return metadata, body.strip()
+
+
+class ReviewIndex:
+    """SQLite index of saved reviews (metadata header + body) with full-text search
+    
+    `update()` rescans a review directory and only re-reads files whose mtime
+    or size changed. Text search uses an FTS5 trigram index, which handles
+    Chinese without word segmentation; terms shorter than three characters
+    (and SQLite builds without FTS5) fall back to LIKE scans.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS reviews (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                title TEXT, artist TEXT, release_date TEXT, genre TEXT,
+                release_type TEXT, medium TEXT, rating TEXT,
+                body TEXT NOT NULL
+            )
+        """)
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(title, artist, body, tokenize='trigram')"
+            )
+            self.fts = True
+        except sqlite3.OperationalError:
+            logger.warning("SQLite has no FTS5 trigram tokenizer; searches will scan the reviews")
+            self.fts = False
+        self._conn.commit()
+    
+    def update(self, directory):
+        """Index new and modified reviews in `directory` and drop deleted ones; returns counts"""
+        started = time.perf_counter()
+        known = {path: (mtime, size) for path, mtime, size in
+                 self._conn.execute("SELECT path, mtime, size FROM reviews")}
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+        seen = set()
+        with self._conn:
+            for path, stat in self._scan(directory):
+                seen.add(path)
+                if known.get(path) == (stat.st_mtime, stat.st_size):
+                    counts['unchanged'] += 1
+                    continue
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        metadata, body = parse_review_file(f.read())
+                except (OSError, UnicodeDecodeError) as e:
+                    logger.warning(f"Could not index {path}: {str(e)}")
+                    continue
+                counts['updated' if path in known else 'added'] += 1
+                self._remove(path)
+                cursor = self._conn.execute(
+                    "INSERT INTO reviews (path, mtime, size, title, artist, release_date, genre, release_type, "
+                    "medium, rating, body) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [path, stat.st_mtime, stat.st_size] + [metadata[column] for column in INDEX_COLUMNS] + [body]
+                )
+                if self.fts:
+                    self._conn.execute("INSERT INTO reviews_fts (rowid, title, artist, body) VALUES (?, ?, ?, ?)",
+                                       (cursor.lastrowid, metadata['歌曲名'], metadata['表演者'], body))
+            for path in set(known) - seen:
+                self._remove(path)
+                counts['removed'] += 1
+        logger.info(f"Review index updated in {time.perf_counter() - started:.2f}s: "
+                    + ', '.join(f"{count} {name}" for name, count in counts.items()))
+        return counts
+    
+    @staticmethod
+    def _scan(directory):
+        """Yield (absolute path, stat) of the review files under `directory`, including shard subdirectories"""
+        pending = [directory]
+        while pending:
+            for entry in os.scandir(pending.pop()):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    pending.append(entry.path)
+                elif entry.name.endswith('.md') and entry.is_file():
+                    yield os.path.abspath(entry.path), entry.stat()
+    
+    def _remove(self, path):
+        row = self._conn.execute("SELECT id FROM reviews WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return
+        self._conn.execute("DELETE FROM reviews WHERE id = ?", row)
+        if self.fts:
+            self._conn.execute("DELETE FROM reviews_fts WHERE rowid = ?", row)
+    
+    def query(self, terms=(), genre=None, artist=None, limit=None):
+        """Yield matching reviews as dicts; every term must occur in the title, artist or body"""
+        sql = ("SELECT r.path, r.title, r.artist, r.release_date, r.genre, r.release_type, r.medium, r.rating, "
+               "r.body FROM reviews r")
+        conditions, params = [], []
+        long_terms = [term for term in terms if len(term) >= 3] if self.fts else []
+        if long_terms:
+            sql += " JOIN reviews_fts f ON f.rowid = r.id"
+            conditions.append("reviews_fts MATCH ?")
+            params.append(' AND '.join('"' + term.replace('"', '""') + '"' for term in long_terms))
+        for term in terms:
+            if term not in long_terms:
+                conditions.append("(r.title LIKE ? OR r.artist LIKE ? OR r.body LIKE ?)")
+                params += [f"%{term}%"] * 3
+        if genre:
+            conditions.append("r.genre = ?")
+            params.append(genre)
+        if artist:
+            conditions.append("r.artist LIKE ?")
+            params.append(f"%{artist}%")
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY r.title"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        fields = ['path'] + INDEX_COLUMNS + ['body']
+        for row in self._conn.execute(sql, params):
+            yield dict(zip(fields, row))
+    
+    def close(self):
+        self._conn.close()
+
+
+def review_snippet(body, terms, width=40):
+    """A short excerpt of `body` around the first matching term"""
+    positions = [body.find(term) for term in terms if term in body]
+    start = max(0, min(positions) - width // 2) if positions else 0
+    excerpt = body[start:start + width * 2].replace('\n', ' ')
+    return ('…' if start else '') + excerpt + ('…' if start + width * 2 < len(body) else '')
+
+
+def export_reviews(reviews, output_path):
+    """Write reviews (dicts from ReviewIndex.query) to .jsonl, .parquet or a combined .md; returns the count"""
+    reviews = list(reviews)
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        content = ''.join(json.dumps(review, ensure_ascii=False) + '\n' for review in reviews)
+        atomic_write_text(output_path, content)
+    elif extension in ('.parquet', '.pq'):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.Table.from_pylist(reviews), output_path)
+        except ImportError:
+            import pandas as pd
+            pd.DataFrame(reviews).to_parquet(output_path, index=False)
+    elif extension == '.md':
+        sections = [f"# 乐评合集\n\n共 {len(reviews)} 篇\n"]
+        for review in reviews:
+            # Parsed review files carry no 序号; header templates may still use any column
+            music_info = {field: review.get(field) or '' for field in MUSIC_FIELDS}
+            sections.append(render_review_markdown(music_info, review['body']))
+        atomic_write_text(output_path, '\n---\n\n'.join(sections))
+    else:
+        raise ValueError(f"Unsupported export format: {output_path} (use .jsonl, .parquet or .md)")
+    logger.info(f"Exported {len(reviews)} reviews to {output_path}")
+    return len(reviews)
+
+
+# Files per work unit handed to a reprocess worker; large enough to amortise pickling
+REPROCESS_CHUNK_SIZE = 256
+
+
+def reprocess_review_text(content, validator, rerender=False):
+    """Re-strip reasoning from and normalise a saved review, optionally re-rendering its header
+    
+    Returns (new content, problems). The header is re-rendered from the
+    metadata it already holds, with the active templates.
+    """
+    header, body = split_review_file(content)
+    normalized, problems = validator.check(body)
+    if rerender:
+        metadata, _ = parse_review_file(header)
+        metadata['序号'] = ''
+        header = render_review_header(metadata)
+    return header + normalized + '\n', problems
+
+
+def _init_reprocess_worker(templates_dir, language):
+    """Process pool initializer: activate the parent's templates in the worker"""
+    global _templates
+    _templates = TemplateSet(templates_dir, language)
+
+
+def _reprocess_chunk(paths, language, rerender, write):
+    """Reprocess one work unit of review files (runs in a worker process); returns [(path, changed, problems)]"""
+    validator = ReviewValidator(language)
+    results = []
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            new_content, problems = reprocess_review_text(content, validator, rerender)
+            changed = new_content != content
+            if changed and write:
+                atomic_write_text(path, new_content)
+        except (OSError, UnicodeDecodeError) as e:
+            changed, problems = False, [f"unreadable: {str(e)}"]
+        results.append((path, changed, problems))
+    return results
+
+
+def reprocess_reviews(paths, workers=None, chunk_size=REPROCESS_CHUNK_SIZE, rerender=False, write=True):
+    """Re-strip, normalise and optionally re-render saved reviews over a pool of processes
+    
+    The regex-heavy work is CPU-bound, so threads would serialise on the GIL.
+    Files are split into chunks of `chunk_size`; each worker process reads,
+    rewrites (atomically, when changed and `write`) and reports a chunk, and
+    at most two chunks per worker are in flight. With `workers` == 1
+    everything runs in this process. Returns a summary dict.
+    """
+    files = list_review_files(paths)
+    workers = max(1, int(workers or os.cpu_count() or 1))
+    chunk_size = max(1, int(chunk_size))
+    chunks = (files[i:i + chunk_size] for i in range(0, len(files), chunk_size))
+    templates = get_templates()
+    summary = {'files': 0, 'changed': 0, 'with_problems': 0, 'problems': {}}
+    
+    def collect(results):
+        for path, changed, problems in results:
+            summary['files'] += 1
+            summary['changed'] += changed
+            if problems:
+                summary['with_problems'] += 1
+                logger.debug(f"{path}: {', '.join(problems)}")
+            for problem in problems:
+                problem = problem.split(':', 1)[0]
+                summary['problems'][problem] = summary['problems'].get(problem, 0) + 1
+    
+    started = time.perf_counter()
+    if workers == 1:
+        for chunk in chunks:
+            collect(_reprocess_chunk(chunk, templates.language, rerender, write))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_reprocess_worker,
+                                 initargs=(templates.directory, templates.language)) as executor:
+            pending = set()
+            for chunk in chunks:
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future.result())
+                pending.add(executor.submit(_reprocess_chunk, chunk, templates.language, rerender, write))
+            for future in pending:
+                collect(future.result())
+    
+    summary['elapsed_s'] = round(time.perf_counter() - started, 3)
+    summary['files_per_s'] = round(summary['files'] / summary['elapsed_s'], 1) if summary['elapsed_s'] else None
+    action = 'rewrote' if write else 'would rewrite'
+    logger.info(f"Reprocessed {summary['files']} reviews in {summary['elapsed_s']:.2f}s "
+                f"({summary['files_per_s']}/s, {workers} workers): {action} {summary['changed']}, "
+                f"{summary['with_problems']} with problems {summary['problems'] or ''}".rstrip())
+    return summary
+
+
+def save_review(music_info, review_text, output_dir, layout=None):
+    """Save the review to a markdown file"""
+    try:
+        filepath = review_filepath(music_info, output_dir, layout)
+        
+        # 检查文件是否存在，记录覆盖日志（有路径规划时用规划前的目录扫描结果）
+        if layout.existed(filepath) if layout is not None else os.path.exists(filepath):
+            logger.info(f"覆盖已存在的评论文件: {filepath}")
+        
+        # Create the markdown content
+        markdown_content = render_review_markdown(music_info, review_text)
+        
+        # Write to file atomically so a kill mid-write cannot truncate the review
+        atomic_write_text(filepath, markdown_content)
+        
+        logger.info(f"Saved review to {filepath}")
+        return filepath
+    except Exception as e:
+        logger.error(f"Error saving review: {str(e)}")
+        return None
+
+
+class ReviewStreamWriter:
+    """Write a streamed review to disk progressively
+    
+    Text goes to a temp file next to the final path as it arrives; `commit()`
+    renames it into place once the stream has finished, so readers never see a
+    half-written review.
+    """
+    
+    def __init__(self, music_info, output_dir, layout=None):
+        self.music_info = music_info
+        self.filepath = review_filepath(music_info, output_dir, layout)
+        self.started = False
+        self._file = None
+        self._tmp_path = None
+    
+    def begin(self):
+        """Start (or restart, on retry) the review with a fresh header"""
+        if self._file is None:
+            fd, self._tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(self.filepath) or '.', prefix='.tmp-', suffix='.md'
+            )
+            self._file = os.fdopen(fd, 'w', encoding='utf-8')
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(render_review_header(self.music_info))
+        self._file.flush()
+        self._at_start = True
+        self._pending_whitespace = ''
+        self.started = True
+    
+    def write(self, text):
+        """Append streamed review text"""
+        # Match save_review, which writes the stripped review text: drop leading
+        # whitespace and hold back trailing whitespace until more text follows
+        text = self._pending_whitespace + text
+        if self._at_start:
+            text = text.lstrip()
+            if not text:
+                return
+            self._at_start = False
+        body = text.rstrip()
+        self._pending_whitespace = text[len(body):]
+        self._file.write(body)
+        self._file.flush()
+    
+    def commit(self):
+        """Finish the file and move it into place; returns the path or None"""
+        try:
+            self._file.write('\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            os.replace(self._tmp_path, self.filepath)
+            logger.info(f"Saved review to {self.filepath}")
+            return self.filepath
+        except Exception as e:
+            logger.error(f"Error saving review: {str(e)}")
+            self.abort()
+            return None
+    
+    def abort(self):
+        """Discard a partial review"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._tmp_path and os.path.exists(self._tmp_path):
+            os.unlink(self._tmp_path)
+
+
+class RunJournal:
+    """Append-only JSONL journal of per-entry outcomes, used to resume interrupted runs
+    
+    Each line records an entry key, its status ('done' or 'failed'), the request
+    hash the review was generated from and the output path. The last line for an
+    entry wins. Entries are keyed by entry_identity, like the manifest and the
+    output layout, so a re-ranked catalogue still resumes; journals written with
+    the older `序号:歌曲名` keys are still read.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {}
+        
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line_number, line in enumerate(f, 1):
+                    try:
+                        record = json.loads(line)
+                        self._state[record['entry']] = record
+                    except (ValueError, KeyError, TypeError):
+                        # A torn last line from a crash is expected; anything else is worth a note
+                        logger.warning(f"Skipping unreadable journal line {line_number} in {path}")
+        
+        self._file = open(path, 'a', encoding='utf-8')
+    
+    @staticmethod
+    def entry_key(music_info):
+        """Stable identifier of a table entry"""
+        return entry_identity(music_info)
+    
+    @staticmethod
+    def legacy_entry_key(music_info):
+        """Key used by journals written before entries were keyed by entry_identity"""
+        return f"{music_info['序号']}:{music_info['歌曲名']}"
+    
+    def record(self, music_info, status, prompt_hash, output_path=None):
+        """Append the outcome of an entry and flush it to disk"""
+        record = {
+            'entry': self.entry_key(music_info),
+            'status': status,
+            'prompt_hash': prompt_hash,
+            'output': output_path,
+            'time': time.time()
+        }
+        with self._lock:
+            self._state[record['entry']] = record
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+    
+    def current_output(self, music_info, prompt_hash):
+        """Output path if the entry was completed from the same request and still exists, else None"""
+        record = self._state.get(self.entry_key(music_info))
+        if record is None:
+            record = self._state.get(self.legacy_entry_key(music_info))
+        if (record
+                and record['status'] == 'done'
+                and record['prompt_hash'] == prompt_hash
+                and record.get('output')
+                and os.path.exists(record['output'])):
+            return record['output']
+        return None
+    
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def entry_identity(music_info):
+    """Identity of a catalogue row across refreshes (its rank may change, title and artist do not)"""
+    return f"{music_info['歌曲名'].strip()}|{music_info['表演者'].strip()}"
+
+
+def entry_fingerprint(music_info):
+    """Hash of the row fields that feed the prompt, and of the templates applied to them"""
+    templates = get_templates()
+    material = templates.entry_hash(music_info) + '\n' + templates.render_prompt(music_info)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+# Common traditional characters and their simplified forms, used to fold titles
+# and artists when OpenCC is not installed
+TRADITIONAL_CHARS = (
+    "葉們個國來時後會說這對開關點與為無愛戀夢聽聲樂專輯華語電動風飛雲龍鳳東門間問聞陽陰陳張劉楊黃趙吳孫鄭謝鄧"
+    "馮蔣蕭羅韓傑偉紅綠藍銀鐘鍾鐵長遠還邊過進運達遲選遺離難雙雜雞頭題顏願顧飄館馬驚體鬥魚鳥鳴麗黨齊憶懷戰戲擁"
+    "擇攝數斷於曉書條樹橋機歡歲歷歸氣滿漢潛灣燈爺牆狀獨獻現當畫瘋發盡眾稱窮競筆節簡約紀純紗細終結給絕經綿緣線"
+    "練縣總繼續義習聖聯腦臉舊藝蘭處號術衛見視親覺觀記許詩話誰請讀變讓貓負貝買賣貴賽質趕車軍輕輪辦農連週鄉醫釋"
+    "錄錯鏡闆陸隊際隨險隱雖靈靜韻響頁項順預領頻顆類颱餘饒髮鬆麥齒壓塵壞夠奪婦學寶實寫將導層島師帶幫廣廳彈彎從"
+    "徵憂憐應懶擊據損換揮搖標樣槍殺殘決沒淚溫滅漁潔濃熱燒爭犧產異畢療皺盤碼確禮種穩竊築糧緊罰膽興艱莊萬蓋薦蘇"
+    "蟲螢補裝複襪覽訊設證評詞認誌談諾謎講譯護豐貢費資賞贈躍軟較轉辭遙適郵鋼錢鎖閃閱闊陣霧韋頌飲飯養驗鬧鮮鷹麼"
+    "龜臺裡衝徹憑戶託並亂亞傘傳傷億價儀優兒內兩冊劇勁勝勞區協單卻員嗎嘆噴嚴囉園圍圖團執堅場塊奮嬰宮寧尋屬嶺巖"
+    "幣幾庫廢強彌徑態慘慣憲懸擔擬擴攤敗敵斬晝暫曆朧楓榮構檔權歐氫滄漸澀濕灘災烏煙爛獎環瓊甦畝癒皚盧睏矯礎禪穀"
+    "筍篤簾籃紛絲緒編縮織繞繪罷羨翹聰職膚艦蒼蓮蔥薩蘋虛蝕衆製覓訴詠誘課調論諧謠識贊趨跡蹤軌輝輩邁鄰醜針鈴銳鋒"
+    "錦鍵鎮鐮閒陝隻雛靂頂頓頸颯飾餓騎騰驅鬱魯鴿鵝麵黴齡倫譚嶽瑋樸蘊縈瀟灑濤澤濱瀾聶蕓萊賴龐倆偵側僅剛劃劍勵參"
+    "叢嘗嗚噹壯壺夾奧姍娛嫻寬屆帥帳幟廟彥復悅惡惱慶懼搶撲擋擠擺攜敘斕昇暈暢曬棧檢檯櫻歎殤沖淺渦測湯漲潤澆濁濺"
+    "瀏煉燦燭營獄獸瑣瓏疊瘡監睜瞞碩磚禱穌窩範糾紋紡絨綁綱網緋緩縫繩纏罵羈翺聳肅脈膠艷荊葦蔭蕩蕪藥蘆蟬蠍蠟褲襯"
+    "訂計訪該詳誇誕誤諸謊謙譜讚貞貧貨販貫貼賀賊賦購贏踐蹟軀輸轟辯遞遜邏鄒醞釀鈞銅銘鋪鍋鏈鑰閉閣閨闖階隕靦韌頒"
+    "頰頹顛顫飆餅餵騙驕驛髒鬍魘鯨鴉鴛鴦鵑鶴鷗鸚鹹齣"
 )
-logger = logging.getLogger(__name__)
+SIMPLIFIED_CHARS = (
+    "叶们个国来时后会说这对开关点与为无爱恋梦听声乐专辑华语电动风飞云龙凤东门间问闻阳阴陈张刘杨黄赵吴孙郑谢邓"
+    "冯蒋萧罗韩杰伟红绿蓝银钟钟铁长远还边过进运达迟选遗离难双杂鸡头题颜愿顾飘馆马惊体斗鱼鸟鸣丽党齐忆怀战戏拥"
+    "择摄数断于晓书条树桥机欢岁历归气满汉潜湾灯爷墙状独献现当画疯发尽众称穷竞笔节简约纪纯纱细终结给绝经绵缘线"
+    "练县总继续义习圣联脑脸旧艺兰处号术卫见视亲觉观记许诗话谁请读变让猫负贝买卖贵赛质赶车军轻轮办农连周乡医释"
+    "录错镜板陆队际随险隐虽灵静韵响页项顺预领频颗类台余饶发松麦齿压尘坏够夺妇学宝实写将导层岛师带帮广厅弹弯从"
+    "征忧怜应懒击据损换挥摇标样枪杀残决没泪温灭渔洁浓热烧争牺产异毕疗皱盘码确礼种稳窃筑粮紧罚胆兴艰庄万盖荐苏"
+    "虫萤补装复袜览讯设证评词认志谈诺谜讲译护丰贡费资赏赠跃软较转辞遥适邮钢钱锁闪阅阔阵雾韦颂饮饭养验闹鲜鹰么"
+    "龟台里冲彻凭户托并乱亚伞传伤亿价仪优儿内两册剧劲胜劳区协单却员吗叹喷严啰园围图团执坚场块奋婴宫宁寻属岭岩"
+    "币几库废强弥径态惨惯宪悬担拟扩摊败敌斩昼暂历胧枫荣构档权欧氢沧渐涩湿滩灾乌烟烂奖环琼苏亩愈皑卢困矫础禅谷"
+    "笋笃帘篮纷丝绪编缩织绕绘罢羡翘聪职肤舰苍莲葱萨苹虚蚀众制觅诉咏诱课调论谐谣识赞趋迹踪轨辉辈迈邻丑针铃锐锋"
+    "锦键镇镰闲陕只雏雳顶顿颈飒饰饿骑腾驱郁鲁鸽鹅面霉龄伦谭岳玮朴蕴萦潇洒涛泽滨澜聂芸莱赖庞俩侦侧仅刚划剑励参"
+    "丛尝呜当壮壶夹奥姗娱娴宽届帅帐帜庙彦复悦恶恼庆惧抢扑挡挤摆携叙斓升晕畅晒栈检台樱叹殇冲浅涡测汤涨润浇浊溅"
+    "浏炼灿烛营狱兽琐珑叠疮监睁瞒硕砖祷稣窝范纠纹纺绒绑纲网绯缓缝绳缠骂羁翱耸肃脉胶艳荆苇荫荡芜药芦蝉蝎蜡裤衬"
+    "订计访该详夸诞误诸谎谦谱赞贞贫货贩贯贴贺贼赋购赢践迹躯输轰辩递逊逻邹酝酿钧铜铭铺锅链钥闭阁闺闯阶陨腼韧颁"
+    "颊颓颠颤飙饼喂骗骄驿脏胡魇鲸鸦鸳鸯鹃鹤鸥鹦咸出"
+)
+TRADITIONAL_TO_SIMPLIFIED = str.maketrans(TRADITIONAL_CHARS, SIMPLIFIED_CHARS)
+# Separators between the alternative names of one title or artist ("叶惠美 / 葉惠美 / Yeh Hui-Mei")
+ALIAS_SEPARATOR = re.compile(r'\s*[/／]\s*')
+# Bracketed suffixes naming an edition or reissue of an album rather than a different album
+EDITION_SUFFIX = re.compile(
+    r'\s*[(\[（【〔][^)\]）】〕]*(?:edition|deluxe|remaster|reissue|anniversary|expanded|bonus|'
+    r'版|重制|纪念|再版|复刻|重发)[^)\]）】〕]*[)\]）】〕]',
+    re.IGNORECASE
+)
+# Everything but letters and digits (whitespace, punctuation, symbols)
+NON_WORD_RUN = re.compile(r'[\W_]+')
+
+_to_simplified = None
+
+
+def fold_chinese(text):
+    """Convert traditional Chinese to simplified, with OpenCC when it is installed"""
+    global _to_simplified
+    if _to_simplified is None:
+        try:
+            import opencc
+            try:
+                converter = opencc.OpenCC('t2s')
+            except Exception:
+                # The upstream package names its configurations after their files
+                converter = opencc.OpenCC('t2s.json')
+            _to_simplified = converter.convert
+        except Exception:
+            _to_simplified = lambda value: value.translate(TRADITIONAL_TO_SIMPLIFIED)
+    return _to_simplified(text)
+
+
+def canonical_aliases(text):
+    """Normalised forms of each alternative name in a title or artist field
+    
+    Names are split on "/", edition suffixes such as "(Deluxe Edition)" are
+    dropped, and what remains is NFKC-normalised, case-folded, folded to
+    simplified Chinese and stripped of whitespace and punctuation.
+    """
+    aliases = []
+    for name in ALIAS_SEPARATOR.split(text or ''):
+        name = EDITION_SUFFIX.sub('', name) or name
+        folded = fold_chinese(unicodedata.normalize('NFKC', name).casefold())
+        # A name made only of punctuation is kept as written, so such titles do not all collide
+        canonical = NON_WORD_RUN.sub('', folded) or folded.strip()
+        if canonical and canonical not in aliases:
+            aliases.append(canonical)
+    return aliases
+
+
+def group_duplicate_entries(music_entries):
+    """Group entries naming the same album; returns (representatives, {identity: duplicates})
+    
+    Two entries are duplicates when they share a canonical title alias and a
+    canonical artist alias (see canonical_aliases), directly or through other
+    entries; an entry without an artist is never grouped. The first entry of each group in catalogue order represents it;
+    the mapping lists the other members under the representative's
+    entry_identity.
+    """
+    parents = list(range(len(music_entries)))
+    
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+    
+    owners = {}
+    for index, music_info in enumerate(music_entries):
+        artists = canonical_aliases(music_info.get('表演者', ''))
+        # No artist: a shared title alone does not make two entries the same album
+        for title in canonical_aliases(music_info['歌曲名']):
+            for artist in artists:
+                owner = owners.setdefault(f"{title}|{artist}", index)
+                root, other = find(index), find(owner)
+                if root != other:
+                    # The earlier entry stays the root, so it represents the group
+                    parents[max(root, other)] = min(root, other)
+    
+    representatives = []
+    duplicates = {}
+    for index, music_info in enumerate(music_entries):
+        root = find(index)
+        if root == index:
+            representatives.append(music_info)
+        else:
+            duplicates.setdefault(entry_identity(music_entries[root]), []).append(music_info)
+    return representatives, duplicates
+
+
+def log_duplicate_groups(representatives, duplicates, verbose=False):
+    """Log how many requests folding duplicate entries saves (and each group when verbose)"""
+    folded = sum(len(members) for members in duplicates.values())
+    logger.info(f"Deduplication: {len(representatives) + folded} entries in {len(representatives)} groups; "
+                f"{folded} duplicates will reuse the review of their group ({folded} requests saved)")
+    if verbose:
+        for music_info in representatives:
+            members = duplicates.get(entry_identity(music_info))
+            if members:
+                names = ', '.join(f"{member['序号']} {member['歌曲名']}" for member in members)
+                logger.info(f"  {music_info['序号']} {music_info['歌曲名']} <- {names}")
+
+
+class ReviewManifest:
+    """Fingerprints of the catalogue rows behind the current reviews
+    
+    Diffing a refreshed catalogue against the manifest tells which rows were
+    added, changed or removed since the last run, so only those need work.
+    Stored as JSON next to the reviews and rewritten atomically on save.
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.entries = data.get('entries', {})
+            except (ValueError, AttributeError) as e:
+                logger.warning(f"Ignoring unreadable manifest {path}: {str(e)}")
+    
+    def plan(self, music_entries):
+        """Diff catalogue entries against the manifest
+        
+        Returns a dict of lists: 'added', 'changed' and 'missing' (unchanged
+        rows whose review file is gone) hold entries that need generating,
+        'unchanged' those that do not, and 'removed' the (identity, record)
+        pairs of rows no longer in the catalogue.
+        """
+        plan = {'added': [], 'changed': [], 'missing': [], 'unchanged': [], 'removed': []}
+        seen = set()
+        for music_info in music_entries:
+            key = entry_identity(music_info)
+            seen.add(key)
+            record = self.entries.get(key)
+            if record is None:
+                plan['added'].append(music_info)
+            elif record.get('fingerprint') != entry_fingerprint(music_info):
+                plan['changed'].append(music_info)
+            elif not record.get('output') or not os.path.exists(record['output']):
+                plan['missing'].append(music_info)
+            else:
+                plan['unchanged'].append(music_info)
+        plan['removed'] = [(key, record) for key, record in self.entries.items() if key not in seen]
+        return plan
+    
+    def update(self, music_info, output_path):
+        """Record the row a review was generated from"""
+        with self._lock:
+            self.entries[entry_identity(music_info)] = {
+                'fingerprint': entry_fingerprint(music_info),
+                # Absolute, so later runs from another working directory still find it
+                'output': os.path.abspath(output_path) if output_path else None,
+                '序号': music_info['序号'],
+                '歌曲名': music_info['歌曲名'],
+                'updated': time.time()
+            }
+    
+    def remove(self, key):
+        with self._lock:
+            self.entries.pop(key, None)
+    
+    def save(self):
+        with self._lock:
+            content = json.dumps({'version': self.VERSION, 'entries': self.entries}, ensure_ascii=False, indent=1)
+        atomic_write_text(self.path, content)
+
+
+def log_catalogue_plan(plan, incremental=True, prune=False, verbose=False):
+    """Log the catalogue diff; with `verbose` every affected row is listed (used by --dry-run)"""
+    to_generate = len(plan['added']) + len(plan['changed']) + len(plan['missing'])
+    if not incremental:
+        to_generate += len(plan['unchanged'])
+    logger.info(f"Catalogue diff: {len(plan['added'])} added, {len(plan['changed'])} changed, "
+                f"{len(plan['missing'])} missing output, {len(plan['unchanged'])} unchanged, "
+                f"{len(plan['removed'])} removed; {to_generate} to generate")
+    if not verbose:
+        return
+    for symbol, bucket in (('+', 'added'), ('~', 'changed'), ('!', 'missing')):
+        for music_info in plan[bucket]:
+            logger.info(f"  {symbol} {music_info['序号']} {music_info['歌曲名']}")
+    for key, record in plan['removed']:
+        action = f"delete {record.get('output')}" if prune and record.get('output') else "keep review"
+        logger.info(f"  - {record.get('序号', '?')} {record.get('歌曲名', key)} ({action})")
+
+
+def prune_removed_reviews(plan, manifest, output_dir, layout=None):
+    """Delete the reviews of rows that left the catalogue; returns the number of files removed"""
+    output_root = os.path.realpath(output_dir)
+    removed = 0
+    for key, record in plan['removed']:
+        output = record.get('output')
+        # Never delete anything outside the output directory
+        if output and os.path.realpath(output).startswith(output_root + os.sep) and os.path.exists(output):
+            try:
+                os.remove(output)
+                removed += 1
+                logger.info(f"Removed review of dropped entry: {output}")
+            except OSError as e:
+                logger.error(f"Could not remove {output}: {str(e)}")
+                continue
+        manifest.remove(key)
+        if layout is not None:
+            layout.release(key)
+    return removed
+
+
+class OutputLayout:
+    """Planned review paths for a catalogue, persisted as an entry→path map
+    
+    Filenames come from the primary title, so different albums with the same
+    name (or titles that sanitize to the same string) would overwrite each
+    other. `plan()` assigns every entry a path before generation starts: the
+    first claimant in catalogue order keeps the plain name, later ones get an
+    artist suffix, then the 序号, then a counter. Names are compared
+    case-insensitively so the layout also holds on macOS and Windows.
+    Assignments are kept in `.paths.json`, so a review keeps its path across
+    runs. Once the catalogue grows past `shard_threshold` entries, new reviews
+    go to two-character hashed subdirectories; existing paths never move.
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, output_dir, shard_threshold=SHARD_THRESHOLD):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, PATH_MAP_FILENAME)
+        self.shard_threshold = shard_threshold
+        self.paths = {}
+        self.sharded = False
+        self._taken = {}
+        self._existing = set()
+        self._directories = set()
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.paths = json.load(f).get('paths', {})
+            except (ValueError, AttributeError) as e:
+                logger.warning(f"Ignoring unreadable path map {self.path}: {str(e)}")
+        self._taken = {relative.casefold(): key for key, relative in self.paths.items()}
+    
+    def _scan(self):
+        """Relative paths (casefolded) of the review files already on disk"""
+        existing = set()
+        for directory, subdirectories, filenames in os.walk(self.output_dir):
+            subdirectories[:] = [name for name in subdirectories if not name.startswith('.')]
+            relative_dir = os.path.relpath(directory, self.output_dir)
+            for filename in filenames:
+                if filename.endswith('.md') and not filename.startswith('.'):
+                    existing.add(os.path.normpath(os.path.join(relative_dir, filename)).casefold())
+        return existing
+    
+    def plan(self, music_entries):
+        """Assign a path to every entry not yet in the map; returns counts of the plan"""
+        started = time.perf_counter()
+        if os.path.isdir(self.output_dir):
+            self._existing = self._scan()
+        entries = []
+        identities = set()
+        duplicates = 0
+        for music_info in music_entries:
+            key = entry_identity(music_info)
+            if key in identities:
+                duplicates += 1
+                logger.warning(f"Duplicate catalogue entry {music_info['序号']} {music_info['歌曲名']} "
+                               f"shares its review file with an earlier row")
+                continue
+            identities.add(key)
+            if key not in self.paths:
+                entries.append(music_info)
+        self.sharded = len(identities | set(self.paths)) > self.shard_threshold
+        
+        renamed = 0
+        with self._lock:
+            for music_info in entries:
+                if self._assign(music_info) > 0:
+                    renamed += 1
+        counts = {'entries': len(identities), 'new': len(entries), 'renamed': renamed, 'duplicates': duplicates}
+        logger.info(f"Planned output paths in {time.perf_counter() - started:.2f}s: {len(identities)} entries, "
+                    f"{len(entries)} newly assigned, {renamed} renamed to avoid collisions"
+                    + (", sharded into subdirectories" if self.sharded else ""))
+        return counts
+    
+    @staticmethod
+    def _candidates(music_info):
+        """Filename stems to try in order: title, title-artist, title-artist-序号, then numbered"""
+        # Use the primary name (before any "/") as the filename
+        base = sanitize_filename(music_info['歌曲名'].split('/')[0].strip())
+        yield base
+        artist = sanitize_filename(music_info.get('表演者', '').split('/')[0].strip())
+        yield f"{base}-{artist}"
+        stem = f"{base}-{artist}-{sanitize_filename(str(music_info['序号']))}"
+        yield stem
+        counter = 2
+        while True:
+            yield f"{stem}-{counter}"
+            counter += 1
+    
+    def _assign(self, music_info):
+        """Give an entry the first free candidate path; returns how many were taken (caller holds the lock)"""
+        key = entry_identity(music_info)
+        directory = hashlib.sha1(key.encode('utf-8')).hexdigest()[:2] if self.sharded else ''
+        for attempt, stem in enumerate(self._candidates(music_info)):
+            relative = os.path.join(directory, stem + '.md')
+            folded = relative.casefold()
+            if folded not in self._taken:
+                break
+        self.paths[key] = relative
+        self._taken[folded] = key
+        return attempt
+    
+    def path_for(self, music_info):
+        """Review path of an entry, inside the output directory"""
+        key = entry_identity(music_info)
+        with self._lock:
+            relative = self.paths.get(key)
+            if relative is None:
+                # Entries that were not planned (e.g. library callers) are assigned on first use
+                self._assign(music_info)
+                relative = self.paths[key]
+        directory = os.path.dirname(relative)
+        if directory and directory not in self._directories:
+            os.makedirs(os.path.join(self.output_dir, directory), exist_ok=True)
+            self._directories.add(directory)
+        return os.path.join(self.output_dir, relative)
+    
+    def existed(self, filepath):
+        """Whether a review file was already on disk when the plan was made"""
+        return os.path.relpath(filepath, self.output_dir).casefold() in self._existing
+    
+    def release(self, key):
+        """Forget the path of an entry whose review was deleted"""
+        with self._lock:
+            relative = self.paths.pop(key, None)
+            if relative is not None:
+                self._taken.pop(relative.casefold(), None)
+    
+    def save(self):
+        with self._lock:
+            content = json.dumps({'version': self.VERSION, 'paths': self.paths}, ensure_ascii=False, indent=1)
+        atomic_write_text(self.path, content)
+
+
+def _finish_entry(api_client, music_info, review, output_dir, journal=None, writer=None, started=None,
+                  metrics=None, recorder=None, validator=None, layout=None):
+    """Validate and save a generated review (or record its failure), then journal and record the outcome
+    
+    Reviews failing `validator` are still saved, with status 'invalid', and
+    journaled as failed so they are retried.
+    """
+    result = {'music_info': music_info, 'filepath': None, 'status': 'failed'}
+    metrics = metrics if metrics is not None else new_request_metrics()
+    save_started = time.perf_counter()
+    problems = []
+    if review and validator is not None:
+        streamed = review
+        review, problems = validator.check(review)
+        if writer is not None and writer.started and review != streamed.strip():
+            # The streamed file holds the raw text; write the normalised one instead
+            writer.abort()
+            writer = None
+    if review:
+        # Save as soon as the review arrives (cache hits are not streamed)
+        if writer is not None and writer.started:
+            result['filepath'] = writer.commit()
+        else:
+            result['filepath'] = save_review(music_info, review, output_dir, layout)
+        result['status'] = 'saved' if result['filepath'] else 'save_failed'
+        if result['status'] == 'saved' and problems:
+            result['status'] = 'invalid'
+            logger.warning(f"Review for {music_info['歌曲名']} failed validation: {', '.join(problems)}")
+    result['problems'] = metrics['problems'] = problems
+    if writer is not None and not result['filepath']:
+        writer.abort()
+    metrics['save_s'] = time.perf_counter() - save_started
+    if started is not None:
+        metrics['total_s'] = time.perf_counter() - started
+    result['latency'] = metrics['total_s']
+    
+    if journal is not None:
+        journal.record(
+            music_info,
+            'done' if result['status'] == 'saved' else 'failed',
+            api_client.request_hash(music_info),
+            result['filepath']
+        )
+    
+    metrics['entry'] = music_info['序号']
+    metrics['title'] = music_info['歌曲名']
+    metrics['outcome'] = 'cache_hit' if metrics['cache_hit'] and result['status'] == 'saved' else result['status']
+    result['metrics'] = metrics
+    if recorder is not None:
+        recorder.record(metrics)
+    return result
+
+
+def _process_entry(api_client, music_info, output_dir, on_start, journal=None, recorder=None,
+                   submitted=None, validator=None, layout=None):
+    """Generate and save the review for a single entry (runs on a worker thread)"""
+    if on_start:
+        on_start(music_info)
+    
+    started = time.perf_counter()
+    metrics = new_request_metrics()
+    if submitted is not None:
+        metrics['queue_wait_s'] = started - submitted
+    # In streaming mode the review is written to disk while it is generated
+    writer = ReviewStreamWriter(music_info, output_dir, layout) if getattr(api_client, 'stream', False) else None
+    review = api_client.generate_review(music_info, stream_sink=writer, metrics=metrics)
+    return [_finish_entry(api_client, music_info, review, output_dir, journal, writer, started, metrics, recorder,
+                          validator, layout)]
+
+
+def _process_batch(api_client, batch, output_dir, on_start, journal=None, recorder=None, submitted=None,
+                   validator=None, layout=None):
+    """Generate and save reviews for several entries with one request (runs on a worker thread)
+    
+    Cached entries are served individually; entries missing from the batched
+    response fall back to single-entry requests.
+    """
+    if len(batch) == 1:
+        return _process_entry(api_client, batch[0], output_dir, on_start, journal, recorder, submitted, validator,
+                              layout)
+    if on_start:
+        for music_info in batch:
+            on_start(music_info)
+    
+    queue_wait = time.perf_counter() - submitted if submitted is not None else 0.0
+    results = []
+    uncached = []
+    for music_info in batch:
+        started = time.perf_counter()
+        review = api_client.cached_review(music_info)
+        if review is not None:
+            metrics = new_request_metrics()
+            metrics.update(queue_wait_s=queue_wait, cache_hit=True)
+            results.append(_finish_entry(api_client, music_info, review, output_dir, journal,
+                                         started=started, metrics=metrics, recorder=recorder,
+                                         validator=validator, layout=layout))
+        else:
+            uncached.append(music_info)
+    if not uncached:
+        return results
+    
+    started = time.perf_counter()
+    batch_metrics = new_request_metrics()
+    reviews = api_client.generate_batch_reviews(uncached, metrics=batch_metrics)
+    # The request's latency and tokens are shared by every review it produced
+    share = 1.0 / max(1, len(reviews))
+    latency = (time.perf_counter() - started) * share
+    for music_info in uncached:
+        review = reviews.get(music_info['序号'])
+        if review:
+            api_client.store_review(music_info, review)
+            metrics = dict(batch_metrics)
+            metrics['queue_wait_s'] = queue_wait
+            metrics['batch_size'] = len(uncached)
+            for field in ('rate_limit_sleep_s', 'backoff_sleep_s', 'network_s'):
+                metrics[field] *= share
+            for field in ('prompt_tokens', 'completion_tokens', 'reasoning_tokens'):
+                if metrics[field] is not None:
+                    metrics[field] = int(metrics[field] * share)
+            result = _finish_entry(api_client, music_info, review, output_dir, journal, metrics=metrics,
+                                   validator=validator, layout=layout)
+            result['latency'] = metrics['total_s'] = latency + metrics['save_s']
+            if recorder is not None:
+                recorder.record(metrics)
+            results.append(result)
+        else:
+            logger.info(f"Falling back to a single request for {music_info['歌曲名']}")
+            results.extend(_process_entry(api_client, music_info, output_dir, None, journal, recorder,
+                                          validator=validator, layout=layout))
+    return results
+
+
+def _copy_to_duplicate(api_client, result, music_info, output_dir, journal=None, recorder=None, layout=None):
+    """Give a duplicate entry the review generated for its group; returns the entry's result dict
+    
+    The review body is copied under the entry's own metadata header and path.
+    An entry the journal already records as done is reported as skipped.
+    """
+    prompt_hash = api_client.request_hash(music_info)
+    duplicate_of = entry_identity(result['music_info'])
+    metrics = new_request_metrics()
+    metrics.update(entry=music_info['序号'], title=music_info['歌曲名'])
+    existing_path = journal.current_output(music_info, prompt_hash) if journal is not None else None
+    if existing_path or result['status'] not in ('saved', 'invalid', 'skipped'):
+        # Already done, or nothing to copy and the duplicate shares its group's outcome
+        status = 'skipped' if existing_path else result['status']
+        metrics['outcome'] = status
+        if recorder is not None:
+            recorder.record(metrics)
+        return {'music_info': music_info, 'filepath': existing_path, 'status': status,
+                'duplicate_of': duplicate_of, 'metrics': metrics}
+    
+    started = time.perf_counter()
+    filepath = None
+    try:
+        with open(result['filepath'], 'r', encoding='utf-8') as f:
+            body = split_review_file(f.read())[1]
+        filepath = save_review(music_info, body.strip(), output_dir, layout)
+    except OSError as e:
+        logger.error(f"Could not copy the review of {result['music_info']['歌曲名']}: {str(e)}")
+    if not filepath:
+        status = 'save_failed'
+    else:
+        status = 'invalid' if result['status'] == 'invalid' else 'saved'
+    if journal is not None:
+        journal.record(music_info, 'done' if status == 'saved' else 'failed', prompt_hash, filepath)
+    metrics.update(outcome='deduplicated', save_s=time.perf_counter() - started)
+    metrics['total_s'] = metrics['save_s']
+    if recorder is not None:
+        recorder.record(metrics)
+    return {'music_info': music_info, 'filepath': filepath, 'status': status, 'duplicate_of': duplicate_of,
+            'problems': result.get('problems') or [], 'metrics': metrics}
+
+
+class RunControl:
+    """Pause/resume/cancel switch shared between a UI thread and a running batch"""
+    
+    def __init__(self):
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = threading.Event()
+    
+    @property
+    def paused(self):
+        return not self._running.is_set()
+    
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+    
+    def pause(self):
+        self._running.clear()
+    
+    def resume(self):
+        self._running.set()
+    
+    def cancel(self):
+        self._cancelled.set()
+        # Wake a paused run so it can stop
+        self._running.set()
+    
+    def wait_resumed(self, timeout=None):
+        """Block up to `timeout` seconds while paused; returns whether the run is no longer paused"""
+        return self._running.wait(timeout)
+    
+    def checkpoint(self):
+        """Block while paused; return False once the run has been cancelled"""
+        while not self._running.wait(0.2):
+            pass
+        return not self._cancelled.is_set()
 
-# Constants (defaults that can be overridden)
-DEFAULT_MD_FILE_PATH = "top25Music_douban.md"
-DEFAULT_OUTPUT_DIR = "musicComments"
-# For Nvidia DeepSeek R1 model
-API_URL = "https://integrate.api.nvidia.com/v1/chat/completions"
 
-# Configure API settings
-class DeepSeekAPI:
-    def __init__(self, api_key=None, keep_thinking=False, simulation_mode=False):
-        self.api_key = api_key or os.environ.get("NVIDIA_API_KEY")
-        if not self.api_key and not simulation_mode:
-            logger.error("No API key provided. Please set the NVIDIA_API_KEY environment variable.")
-            raise ValueError("No API key provided")
-        
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        # New options
-        self.keep_thinking = keep_thinking
-        self.simulation_mode = simulation_mode
-        
-        # Rate limiting parameters
-        # Note: DeepSeek API technically doesn't have a hard limit
-        # But we'll implement conservative waiting periods anyway to avoid issues
-        self.min_request_interval = 6  # seconds between requests (conservative)
-        self.last_request_time = 0
-        
-        # Exponential backoff parameters for handling rate limits
-        self.max_retries = 5
-        self.base_wait_time = 30  # 30 seconds base wait time
-        
-    def generate_review(self, music_info):
-        """Generate a music review using DeepSeek R1 model"""
-        
-        if self.simulation_mode:
-            logger.info(f"SIMULATION MODE: Would call API for: {music_info['歌曲名']}")
-            # Return a simple placeholder review in simulation mode
-            return self._generate_simulation_review(music_info)
-        
-        # Rate limiting: sleep if necessary to maintain rate limit
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
-        
-        if time_since_last_request < self.min_request_interval:
-            sleep_time = self.min_request_interval - time_since_last_request
-            logger.info(f"Rate limiting: sleeping for {sleep_time:.2f} seconds")
-            time.sleep(sleep_time)
+def generate_reviews_concurrently(api_client, music_entries, output_dir, concurrency=1,
+                                  on_start=None, on_result=None, journal=None, resume=False,
+                                  batch_size=1, recorder=None, control=None, validator=None,
+                                  validation_retries=1, layout=None, duplicates=None):
+    """Generate and save reviews with a bounded pool of worker threads
+    
+    At most `concurrency` requests are in flight at once; the API client's
+    rate limit is shared by all workers. With `batch_size` > 1, entries are
+    packed into multi-entry prompts of that size. `on_start(music_info)` is
+    called from the worker thread, `on_result(result)` from the calling thread
+    as each entry completes. With `resume`, entries the journal records as done
+    and current are reported with status 'skipped' instead of being regenerated.
+    Per-entry metrics go to `recorder` (a MetricsRecorder) when given.
+    With a `control` (RunControl), no new work is started while it is paused,
+    and after it is cancelled in-flight requests finish but nothing else is
+    submitted. With a `validator` (ReviewValidator), reviews that fail
+    validation are queued and regenerated (bypassing the cache) with
+    single-entry requests, up to `validation_retries` rounds; the final
+    result of each entry replaces earlier ones. Review paths come from
+    `layout` (an OutputLayout) when given. Once the API client's token budget
+    (a TokenBudget) would be exceeded, the remaining entries are reported with
+    status 'deferred' and left for a later run. `duplicates` maps the
+    entry_identity of an entry to the duplicate entries that reuse its review
+    (see group_duplicate_entries); they are reported, with a 'duplicate_of'
+    key, once the entry's final result is known. Returns the list of result dicts.
+    """
+    concurrency = max(1, int(concurrency))
+    batch_size = max(1, int(batch_size))
+    results = []
+    pending = set()
+    budget = getattr(api_client, 'token_budget', None)
+    deferred = 0
+    
+    def report(result):
+        results.append(result)
+        if on_result:
+            on_result(result)
+        # An invalid review may still be regenerated; its duplicates wait for the final one
+        if duplicates and result['status'] != 'invalid' and 'duplicate_of' not in result:
+            fan_out(result)
+    
+    def fan_out(result):
+        for music_info in duplicates.get(entry_identity(result['music_info']), ()):
+            report(_copy_to_duplicate(api_client, result, music_info, output_dir, journal, recorder, layout))
+    
+    def collect(done):
+        for future in done:
+            try:
+                batch_results = future.result()
+            except Exception as e:
+                logger.error(f"Worker failed: {str(e)}", exc_info=True)
+                batch_results = [
+                    {'music_info': music_info, 'filepath': None, 'status': 'failed'}
+                    for music_info in future.batch
+                ]
+            for result in batch_results:
+                report(result)
+    
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="review") as executor:
         
-        # Format a prompt for DeepSeek R1
-        prompt = f"""请你为以下音乐作品写一篇300-500字的乐评，适合在小红书上发表。
-
-音乐信息:
-歌曲名: {music_info['歌曲名']}
-表演者: {music_info['表演者']}
-发行时间: {music_info['发行时间']}
-流派: {music_info['流派']}
-专辑类型: {music_info['专辑类型']}
-介质: {music_info['介质']}
-评分: {music_info['评分']}
-
-要求:
-1. 乐评要有感染力，文笔优美，情感真挚
-2. 分析一下这首歌的艺术特点、表演水准和音乐语言
-3. 提及这首歌的文化背景和历史意义
-4. 总结这首歌的经典之处和个人感受
-5. 字数保持在300-500字之间
-6. 加入适合小红书风格的标题和2-3个话题标签"""
-        
-        # Prepare API request payload
-        payload = {
-            "model": "deepseek-ai/deepseek-r1",
-            "temperature": 0.6,  # DeepSeek R1 recommends 0.5-0.7 for best results
-            "messages": [
-                {"role": "user", "content": prompt}
-            ]
-        }
+        def hold():
+            """Block while paused, still reporting requests that finish; False once cancelled"""
+            nonlocal pending
+            while not control.wait_resumed(0 if pending else 0.2):
+                if pending:
+                    done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                    collect(done)
+            return not control.cancelled
         
-        # Add thinking option if requested
-        if self.keep_thinking:
-            payload["parameters"] = {
-                "keep_thinking": True
-            }
+        def submit(batch):
+            nonlocal pending, deferred
+            # Keep the submission window bounded so large inputs are not queued up front
+            if len(pending) >= concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            if control is not None and not hold():
+                return
+            # Leave room for the requests still in flight before spending more of the budget
+            if budget is not None and not budget.allows(len(pending)):
+                if not deferred:
+                    logger.warning(f"Token budget reached ({budget.summary()}); deferring the remaining entries")
+                deferred += len(batch)
+                for music_info in batch:
+                    report({'music_info': music_info, 'filepath': None, 'status': 'deferred'})
+                return
+            future = executor.submit(_process_batch, api_client, batch, output_dir, on_start, journal,
+                                     recorder, time.perf_counter(), validator, layout)
+            future.batch = batch
+            pending.add(future)
         
-        for retry_count in range(self.max_retries):
-            try:
-                # Record request time for rate limiting
-                self.last_request_time = time.time()
-                
-                # Make API request
-                logger.info(f"Sending request to DeepSeek API for: {music_info['歌曲名']}")
-                response = requests.post(
-                    API_URL,
-                    headers=self.headers,
-                    json=payload,
-                    timeout=120  # 2 minute timeout (DeepSeek may take time to respond)
-                )
-                
-                # Handle different response statuses
-                if response.status_code == 200:
-                    result = response.json()
-                    # Extract review text from response
-                    review_text = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-                    
-                    if not review_text:
-                        logger.error(f"Empty response received for {music_info['歌曲名']}")
-                        return None
-                    
-                    # 移除思考过程（如果不需要保留）
-                    if not self.keep_thinking:
-                        # 使用正则表达式移除<think>...</think>标签及其内容
-                        import re
-                        review_text = re.sub(r'<think>.*?</think>\s*', '', review_text, flags=re.DOTALL)
-                        logger.info("思考过程已从结果中移除")
-                        
-                    return review_text
-                
-                elif response.status_code == 429:
-                    # Rate limit exceeded
-                    retry_after = int(response.headers.get('Retry-After', self.base_wait_time * (2 ** retry_count)))
-                    logger.warning(f"Rate limit exceeded. Attempt {retry_count+1}/{self.max_retries}. "
-                                  f"Waiting for {retry_after} seconds")
-                    time.sleep(retry_after)
-                    continue
-                
-                else:
-                    # Other error
-                    logger.error(f"API request failed with status {response.status_code}: {response.text}")
-                    # If it's server error (5xx), retry with exponential backoff
-                    if 500 <= response.status_code < 600:
-                        wait_time = self.base_wait_time * (2 ** retry_count)
-                        logger.info(f"Server error, retrying in {wait_time} seconds. "
-                                   f"Attempt {retry_count+1}/{self.max_retries}")
-                        time.sleep(wait_time)
-                        continue
-                    return None
-                
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Request exception: {str(e)}")
-                wait_time = self.base_wait_time * (2 ** retry_count)
-                logger.info(f"Network error, retrying in {wait_time} seconds. "
-                           f"Attempt {retry_count+1}/{self.max_retries}")
-                time.sleep(wait_time)
+        batch = []
+        for music_info in music_entries:
+            if control is not None and not hold():
+                logger.info("Run cancelled; waiting for in-flight requests to finish")
+                batch = []
+                break
+            existing_path = None
+            if resume and journal is not None:
+                existing_path = journal.current_output(music_info, api_client.request_hash(music_info))
+            if existing_path:
+                metrics = new_request_metrics()
+                metrics.update(entry=music_info['序号'], title=music_info['歌曲名'], outcome='skipped')
+                if recorder is not None:
+                    recorder.record(metrics)
+                report({'music_info': music_info, 'filepath': existing_path, 'status': 'skipped',
+                        'metrics': metrics})
                 continue
             
-            except Exception as e:
-                logger.error(f"Error generating review: {str(e)}")
-                return None
+            batch.append(music_info)
+            if len(batch) >= batch_size:
+                submit(batch)
+                batch = []
+        if batch:
+            submit(batch)
         
-        logger.error(f"Failed to generate review for {music_info['歌曲名']} after {self.max_retries} retries")
-        return None
-    
-    def _generate_simulation_review(self, music_info):
-        """Generate a simulation review for testing purposes"""
-        song_name = music_info['歌曲名'].split('/')[0].strip()
-        artist = music_info['表演者']
-        genre = music_info['流派']
-        rating = music_info['评分']
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+        if deferred:
+            logger.info(f"{deferred} entries deferred by the token budget; rerun with --resume to continue")
         
-        return f"""# 【遇见经典】{song_name}，{artist}的音乐心灵之旅 #音乐分享 #乐评 #经典回顾
-
-这首由{artist}演绎的《{song_name}》是{genre}音乐中不可忽视的瑰宝，评分高达{rating}分，足见其艺术成就与听众认可度。
-
-作品以其独特的音乐语言和细腻的情感表达，展现了艺术家深厚的音乐素养和独到的创作视角。音乐中时而澎湃激昂，时而柔情似水的情绪转换，无不牵动听众的心弦，让人沉浸在一场听觉与情感的盛宴中。
+        # Targeted retry queue: only the reviews that failed validation are regenerated
+        for retry_round in range(1, validation_retries + 1 if validator is not None else 1):
+            invalid = [result for result in results if result['status'] == 'invalid']
+            if not invalid or (control is not None and control.cancelled):
+                break
+            logger.info(f"Regenerating {len(invalid)} reviews that failed validation "
+                        f"(round {retry_round}/{validation_retries})")
+            results[:] = [result for result in results if result['status'] != 'invalid']
+            for result in invalid:
+                api_client.forget_review(result['music_info'])
+                submit([result['music_info']])
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        
+        if duplicates:
+            for result in [result for result in results if result['status'] == 'invalid']:
+                if 'duplicate_of' not in result:
+                    fan_out(result)
+    
+    return results
 
-从历史角度看，这首歌曾在当时的音乐环境中掀起波澜，不仅丰富了{genre}音乐的表现形式，更为后来的音乐创作提供了新的可能性。它所承载的时代背景和文化内涵，使其成为了音乐史上浓墨重彩的一笔。
 
-每次聆听，都能发现新的感动和启发，这正是经典的魅力所在。无论是在悲伤时寻求抚慰，还是在喜悦时寻求共鸣，它总能给予我们恰到好处的情感陪伴。
+def generate_reviews(music_entries, api_client, concurrency=1):
+    """Yield (music_info, review_text) pairs as reviews complete, without touching the filesystem
+    
+    This is the library entry point: load entries with `parse_music_table` or
+    `iter_music_entries`, generate here, and persist with
+    `render_review_markdown` or `save_review` as needed. `review_text` is None
+    for entries whose generation failed. Results arrive in completion order.
+    """
+    concurrency = max(1, int(concurrency))
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="review") as executor:
+        pending = {}
+        
+        def drain(done):
+            for future in done:
+                music_info = pending.pop(future)
+                try:
+                    review = future.result()
+                except Exception as e:
+                    logger.error(f"Error generating review for {music_info['歌曲名']}: {str(e)}")
+                    review = None
+                yield music_info, review
+        
+        for music_info in music_entries:
+            # Bounded window: never queue more than `concurrency` entries ahead
+            if len(pending) >= concurrency:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from drain(done)
+            pending[executor.submit(api_client.generate_review, music_info)] = music_info
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from drain(done)
 
-如果你还没有聆听过这首作品，强烈推荐将其加入你的音乐清单，感受那穿越时空的音符之美。
 
-#音乐治愈 #经典重温 #{genre}之美"""
+JOB_QUEUE_FILENAME = ".jobs.sqlite3"
 
 
-def extract_music_info_from_md_line(line):
-    """Extract music information from a markdown table line"""
-    if not line.strip() or line.startswith('| ---') or line.startswith('# '):
-        return None
-        
-    parts = line.split('|')
-    if len(parts) < 9:  # Header + 8 columns
-        return None
-        
-    try:
-        # Clean up the parts and extract the information
-        parts = [p.strip() for p in parts]
-        
-        # Extract data from the markdown table row
-        music_info = {
-            '序号': parts[1],
-            '歌曲名': parts[2],
-            '表演者': parts[3],
-            '发行时间': parts[4],
-            '流派': parts[5],
-            '专辑类型': parts[6],
-            '介质': parts[7],
-            '评分': parts[8]
+class JobQueue:
+    """Durable SQLite queue of review jobs for the `serve` mode
+    
+    A job is one catalogue entry, keyed by its fingerprint (the fields and
+    templates that make up its prompt). Submitting an entry whose job is
+    queued, running or done returns that job instead of adding another one;
+    a failed job is queued again. An entry submitted without a 序号 (there is
+    no catalogue to rank it) is numbered by its job id. Jobs left running by a
+    crash are queued again when the queue is reopened. Every change is
+    committed before it is acknowledged, so a restart neither loses nor
+    repeats finished work.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL UNIQUE,
+                entry TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                output TEXT,
+                problems TEXT,
+                submitted REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+        recovered = self._conn.execute(
+            "UPDATE jobs SET status = 'queued', updated = ? WHERE status = 'running'", (time.time(),)
+        ).rowcount
+        self._conn.commit()
+        if recovered:
+            logger.info(f"Re-queued {recovered} jobs interrupted by the last shutdown")
+    
+    def submit(self, music_info):
+        """Queue an entry; returns (job dict, coalesced) where coalesced means an existing job was reused"""
+        key = entry_fingerprint(music_info)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT id, status FROM jobs WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                job_id = self._conn.execute(
+                    "INSERT INTO jobs (key, entry, status, submitted, updated) VALUES (?, ?, 'queued', ?, ?)",
+                    (key, json.dumps(music_info, ensure_ascii=False), now, now)
+                ).lastrowid
+                if not music_info.get('序号'):
+                    music_info = dict(music_info, 序号=str(job_id))
+                    self._conn.execute("UPDATE jobs SET entry = ? WHERE id = ?",
+                                       (json.dumps(music_info, ensure_ascii=False), job_id))
+                coalesced = False
+            else:
+                job_id = row[0]
+                coalesced = row[1] != 'failed'
+                if not coalesced:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'queued', attempts = 0, updated = ? WHERE id = ?", (now, job_id)
+                    )
+            self._conn.commit()
+        return self.get(job_id), coalesced
+    
+    def claim(self, limit):
+        """Mark up to `limit` queued jobs as running, oldest first; returns [(job id, music_info)]"""
+        if limit <= 0:
+            return []
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, entry FROM jobs WHERE status = 'queued' ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated = ? WHERE id = ?",
+                [(time.time(), job_id) for job_id, _ in rows]
+            )
+            self._conn.commit()
+        return [(job_id, json.loads(entry)) for job_id, entry in rows]
+    
+    def finish(self, job_id, status, output=None, problems=None):
+        """Record the outcome of a job ('done', 'invalid', 'failed', or 'queued' to retry it)"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, output = ?, problems = ?, updated = ? WHERE id = ?",
+                (status, output, json.dumps(problems or [], ensure_ascii=False), time.time(), job_id)
+            )
+            self._conn.commit()
+    
+    def get(self, job_id):
+        """The job as a dict, or None if there is no such job"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, entry, status, attempts, output, problems, submitted, updated FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0], 'music_info': json.loads(row[1]), 'status': row[2], 'attempts': row[3],
+            'output': row[4], 'problems': json.loads(row[5]) if row[5] else [],
+            'submitted': row[6], 'updated': row[7]
         }
-        return music_info
-    except Exception as e:
-        logger.error(f"Error parsing markdown line: {str(e)}")
-        return None
+    
+    def counts(self):
+        """Number of jobs in each status"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
 
 
-def sanitize_filename(name):
-    """Convert a string into a safe filename"""
-    # Remove characters that are not allowed in filenames
-    safe_name = re.sub(r'[^\w\s.-]', '_', name)
-    # Replace spaces with underscores
-    safe_name = re.sub(r'\s+', '_', safe_name)
-    # Remove leading/trailing periods, spaces, and underscores
-    safe_name = safe_name.strip('._')
-    # Ensure we have a valid filename
-    if not safe_name:
-        safe_name = "untitled"
-    return safe_name
+def parse_job_entry(record):
+    """Turn a submitted JSON object into a music entry; raises ValueError if it is not one
+    
+    The 序号 is optional: JobQueue.submit numbers entries without one by their job id.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("expected a JSON object")
+    record = {_normalize_column(key): value for key, value in record.items()}
+    music_info = {field: str(record.get(field) or '').strip() for field in MUSIC_FIELDS}
+    missing = [field for field in REQUIRED_FIELDS if field != '序号' and not music_info[field]]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    return music_info
 
 
-def save_review(music_info, review_text, output_dir):
-    """Save the review to a markdown file"""
-    try:
-        # Use the song name as the filename
-        song_name = music_info['歌曲名'].split('/')[0].strip()  # Take just the primary name
-        filename = sanitize_filename(song_name) + '.md'
-        filepath = os.path.join(output_dir, filename)
-        
-        # 检查文件是否存在，记录覆盖日志
-        if os.path.exists(filepath):
-            logger.info(f"覆盖已存在的评论文件: {filepath}")
+class ReviewService:
+    """Long-running worker that generates the reviews queued in a JobQueue
+    
+    A dispatcher thread claims queued jobs and runs them on a pool of
+    `concurrency` threads sharing one API client, so every job draws on the
+    same rate limits. Outcomes are journaled like a CLI run: a job whose
+    review was saved just before a crash is completed from the journal on
+    restart instead of being generated again. Reviews failing validation are
+    queued again up to `validation_retries` times. `on_finish(job)` is called
+    from a worker thread after each job settles.
+    """
+    
+    # Longest the dispatcher sleeps before looking for new jobs
+    POLL_INTERVAL = 1.0
+    
+    def __init__(self, api_client, job_queue, output_dir, concurrency=1, journal=None, recorder=None,
+                 validator=None, validation_retries=1, layout=None, on_finish=None):
+        self.api_client = api_client
+        self.queue = job_queue
+        self.output_dir = output_dir
+        self.concurrency = max(1, int(concurrency))
+        self.journal = journal
+        self.recorder = recorder
+        self.validator = validator
+        self.validation_retries = validation_retries
+        self.layout = layout
+        self.on_finish = on_finish
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._running = 0
+        self._running_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="review")
+        self._dispatcher = threading.Thread(target=self._dispatch, name="review-dispatcher", daemon=True)
+    
+    def start(self):
+        self._dispatcher.start()
+        return self
+    
+    def submit(self, music_info):
+        """Queue an entry and wake the dispatcher; returns (job dict, coalesced)"""
+        job, coalesced = self.queue.submit(music_info)
+        if coalesced:
+            logger.info(f"Coalesced {music_info['歌曲名']} into job {job['id']} ({job['status']})")
+        self._wakeup.set()
+        return job, coalesced
+    
+    @property
+    def idle(self):
+        """No job is queued or running"""
+        counts = self.queue.counts()
+        return not counts.get('queued') and not counts.get('running')
+    
+    def stop(self):
+        """Stop claiming jobs and wait for the running ones; queued jobs stay for the next start"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._dispatcher.is_alive():
+            self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+    
+    def _dispatch(self):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            with self._running_lock:
+                free = self.concurrency - self._running
+            jobs = self.queue.claim(free)
+            for job_id, music_info in jobs:
+                with self._running_lock:
+                    self._running += 1
+                self._executor.submit(self._run_job, job_id, music_info, time.perf_counter())
+            if not jobs:
+                # Woken early by a submission or a finished job
+                self._wakeup.wait(self.POLL_INTERVAL)
+    
+    def _run_job(self, job_id, music_info, submitted):
+        try:
+            result = self._generate(music_info, submitted)
+            status = {'saved': 'done', 'invalid': 'invalid'}.get(result['status'], 'failed')
+            job = self.queue.get(job_id)
+            if status == 'invalid' and job['attempts'] <= self.validation_retries:
+                # Regenerate (bypassing the cache) on a later claim
+                self.api_client.forget_review(music_info)
+                status = 'queued'
+            self.queue.finish(job_id, status, result.get('filepath'), result.get('problems'))
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}", exc_info=True)
+            self.queue.finish(job_id, 'failed', problems=[str(e)])
+        finally:
+            with self._running_lock:
+                self._running -= 1
+            self._wakeup.set()
+        job = self.queue.get(job_id)
+        if self.on_finish and job['status'] != 'queued':
+            self.on_finish(job)
+    
+    def _generate(self, music_info, submitted):
+        if self.journal is not None:
+            existing_path = self.journal.current_output(music_info, self.api_client.request_hash(music_info))
+            if existing_path:
+                return {'music_info': music_info, 'filepath': existing_path, 'status': 'saved', 'problems': []}
+        if self.layout is not None and entry_identity(music_info) not in self.layout.paths:
+            # Persist the new path before the review is written, so a restart reuses it
+            self.layout.path_for(music_info)
+            self.layout.save()
+        return _process_entry(self.api_client, music_info, self.output_dir, None, self.journal, self.recorder,
+                              submitted, self.validator, self.layout)[0]
+    
+    def serve_http(self, host='127.0.0.1', port=8765):
+        """Serve the JSON API until interrupted
         
-        # Create the markdown content
-        markdown_content = f"""# {music_info['歌曲名']} - 乐评
-
-- 表演者: {music_info['表演者']}
-- 发行时间: {music_info['发行时间']}
-- 流派: {music_info['流派']}
-- 专辑类型: {music_info['专辑类型']}
-- 介质: {music_info['介质']}
-- 评分: {music_info['评分']}
-
-{review_text}
-"""
+        POST /jobs takes an entry object or a list of them and answers with
+        the job ids; GET /jobs/<id> returns a job (with the review once done);
+        GET /jobs returns the number of jobs in each status.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        service = self
         
-        # Write to file
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(markdown_content)
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
             
-        logger.info(f"Saved review to {filepath}")
-        return filepath
-    except Exception as e:
-        logger.error(f"Error saving review: {str(e)}")
-        return None
+            def log_message(self, format, *args):
+                logger.debug(f"{self.address_string()} {format % args}")
+            
+            def _send_json(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def do_POST(self):
+                if self.path.rstrip('/') != '/jobs':
+                    self._send_json(404, {'error': 'not found'})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    payload = json.loads(self.rfile.read(length) or b'null')
+                except ValueError as e:
+                    self._send_json(400, {'error': f"invalid JSON: {str(e)}"})
+                    return
+                records = payload if isinstance(payload, list) else [payload]
+                self._send_json(202, {'jobs': [service.acknowledge(record) for record in records]})
+            
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                if parts == ['jobs']:
+                    self._send_json(200, service.queue.counts())
+                elif len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+                    job = service.describe(int(parts[1]))
+                    self._send_json(200 if job else 404, job or {'error': 'no such job'})
+                else:
+                    self._send_json(404, {'error': 'not found'})
+        
+        httpd = ThreadingHTTPServer((host, port), Handler)
+        httpd.daemon_threads = True
+        logger.info(f"Serving review jobs on http://{host}:{httpd.server_address[1]}/jobs")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Shutting down; queued jobs are kept for the next start")
+        finally:
+            httpd.server_close()
+    
+    def serve_stdin(self, input_stream, output_stream):
+        """Queue one JSON entry per input line, then wait until every queued job has settled
+        
+        Each submission is acknowledged with a JSON line on `output_stream`;
+        finished jobs are reported there too when `on_finish` writes them.
+        """
+        for line in input_stream:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                record = None
+                acknowledgement = {'error': f"invalid JSON: {str(e)}"}
+            if record is not None:
+                acknowledgement = self.acknowledge(record)
+            output_stream.write(json.dumps(acknowledgement, ensure_ascii=False) + '\n')
+            output_stream.flush()
+        while not self.idle:
+            time.sleep(0.2)
+    
+    def acknowledge(self, record):
+        """Submit one JSON record; returns the acknowledgement sent back to the client"""
+        try:
+            music_info = parse_job_entry(record)
+        except ValueError as e:
+            return {'error': str(e)}
+        job, coalesced = self.submit(music_info)
+        return {'id': job['id'], 'status': job['status'], 'coalesced': coalesced}
+    
+    def describe(self, job_id):
+        """A job as returned to clients, with the saved review once it is done"""
+        job = self.queue.get(job_id)
+        if job and job['status'] in ('done', 'invalid') and job['output']:
+            try:
+                with open(job['output'], 'r', encoding='utf-8') as f:
+                    job['review'] = f.read()
+            except OSError as e:
+                logger.warning(f"Could not read review of job {job_id}: {str(e)}")
+        return job
 
 
 class ReviewGeneratorGUI:
-    """GUI interface for the music review generator"""
+    """GUI interface for the music review generator
+    
+    The worker thread never touches Tk: it posts events to `self.events`, which
+    the main loop drains in batches with `after()`.
+    """
+    
+    # Events applied per drain tick, so a burst of results cannot freeze the UI
+    MAX_EVENTS_PER_TICK = 200
+    DRAIN_INTERVAL_MS = 100
+    STATUS_LABELS = {
+        'pending': '等待',
+        'running': '生成中',
+        'saved': '已保存',
+        'skipped': '已跳过',
+        'save_failed': '保存失败',
+        'invalid': '未通过校验',
+        'failed': '失败',
+        'cancelled': '已取消'
+    }
     
     def __init__(self, root):
+        _import_tk()
         self.root = root
         root.title("AI 音乐评论生成器")
-        root.geometry("700x500")
+        root.geometry("800x760")
+        
+        self.events = queue.Queue()
+        self.control = None
+        self.worker = None
+        self.api_client = None
+        self.run_started = None
+        self.completed_count = 0
+        self.total_entries = 0
         
         # Set up main frame
         main_frame = ttk.Frame(root, padding="10")
@@ -325,11 +3946,80 @@ class ReviewGeneratorGUI:
             variable=self.simulation_mode
         ).pack(anchor=tk.W, padx=5, pady=2)
         
+        # Response cache option
+        self.use_cache = tk.BooleanVar(value=True)
+        ttk.Checkbutton(
+            options_frame,
+            text="使用本地缓存（相同请求不再调用API）",
+            variable=self.use_cache
+        ).pack(anchor=tk.W, padx=5, pady=2)
+        
+        # Streaming option
+        self.stream = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            options_frame,
+            text="流式输出（边生成边写入文件）",
+            variable=self.stream
+        ).pack(anchor=tk.W, padx=5, pady=2)
+        
+        # Resume option
+        self.resume = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            options_frame,
+            text="断点续跑（跳过已完成且未变化的条目）",
+            variable=self.resume
+        ).pack(anchor=tk.W, padx=5, pady=2)
+        
+        # Concurrency option
+        concurrency_frame = ttk.Frame(options_frame)
+        concurrency_frame.pack(anchor=tk.W, padx=5, pady=2)
+        ttk.Label(concurrency_frame, text="并发请求数:").pack(side=tk.LEFT)
+        self.concurrency = tk.IntVar(value=1)
+        ttk.Spinbox(
+            concurrency_frame,
+            from_=1,
+            to=32,
+            width=5,
+            textvariable=self.concurrency
+        ).pack(side=tk.LEFT, padx=5)
+        ttk.Label(concurrency_frame, text="每分钟请求数:").pack(side=tk.LEFT, padx=(10, 0))
+        self.requests_per_minute = tk.IntVar(value=10)
+        # Simulated runs stay unthrottled unless the rate is changed here, matching the CLI default
+        self.requests_per_minute_edited = False
+        self.requests_per_minute.trace_add(
+            'write', lambda *_: setattr(self, 'requests_per_minute_edited', True))
+        ttk.Spinbox(
+            concurrency_frame,
+            from_=1,
+            to=600,
+            width=5,
+            textvariable=self.requests_per_minute
+        ).pack(side=tk.LEFT, padx=5)
+        
+        # Per-entry status table
+        status_frame = ttk.LabelFrame(main_frame, text="条目状态", padding="10")
+        status_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        
+        self.status_table = ttk.Treeview(
+            status_frame,
+            columns=("number", "title", "status", "latency"),
+            show="headings",
+            height=8
+        )
+        for column, heading, width in (("number", "序号", 60), ("title", "歌曲名", 360),
+                                       ("status", "状态", 100), ("latency", "耗时(秒)", 100)):
+            self.status_table.heading(column, text=heading)
+            self.status_table.column(column, width=width, anchor=tk.W)
+        status_scrollbar = ttk.Scrollbar(status_frame, orient="vertical", command=self.status_table.yview)
+        self.status_table.configure(yscrollcommand=status_scrollbar.set)
+        status_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.status_table.pack(fill=tk.BOTH, expand=True)
+        
         # Progress reporting
         self.progress_frame = ttk.LabelFrame(main_frame, text="进度", padding="10")
         self.progress_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
-        self.progress_text = tk.Text(self.progress_frame, height=10, width=80)
+        self.progress_text = tk.Text(self.progress_frame, height=6, width=80)
         self.progress_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         
         # Scrollbar for progress text
@@ -348,27 +4038,58 @@ class ReviewGeneratorGUI:
         )
         self.progress_bar.pack(fill=tk.X, padx=10, pady=5)
         
+        # Live throughput
+        self.throughput_var = tk.StringVar(value="")
+        ttk.Label(main_frame, textvariable=self.throughput_var).pack(anchor=tk.W, padx=10)
+        
         # Buttons
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(pady=10, fill=tk.X)
         
-        ttk.Button(
+        self.start_button = ttk.Button(
             button_frame, 
             text="开始生成", 
             command=self.start_generation
-        ).pack(side=tk.RIGHT, padx=5)
+        )
+        self.start_button.pack(side=tk.RIGHT, padx=5)
+        
+        self.pause_button = ttk.Button(
+            button_frame,
+            text="暂停",
+            command=self.toggle_pause,
+            state=tk.DISABLED
+        )
+        self.pause_button.pack(side=tk.RIGHT, padx=5)
+        
+        self.cancel_button = ttk.Button(
+            button_frame,
+            text="取消",
+            command=self.cancel_generation,
+            state=tk.DISABLED
+        )
+        self.cancel_button.pack(side=tk.RIGHT, padx=5)
         
         ttk.Button(
             button_frame, 
             text="退出", 
-            command=root.destroy
+            command=self.quit
         ).pack(side=tk.RIGHT, padx=5)
+        
+        root.protocol("WM_DELETE_WINDOW", self.quit)
+        self.drain_events()
+        self.update_throughput()
     
     def browse_file(self):
         """Open file dialog to select markdown file"""
         filename = filedialog.askopenfilename(
-            title="选择包含豆瓣音乐Top25数据的Markdown文件",
-            filetypes=[("Markdown文件", "*.md"), ("所有文件", "*.*")]
+            title="选择包含豆瓣音乐Top25数据的文件",
+            filetypes=[
+                ("Markdown文件", "*.md"),
+                ("CSV文件", "*.csv"),
+                ("JSONL文件", "*.jsonl"),
+                ("Parquet文件", "*.parquet"),
+                ("所有文件", "*.*")
+            ]
         )
         if filename:
             self.file_path.set(filename)
@@ -379,18 +4100,109 @@ class ReviewGeneratorGUI:
         if dirname:
             self.output_dir.set(dirname)
     
+    def post(self, kind, *payload):
+        """Queue an event for the Tk main loop (safe to call from any thread)"""
+        self.events.put((kind,) + payload)
+    
     def log_message(self, message):
-        """Add message to the progress text box"""
+        """Add message to the progress text box (main thread only)"""
         self.progress_text.insert(tk.END, message + "\n")
         self.progress_text.see(tk.END)
-        self.root.update_idletasks()
+    
+    def drain_events(self):
+        """Apply queued worker events in batches, then reschedule from the Tk main loop"""
+        for _ in range(self.MAX_EVENTS_PER_TICK):
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            self.handle_event(event[0], *event[1:])
+        self.root.after(self.DRAIN_INTERVAL_MS, self.drain_events)
+    
+    def handle_event(self, kind, *payload):
+        """Apply a single worker event to the widgets"""
+        if kind == 'log':
+            self.log_message(payload[0])
+        elif kind == 'entries':
+            self.status_table.delete(*self.status_table.get_children())
+            for row, music_info in enumerate(payload[0]):
+                self.status_table.insert("", tk.END, iid=str(row), values=(
+                    music_info['序号'], music_info['歌曲名'], self.STATUS_LABELS['pending'], ""
+                ))
+            self.total_entries = len(payload[0])
+        elif kind == 'status':
+            row, status, latency = payload
+            iid = str(row)
+            if self.status_table.exists(iid):
+                self.status_table.set(iid, "status", self.STATUS_LABELS.get(status, status))
+                if latency is not None:
+                    self.status_table.set(iid, "latency", f"{latency:.1f}")
+                if status == 'running':
+                    self.status_table.see(iid)
+            if status not in ('running', 'cancelled'):
+                self.completed_count += 1
+                if self.total_entries:
+                    self.progress_var.set((self.completed_count / self.total_entries) * 100)
+        elif kind == 'info':
+            messagebox.showinfo(*payload)
+        elif kind == 'error':
+            messagebox.showerror(*payload)
+        elif kind == 'finished':
+            self.set_running(False)
+    
+    def set_running(self, running):
+        """Enable the controls that apply while a run is (or is not) in progress"""
+        self.start_button.configure(state=tk.DISABLED if running else tk.NORMAL)
+        self.pause_button.configure(state=tk.NORMAL if running else tk.DISABLED, text="暂停")
+        self.cancel_button.configure(state=tk.NORMAL if running else tk.DISABLED)
+    
+    def toggle_pause(self):
+        """Pause or resume the running generation"""
+        if self.control is None:
+            return
+        if self.control.paused:
+            self.control.resume()
+            self.pause_button.configure(text="暂停")
+            self.log_message("继续生成")
+        else:
+            self.control.pause()
+            self.pause_button.configure(text="继续")
+            self.log_message("已暂停：进行中的请求完成后不再开始新的请求")
+    
+    def cancel_generation(self):
+        """Stop submitting new entries; in-flight requests are allowed to finish"""
+        if self.control is None or self.control.cancelled:
+            return
+        self.control.cancel()
+        self.pause_button.configure(state=tk.DISABLED)
+        self.cancel_button.configure(state=tk.DISABLED)
+        self.log_message("正在取消：等待进行中的请求完成...")
+    
+    def quit(self):
+        """Cancel any running generation and close the window"""
+        if self.control is not None:
+            self.control.cancel()
+        self.root.destroy()
     
     def start_generation(self):
         """Start the review generation process"""
+        if self.worker is not None and self.worker.is_alive():
+            return
         md_file = self.file_path.get()
         output_dir = self.output_dir.get()
         keep_thinking = self.keep_thinking.get()
         simulation_mode = self.simulation_mode.get()
+        use_cache = self.use_cache.get()
+        resume = self.resume.get()
+        stream = self.stream.get()
+        try:
+            concurrency = max(1, int(self.concurrency.get()))
+            requests_per_minute = max(1, int(self.requests_per_minute.get()))
+        except (tk.TclError, ValueError):
+            messagebox.showerror("错误", "并发请求数和每分钟请求数必须是正整数")
+            return
+        if simulation_mode and not self.requests_per_minute_edited:
+            requests_per_minute = 1e9
         
         if not os.path.exists(md_file):
             messagebox.showerror("错误", f"找不到指定的Markdown文件: {md_file}")
@@ -399,178 +4211,789 @@ class ReviewGeneratorGUI:
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
         
-        # Clear progress text
+        # Clear progress text and status table
         self.progress_text.delete(1.0, tk.END)
+        self.status_table.delete(*self.status_table.get_children())
+        self.progress_var.set(0)
+        self.completed_count = 0
+        self.total_entries = 0
         self.log_message(f"开始处理文件: {md_file}")
         self.log_message(f"输出目录: {output_dir}")
         self.log_message(f"保留思考过程: {'是' if keep_thinking else '否'}")
         self.log_message(f"模拟模式: {'是' if simulation_mode else '否'}")
+        self.log_message(f"并发请求数: {concurrency}")
+        self.log_message(f"每分钟请求数: {'不限制' if requests_per_minute >= 1e9 else requests_per_minute}")
         self.log_message("----------------------------")
         
         # Start processing in a separate thread to avoid blocking the UI
-        import threading
-        thread = threading.Thread(
+        self.control = RunControl()
+        self.run_started = time.monotonic()
+        self.set_running(True)
+        self.worker = threading.Thread(
             target=self.process_file,
-            args=(md_file, output_dir, keep_thinking, simulation_mode)
+            args=(md_file, output_dir, keep_thinking, simulation_mode, concurrency, requests_per_minute,
+                  use_cache, resume, stream, self.control)
         )
-        thread.daemon = True
-        thread.start()
+        self.worker.daemon = True
+        self.worker.start()
+    
+    def update_throughput(self):
+        """Refresh the throughput readout from the Tk main loop"""
+        api_client = self.api_client
+        if api_client is not None and self.run_started is not None:
+            meter = api_client.token_meter
+            elapsed_minutes = max(time.monotonic() - self.run_started, 1e-6) / 60
+            self.throughput_var.set(
+                f"吞吐量: {meter.rate():.1f} tokens/秒 (累计 {meter.total_tokens} tokens) | "
+                f"已完成 {self.completed_count}/{self.total_entries}，"
+                f"{self.completed_count / elapsed_minutes:.1f} 条/分钟"
+            )
+        self.root.after(1000, self.update_throughput)
     
-    def process_file(self, md_file, output_dir, keep_thinking, simulation_mode):
-        """Process the markdown file and generate reviews"""
+    def process_file(self, md_file, output_dir, keep_thinking, simulation_mode, concurrency=1,
+                     requests_per_minute=10, use_cache=True, resume=False, stream=False, control=None):
+        """Process the markdown file and generate reviews (runs on the worker thread)
+        
+        All UI updates are posted as events; nothing here touches Tk directly.
+        """
+        cache = None
+        journal = None
+        recorder = None
+        api_client = None
+        self.api_client = None
         try:
+            if use_cache and not simulation_mode:
+                cache = ResponseCache(DEFAULT_CACHE_PATH)
+            
             # Initialize API client
             api_client = DeepSeekAPI(
                 keep_thinking=keep_thinking,
-                simulation_mode=simulation_mode
+                simulation_mode=simulation_mode,
+                rate_limiter=RateLimiter(requests_per_minute, burst=concurrency),
+                cache=cache,
+                stream=stream,
+                pool_size=max(10, concurrency)
             )
+            self.api_client = api_client
             
-            # Read the markdown file
-            with open(md_file, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            
-            # Filter out valid music entries
-            music_entries = []
-            for line in lines:
-                music_info = extract_music_info_from_md_line(line)
-                if music_info:
-                    music_entries.append(music_info)
+            # Load the valid music entries (the GUI needs the total for its progress bar)
+            music_entries = list(iter_music_entries(md_file))
             
             if not music_entries:
-                self.log_message("错误: 未在文件中找到有效的音乐条目")
-                messagebox.showerror("错误", "未在文件中找到有效的音乐条目")
+                self.post('log', "错误: 未在文件中找到有效的音乐条目")
+                self.post('error', "错误", "未在文件中找到有效的音乐条目")
                 return
             
             total_entries = len(music_entries)
-            self.log_message(f"找到 {total_entries} 个音乐条目")
+            self.post('entries', music_entries)
+            self.post('log', f"找到 {total_entries} 个音乐条目")
+            rows = {id(music_info): row for row, music_info in enumerate(music_entries)}
             
-            # Reset progress bar
-            self.progress_var.set(0)
+            journal = RunJournal(os.path.join(output_dir, RUN_JOURNAL_FILENAME))
+            recorder = MetricsRecorder(os.path.join(output_dir, METRICS_FILENAME))
+            layout = OutputLayout(output_dir)
+            counts = layout.plan(music_entries)
+            layout.save()
+            if counts['renamed']:
+                self.post('log', f"{counts['renamed']} 个同名条目的评论文件名加上了表演者或序号后缀")
             
-            # Process each music entry
-            for i, music_info in enumerate(music_entries):
-                # Update progress
-                progress_percent = (i / total_entries) * 100
-                self.progress_var.set(progress_percent)
-                
+            def on_start(music_info):
+                self.post('status', rows[id(music_info)], 'running', None)
+            
+            def on_result(result):
+                music_info = result['music_info']
                 song_name = music_info['歌曲名'].split('/')[0].strip()
-                self.log_message(f"处理 [{i+1}/{total_entries}]: {song_name}")
-                
-                # 不再检查文件是否存在，直接生成评论
-                self.log_message(f"为 '{song_name}' 生成评论...")
-                review = api_client.generate_review(music_info)
-                
-                if review:
-                    # Save review
-                    filepath = save_review(music_info, review, output_dir)
-                    if filepath:
-                        self.log_message(f"成功保存评论到: {filepath}")
-                    else:
-                        self.log_message(f"保存评论失败: {song_name}")
-                else:
-                    self.log_message(f"生成评论失败: {song_name}")
-                
-                # Add a longer delay between successful operations to avoid triggering rate limits
-                if not simulation_mode:
-                    wait_time = 10  # seconds
-                    self.log_message(f"等待 {wait_time} 秒后处理下一条...")
-                    time.sleep(wait_time)
+                self.post('status', rows[id(music_info)], result['status'], result.get('latency'))
+                if result['status'] == 'save_failed':
+                    self.post('log', f"保存评论失败: {song_name}")
+                elif result['status'] == 'failed':
+                    self.post('log', f"生成评论失败: {song_name}")
+                elif result['status'] == 'invalid':
+                    self.post('log', f"评论未通过校验: {song_name} ({', '.join(result['problems'])})")
+            
+            # 不再检查文件是否存在，直接生成评论
+            results = generate_reviews_concurrently(
+                api_client,
+                music_entries,
+                output_dir,
+                concurrency=concurrency,
+                on_start=on_start,
+                on_result=on_result,
+                journal=journal,
+                resume=resume,
+                recorder=recorder,
+                control=control,
+                validator=ReviewValidator(get_templates().language),
+                validation_retries=1,
+                layout=layout
+            )
             
-            # Set progress to 100% when done
-            self.progress_var.set(100)
-            self.log_message("----------------------------")
-            self.log_message("音乐评论生成完成!")
-            messagebox.showinfo("完成", "音乐评论生成完成!")
+            self.post('log', "----------------------------")
+            if control is not None and control.cancelled:
+                finished = {id(result['music_info']) for result in results}
+                for music_info in music_entries:
+                    if id(music_info) not in finished:
+                        self.post('status', rows[id(music_info)], 'cancelled', None)
+                self.post('log', f"已取消：完成 {len(results)}/{total_entries} 个条目")
+            else:
+                self.post('log', "音乐评论生成完成!")
+                self.post('info', "完成", "音乐评论生成完成!")
             
         except Exception as e:
             error_msg = f"处理过程中出错: {str(e)}"
-            self.log_message(error_msg)
+            self.post('log', error_msg)
             logger.error(error_msg, exc_info=True)
-            messagebox.showerror("错误", error_msg)
+            self.post('error', "错误", error_msg)
+        finally:
+            if journal is not None:
+                journal.close()
+            if recorder is not None:
+                recorder.log_summary()
+                recorder.close()
+            if api_client is not None:
+                self.post('log', f"连接统计: {api_client.connection_summary()}")
+                api_client.close()
+            if cache is not None:
+                self.post('log', f"缓存统计: {cache.stats()}")
+                cache.close()
+            self.post('finished')
 
 
 def parse_arguments():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(description="AI 音乐评论生成器")
+    parser.add_argument("command", nargs='?', default='generate',
+                        choices=['generate', 'validate', 'reprocess', 'index', 'search', 'export', 'serve'],
+                        help="generate: 生成评论（默认）；validate: 离线校验已保存的评论文件；"
+                             "reprocess: 多进程重新清理、规范化已保存的评论；"
+                             "index: 更新评论全文索引；search: 全文检索评论；export: 批量导出评论；"
+                             "serve: 常驻服务，通过HTTP或标准输入接收条目并排队生成")
+    parser.add_argument("paths", nargs='*',
+                        help="validate/reprocess: 要处理的评论文件或目录 (默认: 输出目录)；search: 检索词；"
+                             "export: 导出文件路径 (.jsonl/.parquet/.md)，其后可跟检索词")
     parser.add_argument("--gui", action="store_true", help="启动图形用户界面")
     parser.add_argument("--file", type=str, default=DEFAULT_MD_FILE_PATH, 
-                        help=f"指定Markdown数据文件路径 (默认: {DEFAULT_MD_FILE_PATH})")
+                        help=f"指定数据文件路径，支持Markdown表格/CSV/JSONL/Parquet (默认: {DEFAULT_MD_FILE_PATH})")
     parser.add_argument("--output-dir", type=str, default=DEFAULT_OUTPUT_DIR,
                         help=f"指定评论输出目录 (默认: {DEFAULT_OUTPUT_DIR})")
     parser.add_argument("--keep-thinking", action="store_true",
                         help="保留DeepSeek R1的思考过程")
     parser.add_argument("--simulation", action="store_true",
-                        help="模拟运行（不实际调用API）")
+                        help="模拟运行：请求发往本地可复现的模拟后端，不实际调用API")
+    parser.add_argument("--sim", action="append", default=[], metavar="KEY=VALUE",
+                        help="模拟后端参数（隐含 --simulation），可重复，例如 seed=7、latency=lognormal:0.8:0.4、"
+                             "rate_limit_rate=0.05、server_error_rate=0.02、connection_error_rate=0.01、"
+                             "truncation_rate=0.05、review_length=normal:420:60、think_chars=uniform:100:600")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="同时进行的API请求数量 (默认: 1)")
+    parser.add_argument("--rpm", type=float, default=None,
+                        help="每分钟最多发送的请求数 (默认: 10；模拟模式下默认不限制)")
+    parser.add_argument("--tpm", type=float, default=None,
+                        help="每分钟最多消耗的token数 (默认: 不限制)")
+    parser.add_argument("--max-tokens", type=int, default=None,
+                        help="每个请求最多生成的token数 (默认: 由服务端决定)")
+    parser.add_argument("--token-budget", type=int, default=None,
+                        help="本次运行最多消耗的token总数，用完后剩余条目留到下次运行 (默认: 不限制)")
+    parser.add_argument("--price-input", type=float, default=None,
+                        help="输入token单价（美元/百万token），用于估算整个目录的费用")
+    parser.add_argument("--price-output", type=float, default=None,
+                        help="输出token单价（美元/百万token），用于估算整个目录的费用")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="不使用本地响应缓存")
+    parser.add_argument("--refresh", action="store_true",
+                        help="忽略已缓存的结果并重新生成（新结果仍会写入缓存）")
+    parser.add_argument("--cache-path", type=str, default=DEFAULT_CACHE_PATH,
+                        help=f"指定响应缓存数据库路径 (默认: {DEFAULT_CACHE_PATH})")
+    parser.add_argument("--resume", action="store_true",
+                        help="根据运行日志跳过已完成且未变化的条目，只重试失败或未完成的条目")
+    parser.add_argument("--incremental", action="store_true",
+                        help="与上次运行的清单比对，只为新增或有变化的条目生成评论")
+    parser.add_argument("--prune", action="store_true",
+                        help="删除已从数据文件中移除的条目对应的评论文件")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="只打印比对结果和生成计划，不调用API也不写文件（reprocess 时只统计不写回）")
+    parser.add_argument("--templates-dir", type=str, default=None,
+                        help=f"提示词和输出模板目录 (默认: {DEFAULT_TEMPLATES_DIR})")
+    parser.add_argument("--language", type=str, default=None,
+                        help=f"使用的模板语言子目录，例如 zh 或 en (默认: {DEFAULT_LANGUAGE})")
+    parser.add_argument("--render-only", type=str, default=None, metavar="PROMPTS_FILE",
+                        help="只把所有提示词渲染到指定的JSONL文件中以便离线检查，不调用API")
+    parser.add_argument("--stream", action="store_true",
+                        help="以流式方式接收API响应，并边生成边写入评论文件")
+    parser.add_argument("--api-url", type=str, default=None,
+                        help=f"指定chat completions接口地址 (默认: {API_URL})")
+    parser.add_argument("--endpoints", type=str, default=None,
+                        help="多个OpenAI兼容接口的JSON配置文件，按健康度和延迟分配请求并自动故障转移")
+    parser.add_argument("--http2", action="store_true",
+                        help="并发时使用HTTP/2多路复用（需要安装 httpx[http2]）")
+    parser.add_argument("--pool-size", type=int, default=None,
+                        help="HTTP连接池大小 (默认: max(10, 并发数))")
+    parser.add_argument("--connect-timeout", type=float, default=10,
+                        help="建立连接的超时秒数 (默认: 10)")
+    parser.add_argument("--read-timeout", type=float, default=120,
+                        help="等待响应的超时秒数 (默认: 120)")
+    parser.add_argument("--max-retries", type=int, default=5,
+                        help="每个请求的最大尝试次数 (默认: 5)")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="每个请求合并生成的条目数，解析失败的条目会单独重试 (默认: 1)")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="合并重复条目（繁简体、别名、版本后缀和标点归一化后相同），每组只生成一次评论")
+    parser.add_argument("--no-validate", action="store_true",
+                        help="不校验生成的评论（长度、标题、话题标签、截断和语言）")
+    parser.add_argument("--validation-retries", type=int, default=1,
+                        help="未通过校验的评论重新生成的轮数 (默认: 1)")
+    parser.add_argument("--fix", action="store_true",
+                        help="validate 时把规范化后的内容写回评论文件")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="reprocess 使用的进程数 (默认: CPU核心数)")
+    parser.add_argument("--rerender", action="store_true",
+                        help="reprocess 时用当前模板重新生成评论文件的元数据头")
+    parser.add_argument("--shard-threshold", type=int, default=SHARD_THRESHOLD,
+                        help=f"条目数超过该值后新评论按哈希分到子目录中 (默认: {SHARD_THRESHOLD})")
+    parser.add_argument("--index-path", type=str, default=None,
+                        help=f"评论索引数据库路径 (默认: 输出目录下的 {INDEX_FILENAME})")
+    parser.add_argument("--genre", type=str, default=None,
+                        help="search/export 时只保留该流派的评论")
+    parser.add_argument("--artist", type=str, default=None,
+                        help="search/export 时只保留表演者包含该文本的评论")
+    parser.add_argument("--limit", type=int, default=20,
+                        help="search 显示的最多结果数 (默认: 20)")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                        help="serve 监听的地址 (默认: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="serve 监听的端口 (默认: 8765)")
+    parser.add_argument("--stdin", action="store_true",
+                        help="serve 从标准输入逐行读取JSON条目，全部完成后退出")
+    parser.add_argument("--metrics-file", type=str, default=None,
+                        help=f"逐条请求指标的JSONL输出路径 (默认: 输出目录下的 {METRICS_FILENAME})")
+    parser.add_argument("--prometheus-file", type=str, default=None,
+                        help="运行结束时以Prometheus文本格式导出指标的文件路径")
     return parser.parse_args()
 
 
-def process_file_cli(md_file_path, output_dir, keep_thinking, simulation_mode):
-    """Process markdown file in CLI mode"""
+def render_prompts(md_file_path, output_path, batch_size=1):
+    """Write every prompt for a catalogue to a JSONL file without calling the API
+    
+    One line per request: the entry numbers, the template it was rendered from
+    and the prompt text. Entries are streamed, so large tables render quickly
+    in constant memory. Returns the number of prompts written.
+    """
+    templates = get_templates()
+    batch_size = max(1, int(batch_size))
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.jsonl')
+    count = 0
+    
+    def records():
+        batch = []
+        for music_info in iter_music_entries(md_file_path):
+            if batch_size == 1:
+                template = templates.select('prompt', music_info)
+                yield {'序号': [music_info['序号']], 'template': template.name,
+                       'template_hash': template.hash, 'prompt': template.render(music_info)}
+                continue
+            batch.append(music_info)
+            if len(batch) >= batch_size:
+                yield batch_record(batch)
+                batch = []
+        if batch:
+            yield batch_record(batch)
+    
+    def batch_record(batch):
+        template = templates.select('batch_prompt')
+        return {'序号': [info['序号'] for info in batch], 'template': template.name,
+                'template_hash': template.hash, 'prompt': templates.render_batch_prompt(batch)}
+    
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for record in records():
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    logger.info(f"Rendered {count} prompts to {output_path} (templates {templates.hash})")
+    return count
+
+
+def index_cli(command, targets, output_dir, index_path=None, genre=None, artist=None, limit=20):
+    """Run the index/search/export commands against the review directory
+    
+    The index is refreshed incrementally first, so searches and exports always
+    reflect the files on disk. Returns the matching reviews (search/export).
+    """
+    if not os.path.isdir(output_dir):
+        logger.error(f"Review directory not found: {output_dir}")
+        return []
+    index = ReviewIndex(index_path or os.path.join(output_dir, INDEX_FILENAME))
+    try:
+        index.update(output_dir)
+        if command == 'index':
+            return []
+        if command == 'export':
+            if not targets:
+                logger.error("export needs an output path (.jsonl, .parquet or .md)")
+                return []
+            output_path, terms = targets[0], targets[1:]
+            reviews = list(index.query(terms, genre=genre, artist=artist))
+            try:
+                export_reviews(reviews, output_path)
+            except ValueError as e:
+                logger.error(str(e))
+                return []
+            return reviews
+        reviews = list(index.query(targets, genre=genre, artist=artist, limit=limit))
+        for review in reviews:
+            print(f"{review['歌曲名']} - {review['表演者']} [{review['流派']}] {review['评分']}")
+            print(f"  {review_snippet(review['body'], targets)}")
+            print(f"  {review['path']}")
+        print(f"{len(reviews)} 条结果")
+        return reviews
+    finally:
+        index.close()
+
+
+def log_batch_summary(results, api_client):
+    """Log how many requests batching saved and the latency per review"""
+    generated = [r for r in results if r['status'] in ('saved', 'save_failed', 'invalid')]
+    # Retries and failover are not what batching saves, so count completion calls, not HTTP attempts
+    requests_made = api_client.completion_calls
+    attempts = api_client.connection_stats['requests']
+    latencies = [r['latency'] for r in generated if 'latency' in r]
+    average_latency = sum(latencies) / len(latencies) if latencies else 0.0
+    logger.info(f"Batch mode: {len(generated)} reviews from {requests_made} API requests "
+                f"({attempts} HTTP attempts, {max(0, len(generated) - requests_made)} requests saved), "
+                f"{average_latency:.2f}s latency per review")
+
+
+def log_cost_projection(summary, catalogue_entries, price_input=None, price_output=None):
+    """Log tokens per generated review and the projected tokens and cost of the whole catalogue
+    
+    Prices are in USD per million tokens; without them only tokens are projected.
+    Returns the projection dict, or None when nothing was generated.
+    """
+    generated = summary['generated']
+    if not generated:
+        return None
+    prompt_per_review = summary['prompt_tokens'] / generated
+    completion_per_review = summary['completion_tokens'] / generated
+    projection = {
+        'entries': catalogue_entries,
+        'prompt_tokens': round(prompt_per_review * catalogue_entries),
+        'completion_tokens': round(completion_per_review * catalogue_entries),
+        'cost': None
+    }
+    message = (f"Projected for {catalogue_entries} entries: {projection['prompt_tokens']} prompt + "
+               f"{projection['completion_tokens']} completion tokens "
+               f"({prompt_per_review + completion_per_review:.0f} per review)")
+    if price_input is not None or price_output is not None:
+        run_cost = (summary['prompt_tokens'] * (price_input or 0)
+                    + summary['completion_tokens'] * (price_output or 0)) / 1e6
+        projection['cost'] = (projection['prompt_tokens'] * (price_input or 0)
+                              + projection['completion_tokens'] * (price_output or 0)) / 1e6
+        message += f", ${projection['cost']:.2f} (this run: ${run_cost:.4f})"
+    logger.info(message)
+    return projection
+
+
+def process_file_cli(md_file_path, output_dir, keep_thinking, simulation_mode, concurrency=1,
+                     requests_per_minute=10, tokens_per_minute=None, use_cache=True,
+                     refresh_cache=False, cache_path=DEFAULT_CACHE_PATH, resume=False, stream=False,
+                     api_url=None, http2=False, pool_size=None, connect_timeout=10, read_timeout=120,
+                     max_retries=5, batch_size=1, metrics_file=None, prometheus_file=None,
+                     endpoints_file=None, incremental=False, prune=False, dry_run=False, validate=True,
+                     validation_retries=1, shard_threshold=SHARD_THRESHOLD, simulation_options=None,
+                     session=None, max_tokens=None, token_budget=None, price_input=None, price_output=None,
+                     dedupe=False, api_key=None):
+    """Process markdown file in CLI mode; returns the per-entry result dicts
+    
+    A manifest of row fingerprints is kept in the output directory. With
+    `incremental`, only rows added or changed since the last run are
+    generated; `prune` deletes the reviews of rows that were removed; `dry_run`
+    logs the plan and returns without calling the API or writing files.
+    With `validate`, reviews are checked and normalised before saving and
+    failures are regenerated up to `validation_retries` times. Output paths
+    are planned for the whole catalogue up front (see OutputLayout).
+    In `simulation_mode`, requests go to a SimulatedBackend built from
+    `simulation_options` (or to `session`, when given) instead of the network.
+    `max_tokens` caps each completion; once `token_budget` tokens are spent the
+    remaining entries are deferred. The run summary projects the tokens (and,
+    with `price_input`/`price_output` in USD per million tokens, the cost) of
+    the whole catalogue. With `dedupe`, entries naming the same album are
+    grouped (see group_duplicate_entries) and each group is generated once.
+    `api_key` overrides NVIDIA_API_KEY for the single-endpoint client.
+    """
     logger.info("Starting music review generation process")
     
+    results = []
+    cache = None
+    journal = None
+    api_client = None
+    recorder = None
+    manifest = None
+    layout = None
+    catalogue_entries = 0
     try:
+        manifest = ReviewManifest(os.path.join(output_dir, MANIFEST_FILENAME))
+        layout = OutputLayout(output_dir, shard_threshold)
+        # Entries are read lazily, so very large catalogues are never loaded whole
+        music_entries = iter_music_entries(md_file_path)
+        if incremental or prune or dry_run:
+            # Diffing needs every row (removed rows are those not seen)
+            music_entries = list(music_entries)
+            plan = manifest.plan(music_entries)
+            log_catalogue_plan(plan, incremental, prune, verbose=dry_run)
+            catalogue_entries = layout.plan(music_entries)['entries']
+            if dry_run:
+                if dedupe:
+                    log_duplicate_groups(*group_duplicate_entries(music_entries), verbose=True)
+                manifest = layout = None
+                return results
+            if incremental:
+                music_entries = plan['added'] + plan['changed'] + plan['missing']
+        else:
+            # A separate pass, so generation can still stream the rows
+            catalogue_entries = layout.plan(iter_music_entries(md_file_path))['entries']
+        duplicates = None
+        if dedupe:
+            # Duplicates can be far apart in the catalogue, so grouping needs every row
+            music_entries, duplicates = group_duplicate_entries(list(music_entries))
+            log_duplicate_groups(music_entries, duplicates)
+            # Only one review per group is paid for
+            catalogue_entries -= sum(len(members) for members in duplicates.values())
+        
+        # Responses are only cached for real API calls
+        if use_cache and not simulation_mode:
+            cache = ResponseCache(cache_path, refresh=refresh_cache)
+        
+        # Several endpoints each get their own rate budget
+        endpoints = None
+        if endpoints_file and not simulation_mode:
+            endpoints = load_endpoints(endpoints_file, requests_per_minute, tokens_per_minute, burst=concurrency)
+            logger.info(f"Routing requests over {len(endpoints)} endpoints")
+        
+        if session is None and simulation_mode:
+            session = SimulatedBackend(**(simulation_options or {}))
+        
         # Initialize API client
         api_client = DeepSeekAPI(
+            api_key=api_key,
             keep_thinking=keep_thinking,
-            simulation_mode=simulation_mode
+            simulation_mode=simulation_mode,
+            rate_limiter=RateLimiter(requests_per_minute, tokens_per_minute, burst=concurrency),
+            cache=cache,
+            stream=stream,
+            session=session,
+            api_url=api_url,
+            http2=http2 and concurrency > 1,
+            pool_size=pool_size or max(10, concurrency),
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            max_retries=max_retries,
+            endpoints=endpoints,
+            max_tokens=max_tokens,
+            token_budget=TokenBudget(token_budget) if token_budget else None
         )
         
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
+        journal = RunJournal(os.path.join(output_dir, RUN_JOURNAL_FILENAME))
+        recorder = MetricsRecorder(metrics_file or os.path.join(output_dir, METRICS_FILENAME))
+        layout.save()
+        if prune:
+            removed = prune_removed_reviews(plan, manifest, output_dir, layout)
+            logger.info(f"Pruned {removed} reviews of removed entries")
         
-        # Read the markdown file
-        with open(md_file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        # Process each line
-        for i, line in enumerate(lines):
-            music_info = extract_music_info_from_md_line(line)
-            if not music_info:
-                continue
-                
+        def on_start(music_info):
             logger.info(f"Processing entry {music_info['序号']}: {music_info['歌曲名']}")
-            
             # 不再检查文件是否存在，直接生成评论
             song_name = music_info['歌曲名'].split('/')[0].strip()
             logger.info(f"Generating review for {song_name}")
-                
-            # Generate review
-            review = api_client.generate_review(music_info)
-            if review:
-                # Save review
-                save_review(music_info, review, output_dir)
-                logger.info(f"Completed review for {music_info['歌曲名']}")
+        
+        def on_result(result):
+            if result['status'] in ('saved', 'skipped'):
+                manifest.update(result['music_info'], result['filepath'])
+            if result['status'] == 'skipped':
+                logger.info(f"Skipping {result['music_info']['歌曲名']}: already done ({result['filepath']})")
+            elif result['status'] == 'saved':
+                logger.info(f"Completed review for {result['music_info']['歌曲名']}")
+            elif result['status'] == 'save_failed':
+                logger.error(f"Failed to save review for {result['music_info']['歌曲名']}")
+            elif result['status'] == 'invalid':
+                logger.warning(f"Saved review for {result['music_info']['歌曲名']} failed validation "
+                               f"({', '.join(result['problems'])})")
+            elif result['status'] == 'deferred':
+                # Left for a later run; generate_reviews_concurrently logs the count once
+                pass
             else:
-                logger.error(f"Failed to generate review for {music_info['歌曲名']}")
-            
-            # Add a longer delay between successful operations to avoid triggering rate limits
-            if not simulation_mode:
-                wait_time = 10  # seconds
-                logger.info(f"Waiting {wait_time} seconds before processing next item")
-                time.sleep(wait_time)
+                logger.error(f"Failed to generate review for {result['music_info']['歌曲名']}")
+        
+        if concurrency > 1:
+            logger.info(f"Running with {concurrency} concurrent requests")
+        if batch_size > 1:
+            logger.info(f"Batching up to {batch_size} entries per request")
+        
+        results = generate_reviews_concurrently(
+            api_client,
+            music_entries,
+            output_dir,
+            concurrency=concurrency,
+            on_start=on_start,
+            on_result=on_result,
+            journal=journal,
+            resume=resume,
+            batch_size=batch_size,
+            recorder=recorder,
+            validator=ReviewValidator(get_templates().language) if validate else None,
+            validation_retries=validation_retries,
+            layout=layout,
+            duplicates=duplicates
+        )
+        if batch_size > 1:
+            log_batch_summary(results, api_client)
+        if duplicates:
+            copied = sum(1 for result in results
+                         if 'duplicate_of' in result and result['status'] in ('saved', 'invalid'))
+            logger.info(f"Deduplication: {copied} duplicate entries reused their group's review "
+                        f"({copied} requests saved)")
             
     except Exception as e:
         logger.error(f"Error in main process: {str(e)}", exc_info=True)
+    finally:
+        if manifest is not None and os.path.isdir(output_dir):
+            manifest.save()
+        if layout is not None and os.path.isdir(output_dir):
+            # Entries assigned on first use during the run are kept too
+            layout.save()
+        if journal is not None:
+            journal.close()
+        if recorder is not None:
+            recorder.log_summary()
+            log_cost_projection(recorder.summary(), catalogue_entries, price_input, price_output)
+            if api_client is not None and api_client.token_budget is not None:
+                logger.info(f"Token budget: {api_client.token_budget.summary()}")
+            if prometheus_file:
+                recorder.write_prometheus(prometheus_file)
+            recorder.close()
+        if api_client is not None:
+            if isinstance(api_client.session, SimulatedBackend):
+                logger.info(f"Simulated backend: {api_client.session.summary()}")
+            else:
+                logger.info(f"HTTP connections: {api_client.connection_summary()}")
+            if len(api_client.endpoints) > 1:
+                for line in api_client.endpoint_summary():
+                    logger.info(f"Endpoint {line}")
+            api_client.close()
+        if cache is not None:
+            logger.info(f"Response cache: {cache.stats()}")
+            cache.close()
     
     logger.info("Music review generation process complete")
+    return results
+
+
+def serve_cli(output_dir, keep_thinking, simulation_mode, concurrency=1, requests_per_minute=10,
+              tokens_per_minute=None, use_cache=True, cache_path=DEFAULT_CACHE_PATH, stream=False, api_url=None,
+              http2=False, pool_size=None, connect_timeout=10, read_timeout=120, max_retries=5,
+              endpoints_file=None, validate=True, validation_retries=1, shard_threshold=SHARD_THRESHOLD,
+              simulation_options=None, max_tokens=None, host='127.0.0.1', port=8765, use_stdin=False):
+    """Run the `serve` mode: generate reviews for entries submitted over HTTP or stdin
+    
+    Jobs are kept in a JobQueue in the output directory, so submissions made
+    while the service is down or busy survive a restart. With `use_stdin`,
+    one JSON entry per line is read from stdin, acknowledgements and finished
+    jobs are written to stdout as JSON lines, and the service exits once every
+    job has settled; otherwise it serves HTTP on `host`:`port` until interrupted.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    job_queue = JobQueue(os.path.join(output_dir, JOB_QUEUE_FILENAME))
+    cache = ResponseCache(cache_path) if use_cache and not simulation_mode else None
+    endpoints = None
+    if endpoints_file and not simulation_mode:
+        endpoints = load_endpoints(endpoints_file, requests_per_minute, tokens_per_minute, burst=concurrency)
+        logger.info(f"Routing requests over {len(endpoints)} endpoints")
+    api_client = DeepSeekAPI(
+        keep_thinking=keep_thinking,
+        simulation_mode=simulation_mode,
+        rate_limiter=RateLimiter(requests_per_minute, tokens_per_minute, burst=concurrency),
+        cache=cache,
+        stream=stream,
+        session=SimulatedBackend(**(simulation_options or {})) if simulation_mode else None,
+        api_url=api_url,
+        http2=http2 and concurrency > 1,
+        pool_size=pool_size or max(10, concurrency),
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        max_retries=max_retries,
+        endpoints=endpoints,
+        max_tokens=max_tokens
+    )
+    journal = RunJournal(os.path.join(output_dir, RUN_JOURNAL_FILENAME))
+    recorder = MetricsRecorder(os.path.join(output_dir, METRICS_FILENAME))
+    layout = OutputLayout(output_dir, shard_threshold)
+    # Records the review files already on disk, so new entries do not take their names
+    layout.plan([])
+    output_lock = threading.Lock()
+    
+    def on_finish(job):
+        logger.info(f"Job {job['id']} {job['status']}: {job['music_info']['歌曲名']}")
+        if use_stdin:
+            event = {key: job[key] for key in ('id', 'status', 'output', 'problems')}
+            with output_lock:
+                os.sys.stdout.write(json.dumps(event, ensure_ascii=False) + '\n')
+                os.sys.stdout.flush()
+    
+    counts = job_queue.counts()
+    if counts:
+        logger.info(f"Job queue: {', '.join(f'{status}={count}' for status, count in sorted(counts.items()))}")
+    service = ReviewService(
+        api_client, job_queue, output_dir,
+        concurrency=concurrency,
+        journal=journal,
+        recorder=recorder,
+        validator=ReviewValidator(get_templates().language) if validate else None,
+        validation_retries=validation_retries,
+        layout=layout,
+        on_finish=on_finish
+    ).start()
+    try:
+        if use_stdin:
+            service.serve_stdin(os.sys.stdin, _LockedWriter(os.sys.stdout, output_lock))
+        else:
+            service.serve_http(host, port)
+    finally:
+        service.stop()
+        layout.save()
+        journal.close()
+        recorder.log_summary()
+        recorder.close()
+        api_client.close()
+        if cache is not None:
+            cache.close()
+        job_queue.close()
+    return job_queue.path
+
+
+class _LockedWriter:
+    """File wrapper serialising writes with the worker threads' job reports"""
+    
+    def __init__(self, stream, lock):
+        self._stream = stream
+        self._lock = lock
+    
+    def write(self, text):
+        with self._lock:
+            self._stream.write(text)
+    
+    def flush(self):
+        with self._lock:
+            self._stream.flush()
 
 
 def main():
     """Main function"""
     args = parse_arguments()
+    configure_logging()
+    if args.templates_dir or args.language:
+        use_templates(args.templates_dir, args.language)
     
     # Launch GUI if requested or if no command-line args provided
     if args.gui or len(os.sys.argv) == 1:
+        _import_tk()
         root = tk.Tk()
         app = ReviewGeneratorGUI(root)
         root.mainloop()
+    elif args.command == 'validate':
+        report = validate_review_files(args.paths or [args.output_dir], args.language or DEFAULT_LANGUAGE,
+                                       fix=args.fix)
+        # A non-zero exit lets scripts gate on the result
+        os.sys.exit(1 if any(report.values()) else 0)
+    elif args.command == 'reprocess':
+        reprocess_reviews(args.paths or [args.output_dir], workers=args.workers, rerender=args.rerender,
+                          write=not args.dry_run)
+    elif args.command in ('index', 'search', 'export'):
+        index_cli(args.command, args.paths, args.output_dir, args.index_path,
+                  genre=args.genre, artist=args.artist, limit=args.limit)
+    elif args.render_only:
+        render_prompts(args.file, args.render_only, batch_size=args.batch_size)
     else:
+        try:
+            simulation_options = parse_simulation_options(args.sim)
+        except ValueError as e:
+            logger.error(str(e))
+            os.sys.exit(2)
+        simulation = args.simulation or bool(args.sim)
+        # Simulated runs are only throttled when asked to, so they stay fast by default
+        requests_per_minute = args.rpm or (1e9 if simulation else 10)
+        if args.command == 'serve':
+            serve_cli(
+                args.output_dir,
+                args.keep_thinking,
+                simulation,
+                concurrency=args.concurrency,
+                requests_per_minute=requests_per_minute,
+                tokens_per_minute=args.tpm,
+                use_cache=not args.no_cache,
+                cache_path=args.cache_path,
+                stream=args.stream,
+                api_url=args.api_url,
+                http2=args.http2,
+                pool_size=args.pool_size,
+                connect_timeout=args.connect_timeout,
+                read_timeout=args.read_timeout,
+                max_retries=args.max_retries,
+                endpoints_file=args.endpoints,
+                validate=not args.no_validate,
+                validation_retries=args.validation_retries,
+                shard_threshold=args.shard_threshold,
+                simulation_options=simulation_options,
+                max_tokens=args.max_tokens,
+                host=args.host,
+                port=args.port,
+                use_stdin=args.stdin
+            )
+            return
         # Run in CLI mode
         process_file_cli(
             args.file, 
             args.output_dir, 
             args.keep_thinking,
-            args.simulation
+            simulation,
+            concurrency=args.concurrency,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=args.tpm,
+            use_cache=not args.no_cache,
+            refresh_cache=args.refresh,
+            cache_path=args.cache_path,
+            resume=args.resume,
+            stream=args.stream,
+            api_url=args.api_url,
+            http2=args.http2,
+            pool_size=args.pool_size,
+            connect_timeout=args.connect_timeout,
+            read_timeout=args.read_timeout,
+            max_retries=args.max_retries,
+            batch_size=args.batch_size,
+            metrics_file=args.metrics_file,
+            prometheus_file=args.prometheus_file,
+            endpoints_file=args.endpoints,
+            incremental=args.incremental,
+            prune=args.prune,
+            dry_run=args.dry_run,
+            validate=not args.no_validate,
+            validation_retries=args.validation_retries,
+            shard_threshold=args.shard_threshold,
+            simulation_options=simulation_options,
+            max_tokens=args.max_tokens,
+            token_budget=args.token_budget,
+            price_input=args.price_input,
+            price_output=args.price_output,
+            dedupe=args.dedupe
         )
 
 
@@ -0,0 +1,28 @@
+"""Request hashes used by the response cache and the resume journal"""
+import music_review_generator as mrg
+
+MUSIC_INFO = {'序号': '1', '歌曲名': 'OK Computer', '表演者': 'Radiohead', '发行时间': '1997', '流派': '摇滚',
+              '专辑类型': '专辑', '介质': 'CD', '评分': '9.5'}
+
+
+def make_client(**kwargs):
+    return mrg.DeepSeekAPI(api_key='test', simulation_mode=True, **kwargs)
+
+
+def test_max_tokens_changes_the_request_hash():
+    uncapped = make_client().request_hash(MUSIC_INFO)
+    assert make_client(max_tokens=200).request_hash(MUSIC_INFO) != uncapped
+    assert make_client(max_tokens=200).request_hash(MUSIC_INFO) != make_client(max_tokens=400).request_hash(MUSIC_INFO)
+
+
+def test_unset_max_tokens_keeps_existing_keys():
+    key = mrg.ResponseCache.make_key('model', 0.6, False, 'prompt', 'templates')
+    assert mrg.ResponseCache.make_key('model', 0.6, False, 'prompt', 'templates', max_tokens=None) == key
+    assert mrg.ResponseCache.make_key('model', 0.6, False, 'prompt', 'templates', max_tokens=100) != key
+
+
+def test_endpoint_models_are_part_of_the_request_hash():
+    single = make_client(endpoints=[mrg.Endpoint('http://a', 'k', model='model-a')])
+    mixed = make_client(endpoints=[mrg.Endpoint('http://a', 'k', model='model-a'),
+                                   mrg.Endpoint('http://b', 'k', model='model-b')])
+    assert single.request_hash(MUSIC_INFO) != mixed.request_hash(MUSIC_INFO)
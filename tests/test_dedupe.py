@@ -0,0 +1,66 @@
+"""Outcomes recorded for duplicate entries that reuse their group's review"""
+import music_review_generator as mrg
+
+ORIGINAL = {'序号': '1', '歌曲名': 'OK Computer', '表演者': 'Radiohead', '发行时间': '1997', '流派': '摇滚',
+            '专辑类型': '专辑', '介质': 'CD', '评分': '9.5'}
+DUPLICATE = dict(ORIGINAL, **{'序号': '2', '介质': '黑胶'})
+
+
+def copy(tmp_path, group_result, journal=None):
+    client = mrg.DeepSeekAPI(api_key='test', simulation_mode=True)
+    recorder = mrg.MetricsRecorder()
+    result = mrg._copy_to_duplicate(client, group_result, DUPLICATE, str(tmp_path), journal=journal,
+                                    recorder=recorder)
+    return client, result, recorder
+
+
+def test_journaled_duplicate_is_recorded_as_skipped(tmp_path):
+    client = mrg.DeepSeekAPI(api_key='test', simulation_mode=True)
+    review_path = mrg.save_review(ORIGINAL, '# 【乐评】OK Computer\n\n好听。', str(tmp_path))
+    journal = mrg.RunJournal(str(tmp_path / 'journal.jsonl'))
+    journal.record(DUPLICATE, 'done', client.request_hash(DUPLICATE), review_path)
+    _, result, recorder = copy(tmp_path, {'music_info': ORIGINAL, 'filepath': review_path, 'status': 'saved'},
+                               journal)
+    assert result['status'] == 'skipped'
+    assert recorder.summary()['outcomes'] == {'skipped': 1}
+    assert result['metrics']['entry'] == '2'
+
+
+def test_duplicate_of_a_failed_group_is_recorded(tmp_path):
+    _, result, recorder = copy(tmp_path, {'music_info': ORIGINAL, 'filepath': None, 'status': 'failed'})
+    assert result['status'] == 'failed'
+    assert recorder.summary()['outcomes'] == {'failed': 1}
+
+
+def test_copied_duplicate_is_recorded_as_deduplicated(tmp_path):
+    review_path = mrg.save_review(ORIGINAL, '# 【乐评】OK Computer\n\n好听。', str(tmp_path))
+    _, result, recorder = copy(tmp_path, {'music_info': ORIGINAL, 'filepath': review_path, 'status': 'saved'})
+    assert result['status'] == 'saved'
+    assert recorder.summary()['outcomes'] == {'deduplicated': 1}
+    assert result['metrics']['title'] == 'OK Computer'
+
+
+def test_entries_without_an_artist_are_never_grouped():
+    entries = [{'序号': '1', '歌曲名': 'Greatest Hits', '表演者': ''},
+               {'序号': '2', '歌曲名': 'Greatest Hits', '表演者': ''},
+               {'序号': '3', '歌曲名': 'Greatest Hits'}]
+    representatives, duplicates = mrg.group_duplicate_entries(entries)
+    assert representatives == entries
+    assert duplicates == {}
+
+
+def test_entries_sharing_title_and_artist_aliases_are_grouped():
+    entries = [{'序号': '1', '歌曲名': 'OK Computer', '表演者': 'Radiohead'},
+               {'序号': '2', '歌曲名': 'OK Computer (Deluxe Edition)', '表演者': 'radiohead'}]
+    representatives, duplicates = mrg.group_duplicate_entries(entries)
+    assert representatives == entries[:1]
+    assert duplicates == {mrg.entry_identity(entries[0]): entries[1:]}
+
+
+def test_only_slashes_separate_aliases():
+    assert mrg.canonical_aliases('叶惠美 / 葉惠美／Yeh Hui-Mei') == ['叶惠美', 'yehhuimei']
+    entries = [{'序号': '1', '歌曲名': 'A|B', '表演者': 'Artist'},
+               {'序号': '2', '歌曲名': 'B', '表演者': 'Artist'}]
+    representatives, duplicates = mrg.group_duplicate_entries(entries)
+    assert representatives == entries
+    assert duplicates == {}
@@ -0,0 +1,121 @@
+"""Throttling and circuit-breaker behaviour of the request path"""
+import random
+import time
+
+import music_review_generator as mrg
+
+MUSIC_INFO = {'序号': '1', '歌曲名': 'OK Computer', '表演者': 'Radiohead', '发行时间': '1997', '流派': '摇滚',
+              '专辑类型': '专辑', '介质': 'CD', '评分': '9.5'}
+
+
+class ThrottlingSession:
+    """Answers the first `throttled` requests with 429 (Retry-After: 0), then with a review"""
+
+    transport_errors = (mrg.SimulatedConnectionError,)
+
+    def __init__(self, throttled):
+        self.throttled = throttled
+        self.requests = 0
+
+    def post(self, url, headers=None, json=None, timeout=None, stream=False):
+        self.requests += 1
+        if self.requests <= self.throttled:
+            return mrg._SimulatedResponse(429, {"error": "rate limited"}, {'Retry-After': '0'})
+        return mrg._SimulatedResponse(200, {
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "# 【乐评】OK Computer\n\n好听。"}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20}
+        })
+
+
+class RoutingSession:
+    """Answers each URL in `down` with that status code, or a connection error for 'unreachable'; others with a review"""
+
+    transport_errors = (mrg.SimulatedConnectionError,)
+
+    def __init__(self, down):
+        self.down = down
+        self.requests = {}
+
+    def post(self, url, headers=None, json=None, timeout=None, stream=False):
+        self.requests[url] = self.requests.get(url, 0) + 1
+        failure = self.down.get(url)
+        if failure == 'unreachable':
+            raise mrg.SimulatedConnectionError(f"cannot reach {url}")
+        if failure:
+            return mrg._SimulatedResponse(failure, {"error": "server error"}, {'Retry-After': '0'})
+        return ThrottlingSession(throttled=0).post(url)
+
+
+def make_client(session, endpoints=None):
+    return mrg.DeepSeekAPI(api_key='test', session=session, max_retries=10, endpoints=endpoints,
+                           rate_limiter=mrg.RateLimiter(requests_per_minute=1e9))
+
+
+def test_repeated_429s_on_a_single_endpoint_do_not_open_the_circuit():
+    session = ThrottlingSession(throttled=8)
+    client = make_client(session)
+    started = time.monotonic()
+    review = client.generate_review(MUSIC_INFO)
+    assert review and 'OK Computer' in review
+    assert session.requests == 9
+    assert client.connection_stats['requests'] == 9
+    assert client.completion_calls == 1
+    assert client.endpoints[0].breaker.state == 'closed'
+    # The breaker's 30 s cooldown would show up here
+    assert time.monotonic() - started < 5
+
+
+def test_429s_are_not_breaker_failures_with_several_endpoints():
+    endpoints = [mrg.Endpoint(f"http://endpoint-{number}", 'test', rate_limiter=mrg.RateLimiter(1e9))
+                 for number in range(2)]
+    client = make_client(ThrottlingSession(throttled=8), endpoints)
+    assert client.generate_review(MUSIC_INFO)
+    for endpoint in client.endpoints:
+        assert endpoint.breaker.state == 'closed'
+        assert endpoint.breaker.consecutive_failures == 0
+
+
+def test_server_errors_open_the_circuit_of_one_of_several_endpoints():
+    endpoints = [mrg.Endpoint(url, 'test', rate_limiter=mrg.RateLimiter(1e9),
+                              breaker=mrg.CircuitBreaker(failure_threshold=2))
+                 for url in ('http://down', 'http://healthy')]
+    session = RoutingSession(down={'http://down': 500})
+    client = make_client(session, endpoints)
+    client.router._rng = random.Random(0)
+    down, healthy = client.endpoints
+    for _ in range(50):
+        assert client.generate_review(MUSIC_INFO)
+        if down.breaker.state == 'open':
+            break
+    assert down.breaker.state == 'open'
+    assert healthy.breaker.state == 'closed'
+    failed_requests = session.requests['http://down']
+    for _ in range(5):
+        assert client.generate_review(MUSIC_INFO)
+    # Traffic has moved to the healthy endpoint
+    assert session.requests['http://down'] == failed_requests
+    assert session.requests['http://healthy'] >= 5
+
+
+def test_retries_back_off_once_every_endpoint_is_unreachable(monkeypatch):
+    endpoints = [mrg.Endpoint(url, 'test', rate_limiter=mrg.RateLimiter(1e9, jitter=0, base_backoff=1.0))
+                 for url in ('http://a', 'http://b')]
+    session = RoutingSession(down={'http://a': 'unreachable', 'http://b': 'unreachable'})
+    client = mrg.DeepSeekAPI(api_key='test', session=session, max_retries=6, endpoints=endpoints)
+    sleeps = []
+    monkeypatch.setattr(mrg.time, 'sleep', sleeps.append)
+    metrics = mrg.new_request_metrics()
+    assert client.generate_review(MUSIC_INFO, metrics=metrics) is None
+    assert session.requests == {'http://a': 3, 'http://b': 3}
+    # Each round fails over once, then backs off before the next one
+    assert sleeps == [2.0, 8.0, 32.0]
+    assert metrics['backoff_sleep_s'] == sum(sleeps)
+
+
+def test_batch_summary_counts_completion_calls_not_retries(caplog):
+    client = make_client(ThrottlingSession(throttled=3))
+    assert client.generate_review(MUSIC_INFO)
+    results = [{'music_info': MUSIC_INFO, 'status': 'saved', 'latency': 1.0}] * 5
+    with caplog.at_level('INFO', logger=mrg.logger.name):
+        mrg.log_batch_summary(results, client)
+    assert '5 reviews from 1 API requests (4 HTTP attempts, 4 requests saved)' in caplog.text
@@ -0,0 +1,28 @@
+"""Exporting indexed reviews"""
+import shutil
+
+import pytest
+
+import music_review_generator as mrg
+
+
+@pytest.fixture
+def numbered_header_templates(tmp_path):
+    directory = tmp_path / 'templates'
+    shutil.copytree(mrg.DEFAULT_TEMPLATES_DIR, directory)
+    (directory / 'zh' / 'review_header.md').write_text('# {序号}. {歌曲名} - 乐评\n\n- 表演者: {表演者}\n',
+                                                      encoding='utf-8')
+    mrg.use_templates(str(directory))
+    yield
+    mrg.use_templates()
+
+
+def test_markdown_export_renders_headers_using_any_column(tmp_path, numbered_header_templates):
+    review = {'path': 'OK Computer.md', '歌曲名': 'OK Computer', '表演者': 'Radiohead', '发行时间': '1997',
+              '流派': '摇滚', '专辑类型': '专辑', '介质': 'CD', '评分': '9.5', 'body': '好听。'}
+    output_path = tmp_path / 'export.md'
+    assert mrg.export_reviews([review], str(output_path)) == 1
+    exported = output_path.read_text(encoding='utf-8')
+    assert '# . OK Computer - 乐评' in exported
+    assert '- 表演者: Radiohead' in exported
+    assert '好听。' in exported
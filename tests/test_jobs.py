@@ -0,0 +1,20 @@
+"""Job submissions in the `serve` mode"""
+import pytest
+
+import music_review_generator as mrg
+
+
+def test_submission_without_a_rank_is_numbered_by_its_job(tmp_path):
+    queue = mrg.JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    queue.submit(mrg.parse_job_entry({'歌曲名': 'OK Computer', '表演者': 'Radiohead', '序号': '5'}))
+    music_info = mrg.parse_job_entry({'title': '叶惠美', 'artist': '周杰伦'})
+    job, coalesced = queue.submit(music_info)
+    assert not coalesced
+    assert job['music_info']['序号'] == str(job['id']) == '2'
+    assert queue.claim(2)[1] == (job['id'], job['music_info'])
+    queue.close()
+
+
+def test_submission_needs_a_title():
+    with pytest.raises(ValueError, match='歌曲名'):
+        mrg.parse_job_entry({'表演者': '周杰伦'})
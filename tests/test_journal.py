@@ -0,0 +1,29 @@
+"""Resume journal keys"""
+import json
+
+import music_review_generator as mrg
+
+MUSIC_INFO = {'序号': '1', '歌曲名': 'OK Computer', '表演者': 'Radiohead'}
+
+
+def test_reranked_entry_is_still_done(tmp_path):
+    review_path = tmp_path / 'OK Computer.md'
+    review_path.write_text('review', encoding='utf-8')
+    journal = mrg.RunJournal(str(tmp_path / 'journal.jsonl'))
+    journal.record(MUSIC_INFO, 'done', 'hash', str(review_path))
+    journal.close()
+    reopened = mrg.RunJournal(str(tmp_path / 'journal.jsonl'))
+    assert reopened.current_output(dict(MUSIC_INFO, 序号='7'), 'hash') == str(review_path)
+    assert reopened.current_output(dict(MUSIC_INFO, 序号='1', 表演者='Someone Else'), 'hash') is None
+    reopened.close()
+
+
+def test_legacy_keys_are_still_read(tmp_path):
+    review_path = tmp_path / 'OK Computer.md'
+    review_path.write_text('review', encoding='utf-8')
+    journal_path = tmp_path / 'journal.jsonl'
+    journal_path.write_text(json.dumps({'entry': '1:OK Computer', 'status': 'done', 'prompt_hash': 'hash',
+                                        'output': str(review_path), 'time': 0}) + '\n', encoding='utf-8')
+    journal = mrg.RunJournal(str(journal_path))
+    assert journal.current_output(MUSIC_INFO, 'hash') == str(review_path)
+    journal.close()
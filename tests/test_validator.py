@@ -0,0 +1,48 @@
+"""ReviewValidator against the reviews checked into musicComments/"""
+import glob
+import os
+
+import pytest
+
+import music_review_generator as mrg
+
+REVIEW_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "musicComments")
+REVIEW_FILES = sorted(glob.glob(os.path.join(REVIEW_DIR, "*.md")))
+
+
+def read_body(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return mrg.split_review_file(f.read())[1]
+
+
+def test_there_are_real_reviews_to_check():
+    assert len(REVIEW_FILES) >= 20
+
+
+@pytest.mark.parametrize("path", REVIEW_FILES, ids=os.path.basename)
+def test_real_review_passes_validation(path):
+    _, problems = mrg.ReviewValidator('zh').check(read_body(path))
+    assert problems == []
+
+
+@pytest.mark.parametrize("path", REVIEW_FILES, ids=os.path.basename)
+def test_normalisation_keeps_hard_line_breaks(path):
+    body = read_body(path)
+    normalized, _ = mrg.ReviewValidator('zh').check(body)
+    hard_breaks = [line.rstrip() for line in body.split('\n') if line.endswith('  ') and line.strip()]
+    kept = {line.rstrip() for line in normalized.split('\n') if line.endswith('  ')}
+    assert all(line in kept or mrg.TAG_LINE_PATTERN.match(line) for line in hard_breaks)
+    # Normalising twice changes nothing
+    assert mrg.ReviewValidator('zh').check(normalized)[0] == normalized
+
+
+def test_emoji_led_title_and_emoji_ending():
+    body = "🎶 **夜空中最亮的星**\n\n" + "这是一段足够长的乐评正文。" * 30 + "✨\n\n#逃跑计划 #摇滚"
+    _, problems = mrg.ReviewValidator('zh').check(body)
+    assert 'missing_title' not in problems
+    assert 'truncated' not in problems
+
+
+def test_cut_off_review_is_still_truncated():
+    body = "# 标题\n\n" + "这是一段足够长的乐评正文。" * 30 + "然后它突然\n\n#话题 #乐评"
+    assert 'truncated' in mrg.ReviewValidator('zh').check(body)[1]